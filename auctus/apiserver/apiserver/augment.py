@@ -11,12 +11,14 @@ import zipfile
 from datamart_augmentation.augmentation import AugmentationError
 from datamart_core.augment import augment
 from datamart_core.common import hash_json, contextdecorator
-from datamart_core.materialize import get_dataset, make_zip_recursive
+from datamart_core.materialize import get_dataset, get_dataset_sidecar, \
+    make_zip_recursive, parquet_sidecar_enabled
 from datamart_core.prom import PromMeasureRequest
 from datamart_fslock.cache import cache_get, cache_get_or_set
 from datamart_materialize import make_writer
 
 from .base import BUCKETS, BaseHandler
+from .executor import ExecutorQueueFull
 from .graceful_shutdown import GracefulHandler
 from .profile import ProfilePostedData, get_data_profile_from_es, \
     profile_token_re
@@ -51,8 +53,37 @@ PROM_AUGMENT_RESULT = PromMeasureRequest(
 )
 
 
+def read_file(path):
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+def augment_in_worker(
+    data, newdata, data_profile, task, destination, *,
+    format, format_options, columns,
+):
+    """Perform augmentation, in a worker process.
+
+    :param data: the input data, either as bytes or the path to a CSV file
+    """
+    with contextlib.ExitStack() as stack:
+        if isinstance(data, bytes):
+            data_file = io.BytesIO(data)
+        else:
+            data_file = stack.enter_context(open(data, 'rb'))
+        writer = make_writer(destination, format, format_options)
+        augment(
+            data_file,
+            newdata,
+            data_profile,
+            task,
+            writer,
+            columns=columns,
+        )
+
+
 class Augment(BaseHandler, GracefulHandler, ProfilePostedData):
-    @PROM_AUGMENT.sync()
+    @PROM_AUGMENT.async_()
     @contextdecorator(contextlib.ExitStack, 'stack')
     async def post(self, stack):
         format, format_options, format_ext = self.read_format('d3m')
@@ -93,6 +124,28 @@ class Augment(BaseHandler, GracefulHandler, ProfilePostedData):
             columns = json.loads(columns)
 
         logger.info("Got augmentation, content-type=%r", type_.split(';')[0])
+        try:
+            async with self.application.executors.limit('augment'):
+                return await self._augment(
+                    stack,
+                    task=task,
+                    data=data,
+                    data_id=data_id,
+                    columns=columns,
+                    session_id=session_id,
+                    format=format,
+                    format_options=format_options,
+                    format_ext=format_ext,
+                )
+        except ExecutorQueueFull:
+            return await self.send_busy_error()
+
+    async def _augment(
+        self, stack, *, task, data, data_id, columns, session_id,
+        format, format_options, format_ext,
+    ):
+        executors = self.application.executors
+
         with tracer.start_as_current_span(
             'augment',
             attributes={
@@ -108,7 +161,8 @@ class Augment(BaseHandler, GracefulHandler, ProfilePostedData):
                     "(either 'data' or 'data_id')",
                 )
             elif data_id is not None:
-                data_profile = get_data_profile_from_es(
+                data_profile = await executors.run_in_thread(
+                    get_data_profile_from_es,
                     self.application.elasticsearch,
                     data_id,
                 )
@@ -123,19 +177,22 @@ class Augment(BaseHandler, GracefulHandler, ProfilePostedData):
                         pass
                     else:
                         if profile_token_re.match(data_token):
-                            data = stack.enter_context(cache_get(
-                                '/cache/user_data',
-                                data_token,
-                            ))
+                            data = await executors.run_in_thread(
+                                stack.enter_context,
+                                cache_get('/cache/user_data', data_token),
+                            )
                             if data is None:
                                 return await self.send_error_json(
                                     404,
                                     "Data token expired",
                                 )
                             else:
-                                with open(data, 'rb') as fp:
-                                    data = fp.read()
-                data_profile, data_hash = self.handle_data_parameter(data)
+                                data = await executors.run_in_thread(
+                                    read_file, data,
+                                )
+                data_profile, data_hash = await self.handle_data_parameter(
+                    data,
+                )
             else:
                 return await self.send_error_json(400, "Missing 'data'")
 
@@ -146,7 +203,8 @@ class Augment(BaseHandler, GracefulHandler, ProfilePostedData):
             if 'augmentation' not in task or task['augmentation']['type'] == 'none':
                 logger.info("No task, searching for augmentations")
                 with tracer.start_as_current_span('augment/search'):
-                    search_results = get_augmentation_search_results(
+                    search_results = await executors.run_in_thread(
+                        get_augmentation_search_results,
                         es=self.application.elasticsearch,
                         lazo_client=self.application.lazo_client,
                         data_profile=data_profile,
@@ -178,31 +236,39 @@ class Augment(BaseHandler, GracefulHandler, ProfilePostedData):
                 format_options=format_options,
             )
 
+            # Runs in a thread, the join itself runs in a worker process
             def create_aug(cache_temp):
                 with contextlib.ExitStack() as stack:
                     stack.enter_context(tracer.start_as_current_span('augment/join'))
 
-                    # Get augmentation data
-                    newdata = stack.enter_context(
-                        get_dataset(metadata, task['id'], format='csv'),
-                    )
+                    # Get augmentation data, typed Parquet if enabled (it
+                    # is read exactly like the CSV)
+                    if parquet_sidecar_enabled():
+                        newdata = stack.enter_context(
+                            get_dataset_sidecar(metadata, task['id']),
+                        )
+                    else:
+                        newdata = stack.enter_context(
+                            get_dataset(metadata, task['id'], format='csv'),
+                        )
                     # Get input data if it's a reference to a dataset
                     if data_id:
-                        path = stack.enter_context(
+                        data_input = stack.enter_context(
                             get_dataset(data_profile, data_id, format='csv'),
                         )
-                        data_file = stack.enter_context(open(path, 'rb'))
                     else:
-                        data_file = io.BytesIO(data)
+                        data_input = data
                     # Perform augmentation
-                    writer = make_writer(cache_temp, format, format_options)
                     logger.info("Performing augmentation with supplied data")
-                    augment(
-                        data_file,
+                    executors.call_in_process(
+                        augment_in_worker,
+                        data_input,
                         newdata,
                         data_profile,
                         task,
-                        writer,
+                        cache_temp,
+                        format=format,
+                        format_options=format_options,
                         columns=columns,
                     )
 
@@ -217,31 +283,36 @@ class Augment(BaseHandler, GracefulHandler, ProfilePostedData):
                             os.rename(zip_name, cache_temp)
 
             try:
-                with cache_get_or_set('/cache/aug', key, create_aug) as path:
-                    if session_id:
-                        self.application.redis.rpush(
-                            'session:' + session_id,
-                            json.dumps(
-                                {
-                                    'type': task['augmentation']['type'],
-                                    'url': '/augment/' + key,
-                                },
-                                # Compact
-                                sort_keys=True, indent=None, separators=(',', ':'),
-                            )
-                        )
-                        return await self.send_json({
-                            'success': "attached to session",
-                        })
-                    else:
-                        # send the file
-                        return await self.send_file(
-                            path,
-                            name='augmentation' + (format_ext or ''),
-                        )
+                path = await executors.run_in_thread(
+                    stack.enter_context,
+                    cache_get_or_set('/cache/aug', key, create_aug),
+                )
             except AugmentationError as e:
                 return await self.send_error_json(400, str(e))
 
+            if session_id:
+                await executors.run_in_thread(
+                    self.application.redis.rpush,
+                    'session:' + session_id,
+                    json.dumps(
+                        {
+                            'type': task['augmentation']['type'],
+                            'url': '/augment/' + key,
+                        },
+                        # Compact
+                        sort_keys=True, indent=None, separators=(',', ':'),
+                    ),
+                )
+                return await self.send_json({
+                    'success': "attached to session",
+                })
+            else:
+                # send the file
+                return await self.send_file(
+                    path,
+                    name='augmentation' + (format_ext or ''),
+                )
+
 
 class AugmentResult(BaseHandler):
     @PROM_AUGMENT_RESULT.sync()
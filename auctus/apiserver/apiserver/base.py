@@ -1,8 +1,13 @@
 import aio_pika
 import asyncio
+from datetime import datetime
+import email.utils
+import functools
 import logging
 import json
 import os
+import re
+import time
 from tornado.httpclient import AsyncHTTPClient
 from tornado.iostream import StreamClosedError
 from tornado.web import HTTPError, RequestHandler
@@ -13,12 +18,20 @@ from datamart_core.common import log_future
 from datamart_geo import GeoData
 from datamart_materialize import get_writer
 
+from .executor import Executors, SingleFlight
 from .graceful_shutdown import GracefulApplication
 
 
 logger = logging.getLogger(__name__)
 
 
+# Buffer sizes used to send files
+SEND_BUFSIZE_MIN = 65536  # 64 kB
+SEND_BUFSIZE_MAX = 4194304  # 4 MB
+
+_re_range = re.compile(r'^bytes=([0-9]*)-([0-9]*)$')
+
+
 BUCKETS = [
     0.5, 1.0, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0,
     float('inf'),
@@ -60,6 +73,61 @@ class BaseHandler(RequestHandler):
         self.set_status(status)
         return self.send_json({'error': message})
 
+    def send_busy_error(self):
+        """Reject a request because the executors' queue is full.
+        """
+        self.set_header('Retry-After', '10')
+        return self.send_error_json(
+            429,
+            "Too many requests are being processed, try again later",
+        )
+
+    def get_request_range(self, size, etag, mtime):
+        """Get the byte range requested with the Range header, if any.
+
+        :return: ``(start, end)`` with `end` exclusive, or None to send the
+            whole file
+        :raises ValueError: if the range can't be satisfied
+        """
+        range_header = self.request.headers.get('Range')
+        if not range_header:
+            return None
+
+        # Only use the range if the file didn't change
+        if_range = self.request.headers.get('If-Range')
+        if if_range:
+            if if_range.startswith(('"', 'W/')):
+                if if_range != etag:
+                    return None
+            else:
+                try:
+                    date = email.utils.parsedate_to_datetime(if_range)
+                except (TypeError, ValueError):
+                    return None
+                if date.timestamp() != int(mtime):
+                    return None
+
+        # Only a single range is supported, ignore others
+        m = _re_range.match(range_header)
+        if m is None:
+            return None
+        start, end = m.groups()
+        if not start:
+            if not end:
+                return None
+            # Suffix range, last N bytes
+            start = max(size - int(end, 10), 0)
+            end = size
+        else:
+            start = int(start, 10)
+            if end:
+                end = min(int(end, 10) + 1, size)
+            else:
+                end = size
+        if start >= end:
+            raise ValueError
+        return start, end
+
     async def send_file(self, path, name):
         if zipfile.is_zipfile(path):
             type_ = 'application/zip'
@@ -70,32 +138,85 @@ class BaseHandler(RequestHandler):
         self.set_header('X-Content-Type-Options', 'nosniff')
         self.set_header('Content-Disposition',
                         'attachment; filename="%s"' % name)
+        self.set_header('Accept-Ranges', 'bytes')
         logger.info("Sending file...")
         with open(path, 'rb') as fp:
-            self.set_header('Content-Length', fp.seek(0, 2))
-            fp.seek(0, 0)
+            stat = os.fstat(fp.fileno())
+            size = stat.st_size
+            etag = '"%x-%x"' % (stat.st_mtime_ns, size)
+            self.set_header('ETag', etag)
+            self.set_header(
+                'Last-Modified',
+                datetime.utcfromtimestamp(int(stat.st_mtime)),
+            )
+            if self.check_etag_header():
+                self.set_status(304)
+                return await self.finish()
 
-            BUFSIZE = 40960
-            buf = fp.read(BUFSIZE)
             try:
-                while buf:
-                    self.write(buf)
-                    if len(buf) != BUFSIZE:
+                range_ = self.get_request_range(size, etag, stat.st_mtime)
+            except ValueError:
+                self.set_header('Content-Range', 'bytes */%d' % size)
+                return await self.send_error_json(
+                    416,
+                    "Requested range not satisfiable",
+                )
+            if range_ is None:
+                start, end = 0, size
+            else:
+                start, end = range_
+                self.set_status(206)
+                self.set_header(
+                    'Content-Range',
+                    'bytes %d-%d/%d' % (start, end - 1, size),
+                )
+            self.set_header('Content-Length', end - start)
+            fp.seek(start, 0)
+
+            # Read the next buffer in a thread while sending the current one,
+            # growing it as long as the client keeps up
+            read = functools.partial(
+                self.application.executors.run_in_thread,
+                fp.read,
+            )
+            bufsize = SEND_BUFSIZE_MIN
+            remaining = end - start
+            next_buf = read(min(bufsize, remaining))
+            try:
+                while remaining > 0:
+                    buf = await next_buf
+                    next_buf = None
+                    if not buf:
+                        logger.error("File is shorter than expected")
                         break
-                    buf = fp.read(BUFSIZE)
+                    remaining -= len(buf)
+                    if remaining > 0:
+                        next_buf = read(min(bufsize, remaining))
+                    self.write(buf)
+                    flush_start = time.perf_counter()
                     await self.flush()
+                    if (
+                        bufsize < SEND_BUFSIZE_MAX
+                        and time.perf_counter() - flush_start < 0.05
+                    ):
+                        bufsize *= 2
                 return await self.finish()
             except StreamClosedError:
                 return
+            finally:
+                # Don't close the file while it's being read
+                if next_buf is not None:
+                    await asyncio.wait([next_buf])
 
     def prepare(self):
         super(BaseHandler, self).prepare()
         self.set_header('Access-Control-Allow-Origin', '*')
         self.set_header('Access-Control-Allow-Methods', 'POST')
-        self.set_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.set_header('Access-Control-Allow-Headers', 'Content-Type, Range')
         self.set_header(
             'Access-Control-Expose-Headers',
-            'Content-Type, Content-Length, Content-Disposition',
+            'Content-Type, Content-Length, Content-Disposition, '
+            'Content-Range, Accept-Ranges',
         )
 
     def options(self):
@@ -164,6 +285,11 @@ class Application(GracefulApplication):
         self.geo_data = GeoData.from_local_cache()
         self.channel = None
 
+        # Pools for blocking work, see executor.py
+        self.executors = Executors()
+        # Concurrent profiling of the same data, see ProfilePostedData
+        self.profile_flights = SingleFlight('profile')
+
         self.custom_fields = {}
         custom_fields = os.environ.get('CUSTOM_FIELDS', None)
         if custom_fields:
@@ -0,0 +1,280 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import multiprocessing
+import opentelemetry.context
+import opentelemetry.propagate
+import os
+import prometheus_client
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+PROM_EXECUTOR_RUNNING = prometheus_client.Gauge(
+    'executor_running_count',
+    "Number of requests currently running blocking work, per endpoint",
+    ['endpoint'],
+    multiprocess_mode='livesum',
+)
+PROM_EXECUTOR_QUEUED = prometheus_client.Gauge(
+    'executor_queued_count',
+    "Number of requests waiting to run blocking work, per endpoint",
+    ['endpoint'],
+    multiprocess_mode='livesum',
+)
+PROM_EXECUTOR_REJECTED = prometheus_client.Counter(
+    'executor_rejected_count',
+    "Number of requests rejected because the queue was full, per endpoint",
+    ['endpoint'],
+)
+PROM_EXECUTOR_WAIT = prometheus_client.Histogram(
+    'executor_wait_seconds',
+    "Time requests waited in the queue, per endpoint",
+    ['endpoint'],
+    buckets=[0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+             float('inf')],
+)
+PROM_SINGLEFLIGHT_COALESCED = prometheus_client.Counter(
+    'singleflight_coalesced_count',
+    "Number of requests that shared a computation already in flight",
+    ['name'],
+)
+
+
+# Default (concurrency, queue size) for each endpoint
+DEFAULT_LIMITS = {
+    'profile': (2, 8),
+    'augment': (2, 8),
+    'search': (4, 16),
+}
+
+
+# Using the 'fork' method causes deadlocks because other threads hold locks
+_mp_context = multiprocessing.get_context('spawn')
+
+
+class ExecutorQueueFull(Exception):
+    """Too many requests are already waiting to run on the executors.
+    """
+
+
+class _EndpointLimit(object):
+    def __init__(self, endpoint, concurrency, queue_size):
+        self.endpoint = endpoint
+        self.queue_size = queue_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queued = 0
+
+        PROM_EXECUTOR_RUNNING.labels(endpoint).set(0)
+        PROM_EXECUTOR_QUEUED.labels(endpoint).set(0)
+        PROM_EXECUTOR_REJECTED.labels(endpoint).inc(0)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        if self.semaphore.locked():
+            if self.queued >= self.queue_size:
+                PROM_EXECUTOR_REJECTED.labels(self.endpoint).inc()
+                raise ExecutorQueueFull(self.endpoint)
+        self.queued += 1
+        PROM_EXECUTOR_QUEUED.labels(self.endpoint).inc()
+        start = time.perf_counter()
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.queued -= 1
+            PROM_EXECUTOR_QUEUED.labels(self.endpoint).dec()
+        PROM_EXECUTOR_WAIT.labels(self.endpoint).observe(
+            time.perf_counter() - start,
+        )
+
+        PROM_EXECUTOR_RUNNING.labels(self.endpoint).inc()
+        try:
+            yield
+        finally:
+            PROM_EXECUTOR_RUNNING.labels(self.endpoint).dec()
+            self.semaphore.release()
+
+
+class SingleFlight(object):
+    """Coalesce concurrent computations with the same key.
+
+    While a computation is in flight, other requests for the same key wait
+    for its result (or its error) instead of starting their own.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.in_flight = {}
+
+        PROM_SINGLEFLIGHT_COALESCED.labels(name).inc(0)
+
+    async def run(self, key, func, *args, **kwargs):
+        """Await ``func(*args, **kwargs)``, or the same call already running.
+        """
+        try:
+            future = self.in_flight[key]
+        except KeyError:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        else:
+            PROM_SINGLEFLIGHT_COALESCED.labels(self.name).inc()
+            logger.info("Coalescing %s %r", self.name, key)
+
+        # If this request goes away, the others can still use the result
+        return await asyncio.shield(future)
+
+
+def _get_carrier():
+    carrier = {}
+    opentelemetry.propagate.inject(carrier)
+    return carrier
+
+
+def _run_in_context(carrier, func, args, kwargs):
+    # Continue the trace of the parent process
+    token = opentelemetry.context.attach(
+        opentelemetry.propagate.extract(carrier),
+    )
+    try:
+        return func(*args, **kwargs)
+    finally:
+        opentelemetry.context.detach(token)
+
+
+class Executors(object):
+    """Bounded executors for the blocking work of the API server.
+
+    CPU-bound work (profiling, augmentation) runs in a pool of processes, and
+    blocking I/O (Elasticsearch, Redis, locking the caches) in a pool of
+    threads, so that the event loop keeps serving other requests.
+
+    Requests take a slot for their endpoint with :meth:`limit` before running
+    anything. When all the slots are taken and too many requests are already
+    waiting, :class:`ExecutorQueueFull` is raised, which handlers turn into a
+    429 response.
+
+    Configured from the environment:
+
+    * ``APISERVER_PROCESSES``: number of worker processes (default 2)
+    * ``APISERVER_THREADS``: number of worker threads (default 16)
+    * ``APISERVER_LIMITS``: JSON object mapping endpoints to
+      ``[concurrency, queue_size]``, overriding `DEFAULT_LIMITS`
+    """
+    def __init__(self):
+        processes = int(os.environ.get('APISERVER_PROCESSES', '') or 2)
+        threads = int(os.environ.get('APISERVER_THREADS', '') or 16)
+
+        limits = dict(DEFAULT_LIMITS)
+        env_limits = os.environ.get('APISERVER_LIMITS', '')
+        if env_limits:
+            for endpoint, value in json.loads(env_limits).items():
+                if (
+                    not isinstance(value, list)
+                    or len(value) != 2
+                    or not all(isinstance(v, int) and v > 0 for v in value)
+                ):
+                    raise ValueError("Invalid limits for %s" % endpoint)
+                limits[endpoint] = tuple(value)
+        logger.info(
+            "Executors: %d processes, %d threads, limits: %s",
+            processes, threads,
+            ", ".join(
+                "%s=%d/%d" % (endpoint, concurrency, queue_size)
+                for endpoint, (concurrency, queue_size) in limits.items()
+            ),
+        )
+
+        self.process_pool = concurrent.futures.ProcessPoolExecutor(
+            processes,
+            mp_context=_mp_context,
+        )
+        self.thread_pool = concurrent.futures.ThreadPoolExecutor(
+            threads,
+            thread_name_prefix='apiserver',
+        )
+        self.limits = {
+            endpoint: _EndpointLimit(endpoint, concurrency, queue_size)
+            for endpoint, (concurrency, queue_size) in limits.items()
+        }
+
+    def limit(self, endpoint):
+        """Wait for a slot to run blocking work for an endpoint.
+
+        Use as an async context manager.
+
+        :raises ExecutorQueueFull: if too many requests are already waiting
+        """
+        return self.limits[endpoint].acquire()
+
+    def run_in_thread(self, func, *args, **kwargs):
+        # Keep the context, for tracing
+        context = contextvars.copy_context()
+        return asyncio.get_event_loop().run_in_executor(
+            self.thread_pool,
+            functools.partial(context.run, func, *args, **kwargs),
+        )
+
+    def run_in_process(self, func, *args, **kwargs):
+        # Send the context, for tracing
+        return asyncio.get_event_loop().run_in_executor(
+            self.process_pool,
+            functools.partial(
+                _run_in_context, _get_carrier(), func, args, kwargs,
+            ),
+        )
+
+    def call_in_process(self, func, *args, **kwargs):
+        """Run a function in the process pool from a worker thread.
+        """
+        return self.process_pool.submit(
+            _run_in_context, _get_carrier(), func, args, kwargs,
+        ).result()
+
+    def shutdown(self):
+        self.process_pool.shutdown(wait=False)
+        self.thread_pool.shutdown(wait=False)
+
+
+_worker_resources = None
+_worker_lazo_client = None
+
+
+def worker_resources():
+    """Get the resources that the profiler needs, in a worker process.
+
+    They are created the first time this is called in each process. The Lazo
+    client is separate, see `worker_lazo_client()`.
+    """
+    global _worker_resources
+
+    if _worker_resources is None:
+        from datamart_geo import GeoData
+
+        _worker_resources = dict(
+            geo_data=GeoData.from_local_cache(),
+            nominatim=os.environ.get('NOMINATIM_URL') or None,
+        )
+    return _worker_resources
+
+
+def worker_lazo_client():
+    """Get the Lazo client, in a worker process.
+
+    It is only created when needed, fast profiles don't use it.
+    """
+    global _worker_lazo_client
+
+    if _worker_lazo_client is None:
+        import lazo_index_service
+
+        _worker_lazo_client = lazo_index_service.LazoIndexClient(
+            host=os.environ['LAZO_SERVER_HOST'],
+            port=int(os.environ['LAZO_SERVER_PORT']),
+        )
+    return _worker_lazo_client
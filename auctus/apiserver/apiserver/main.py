@@ -13,7 +13,8 @@ from tornado.routing import Rule, PathMatches, URLSpec
 import tornado.httputil
 import tornado.web
 
-from datamart_core.common import PrefixedElasticsearch, setup_logging
+from datamart_core.common import PrefixedElasticsearch, setup_logging, \
+    start_metrics_server
 from datamart_core.objectstore import get_object_store
 from datamart_core.prom import PromMeasureRequest
 import datamart_profiler
@@ -226,7 +227,7 @@ def main():
     debug = os.environ.get('AUCTUS_DEBUG') not in (
         None, '', 'no', 'off', 'false',
     )
-    prometheus_client.start_http_server(8000)
+    start_metrics_server(8000)
     logger.info(
         "Startup: apiserver %s %s",
         os.environ['DATAMART_VERSION'],
@@ -240,4 +241,7 @@ def main():
     loop = tornado.ioloop.IOLoop.current()
     if debug:
         asyncio.get_event_loop().set_debug(True)
-    loop.start()
+    try:
+        loop.start()
+    finally:
+        app.executors.shutdown()
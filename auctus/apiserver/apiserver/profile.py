@@ -16,6 +16,8 @@ from datamart_materialize.detect import detect_format_convert_to_csv
 from datamart_profiler import process_dataset
 
 from .base import BUCKETS, BaseHandler
+from .executor import ExecutorQueueFull, worker_lazo_client, \
+    worker_resources
 from .graceful_shutdown import GracefulHandler
 
 
@@ -36,11 +38,38 @@ PROM_PROFILE = PromMeasureRequest(
 )
 
 
+def profile_in_worker(csv_path, *, fast=False):
+    """Profile a dataset, in a worker process.
+    """
+    resources = worker_resources()
+    with open(csv_path, 'rb') as data:
+        if fast:
+            return process_dataset(
+                data=data,
+                geo_data=resources['geo_data'],
+                include_sample=True,
+                search=True, coverage=False, plots=False,
+            )
+        else:
+            return process_dataset(
+                data=data,
+                lazo_client=worker_lazo_client(),
+                nominatim=resources['nominatim'],
+                geo_data=resources['geo_data'],
+                search=True,
+                include_sample=True,
+                coverage=True,
+            )
+
+
 class ProfilePostedData(tornado.web.RequestHandler):
-    def handle_data_parameter(self, data, *, fast=False):
+    async def handle_data_parameter(self, data, *, fast=False):
         """
         Handles the 'data' parameter.
 
+        The blocking work happens on the application's executors, the caller
+        should hold a slot from `Executors.limit()`.
+
         :param data: the input parameter
         :param fast: whether to perform "fast" profiling, unsuitable for search
         :return: (data, data_profile)
@@ -51,17 +80,24 @@ class ProfilePostedData(tornado.web.RequestHandler):
         if not isinstance(data, bytes):
             raise ValueError
 
+        executors = self.application.executors
+        redis = self.application.redis
+
         # Use SHA1 of file as cache key
         sha1 = hashlib.sha1(data)
         data_hash = sha1.hexdigest()
 
         if fast:
-            data_profile = (
-                self.application.redis.get('profile-fast:' + data_hash)
-                or self.application.redis.get('profile:' + data_hash)
+            cached_profile = await executors.run_in_thread(
+                lambda: (
+                    redis.get('profile-fast:' + data_hash)
+                    or redis.get('profile:' + data_hash)
+                ),
             )
         else:
-            data_profile = self.application.redis.get('profile:' + data_hash)
+            cached_profile = await executors.run_in_thread(
+                redis.get, 'profile:' + data_hash,
+            )
 
         # Do format conversion
         materialize = {}
@@ -87,73 +123,55 @@ class ProfilePostedData(tornado.web.RequestHandler):
             )
             assert ret == cache_temp
 
-        with cache_get_or_set(
-            '/cache/user_data',
-                data_hash,
-                create_csv,
-        ) as csv_path:
-            if data_profile is not None:
-                # This is here because we want to put the data in the cache
-                # even if the profile is already in Redis
-                logger.info("Found cached profile_data")
-                data_profile = json.loads(data_profile)
-            elif fast:
-                with tracer.start_as_current_span(
-                    'profile-userdata',
-                    attributes={'hash': data_hash, 'fast': True},
-                ):
-                    logger.info("Profiling (fast)...")
-                    start = time.perf_counter()
-                    with open(csv_path, 'rb') as data:
-                        data_profile = process_dataset(
-                            data=data,
-                            geo_data=self.application.geo_data,
-                            include_sample=True,
-                            search=True, coverage=False, plots=False,
-                        )
-                    logger.info("Profiled (fast) in %.2fs", time.perf_counter() - start)
-
-                data_profile['materialize'] = materialize
-                data_profile['version'] = os.environ['DATAMART_VERSION']
+        # Runs in a thread
+        def get_profile():
+            with cache_get_or_set(
+                '/cache/user_data',
+                    data_hash,
+                    create_csv,
+            ) as csv_path:
+                if cached_profile is not None:
+                    # This is here because we want to put the data in the
+                    # cache even if the profile is already in Redis
+                    logger.info("Found cached profile_data")
+                    return json.loads(cached_profile)
 
-                self.application.redis.set(
-                    'profile-fast:' + data_hash,
-                    json.dumps(
-                        data_profile,
-                        # Compact
-                        sort_keys=True, indent=None, separators=(',', ':'),
-                    ),
-                )
-            else:
                 with tracer.start_as_current_span(
                     'profile-userdata',
-                    attributes={'hash': data_hash, 'fast': False},
+                    attributes={'hash': data_hash, 'fast': fast},
                 ):
-                    logger.info("Profiling...")
+                    logger.info("Profiling%s...", " (fast)" if fast else "")
                     start = time.perf_counter()
-                    with open(csv_path, 'rb') as data:
-                        data_profile = process_dataset(
-                            data=data,
-                            lazo_client=self.application.lazo_client,
-                            nominatim=self.application.nominatim,
-                            geo_data=self.application.geo_data,
-                            search=True,
-                            include_sample=True,
-                            coverage=True,
-                        )
-                    logger.info("Profiled in %.2fs", time.perf_counter() - start)
+                    data_profile = executors.call_in_process(
+                        profile_in_worker,
+                        csv_path,
+                        fast=fast,
+                    )
+                    logger.info(
+                        "Profiled%s in %.2fs",
+                        " (fast)" if fast else "",
+                        time.perf_counter() - start,
+                    )
 
                 data_profile['materialize'] = materialize
                 data_profile['version'] = os.environ['DATAMART_VERSION']
 
-                self.application.redis.set(
-                    'profile:' + data_hash,
+                redis.set(
+                    ('profile-fast:' if fast else 'profile:') + data_hash,
                     json.dumps(
                         data_profile,
                         # Compact
                         sort_keys=True, indent=None, separators=(',', ':'),
                     ),
                 )
+                return data_profile
+
+        # Identical data being profiled concurrently is only profiled once
+        data_profile = await self.application.profile_flights.run(
+            (data_hash, fast),
+            executors.run_in_thread,
+            get_profile,
+        )
 
         return data_profile, data_hash
 
@@ -188,56 +206,62 @@ class Profile(BaseHandler, GracefulHandler, ProfilePostedData):
     def initialize(self, *, fast=False):
         self.fast = fast
 
-    @PROM_PROFILE.sync()
-    def post(self):
+    @PROM_PROFILE.async_()
+    async def post(self):
         data = self.get_body_argument('data', None)
         if 'data' in self.request.files:
             data = self.request.files['data'][0].body
         elif data is not None:
             data = data.encode('utf-8')
 
-        if len(data) == 40:
+        if data is not None and len(data) == 40:
             try:
                 data_hash = data.decode('ascii')
             except UnicodeDecodeError:
                 pass
             else:
                 if profile_token_re.match(data_hash):
+                    redis = self.application.redis
                     if self.fast:
-                        data_profile = self.application.redis.get(
-                            'profile-fast:' + data_hash,
-                        )
+                        data_profile = await self.application.executors \
+                            .run_in_thread(redis.get, 'profile-fast:' + data_hash)
                         if data_profile:
-                            return self.send_json(dict(
+                            return await self.send_json(dict(
                                 json.loads(data_profile),
                                 token=data_hash,
                             ))
 
-                    data_profile = self.application.redis.get(
-                        'profile:' + data_hash,
-                    )
+                    data_profile = await self.application.executors \
+                        .run_in_thread(redis.get, 'profile:' + data_hash)
                     if data_profile:
-                        return self.send_json(dict(
+                        return await self.send_json(dict(
                             json.loads(data_profile),
                             token=data_hash,
                         ))
                     else:
-                        return self.send_error_json(
+                        return await self.send_error_json(
                             404,
                             "Data profile token expired",
                         )
 
         if data is None:
-            return self.send_error_json(
+            return await self.send_error_json(
                 400,
                 "Please send 'data' as a file, using multipart/form-data",
             )
 
         logger.info("Got profile")
 
-        data_profile, data_hash = self.handle_data_parameter(data, fast=self.fast)
+        try:
+            async with self.application.executors.limit('profile'):
+                data_profile, data_hash = await self.handle_data_parameter(
+                    data,
+                    fast=self.fast,
+                )
+        except ExecutorQueueFull:
+            return await self.send_busy_error()
 
-        return self.send_json(dict(
+        return await self.send_json(dict(
             data_profile,
             token=data_hash,
         ))
@@ -13,6 +13,7 @@ from datamart_profiler.temporal import parse_date, temporal_aggregation_keys
 
 from ..base import BUCKETS, BaseHandler
 from ..enhance_metadata import enhance_metadata
+from ..executor import ExecutorQueueFull
 from ..graceful_shutdown import GracefulHandler
 from ..profile import ProfilePostedData, get_data_profile_from_es, \
     profile_token_re
@@ -421,8 +422,8 @@ def get_augmentation_search_results(
 
 
 class Search(BaseHandler, GracefulHandler, ProfilePostedData):
-    @PROM_SEARCH.sync()
-    def post(self):
+    @PROM_SEARCH.async_()
+    async def post(self):
         type_ = self.request.headers.get('Content-Type', '')
         data = None
         data_id = None
@@ -458,13 +459,15 @@ class Search(BaseHandler, GracefulHandler, ProfilePostedData):
             if data_profile is not None:
                 # Data profile can optionally be just the hash
                 if len(data_profile) == 40 and profile_token_re.match(data_profile):
-                    data_profile = self.application.redis.get(
-                        'profile:' + data_profile,
-                    )
+                    data_profile = await self.application.executors \
+                        .run_in_thread(
+                            self.application.redis.get,
+                            'profile:' + data_profile,
+                        )
                     if data_profile:
                         data_profile = json.loads(data_profile)
                     else:
-                        return self.send_error_json(
+                        return await self.send_error_json(
                             404,
                             "Data profile token expired",
                         )
@@ -476,7 +479,7 @@ class Search(BaseHandler, GracefulHandler, ProfilePostedData):
             query = None
             data = self.request.body
         else:
-            return self.send_error_json(
+            return await self.send_error_json(
                 400,
                 "Either use multipart/form-data to send the 'query' JSON and "
                 "'data' file (or 'data_profile' JSON), or use "
@@ -485,7 +488,7 @@ class Search(BaseHandler, GracefulHandler, ProfilePostedData):
             )
 
         if sum(1 for e in [data, data_id, data_profile] if e is not None) > 1:
-            return self.send_error_json(
+            return await self.send_error_json(
                 400,
                 "Please only provide one input dataset (either 'data', " +
                 "'data_id', or  'data_profile')",
@@ -497,6 +500,20 @@ class Search(BaseHandler, GracefulHandler, ProfilePostedData):
                     ', data' if data else '',
                     ', data_id' if data_id else '',
                     ', data_profile' if data_profile else '')
+        try:
+            async with self.application.executors.limit('search'):
+                return await self._search(
+                    query=query,
+                    data=data,
+                    data_id=data_id,
+                    data_profile=data_profile,
+                )
+        except ExecutorQueueFull:
+            return await self.send_busy_error()
+
+    async def _search(self, *, query, data, data_id, data_profile):
+        executors = self.application.executors
+
         with tracer.start_as_current_span(
             'search',
             attributes={
@@ -508,16 +525,17 @@ class Search(BaseHandler, GracefulHandler, ProfilePostedData):
         ):
             # parameter: data
             if data is not None:
-                data_profile, _ = self.handle_data_parameter(data)
+                data_profile, _ = await self.handle_data_parameter(data)
 
             # parameter: data_id
             if data_id:
-                data_profile = get_data_profile_from_es(
+                data_profile = await executors.run_in_thread(
+                    get_data_profile_from_es,
                     self.application.elasticsearch,
                     data_id,
                 )
                 if data_profile is None:
-                    return self.send_error_json(400, "No such dataset")
+                    return await self.send_error_json(400, "No such dataset")
 
             # parameter: query
             query_args_main = list()
@@ -533,21 +551,21 @@ class Search(BaseHandler, GracefulHandler, ProfilePostedData):
                         tabular_variables,
                     ) = parse_query(query, self.application.geo_data)
                 except ClientError as e:
-                    return self.send_error_json(400, str(e))
+                    return await self.send_error_json(400, str(e))
                 if 'augmentation_type' in query:
                     if query['augmentation_type'] == 'join':
                         search_unions = False
                     elif query['augmentation_type'] == 'union':
                         search_joins = False
                     else:
-                        return self.send_error_json(
+                        return await self.send_error_json(
                             400,
                             "Unknown augmentation_type",
                         )
 
             # At least one of them must be provided
             if not query_args_main and not data_profile:
-                return self.send_error_json(
+                return await self.send_error_json(
                     400,
                     "At least one of 'data' or 'query' must be provided",
                 )
@@ -560,7 +578,7 @@ class Search(BaseHandler, GracefulHandler, ProfilePostedData):
                 except ValueError:
                     page = -1
                 if page < 1:
-                    return self.send_error_json(400, "Invalid page number")
+                    return await self.send_error_json(400, "Invalid page number")
             size = self.get_query_argument('size', None)
             if size is not None:
                 try:
@@ -568,15 +586,16 @@ class Search(BaseHandler, GracefulHandler, ProfilePostedData):
                 except ValueError:
                     size = -1
                 if size < 1 or size > 100:
-                    return self.send_error_json(400, "Invalid size")
+                    return await self.send_error_json(400, "Invalid size")
 
             if not data_profile:
                 page = page or 1
                 size = size or TOP_K_SIZE
                 if page * size > 10000:
-                    return self.send_error_json(400, "Can't scroll past 10000 items")
+                    return await self.send_error_json(400, "Can't scroll past 10000 items")
 
-                response = self.application.elasticsearch.search(
+                response = await executors.run_in_thread(
+                    self.application.elasticsearch.search,
                     index='datasets',
                     body={
                         'query': {
@@ -644,11 +663,12 @@ class Search(BaseHandler, GracefulHandler, ProfilePostedData):
                     total = response['hits']['total']['value']
             else:
                 if page or size:
-                    return self.send_error_json(
+                    return await self.send_error_json(
                         400,
                         "Pagination is not yet supported for augmentation search",
                     )
-                results = get_augmentation_search_results(
+                results = await executors.run_in_thread(
+                    get_augmentation_search_results,
                     self.application.elasticsearch,
                     self.application.lazo_client,
                     data_profile,
@@ -677,4 +697,4 @@ class Search(BaseHandler, GracefulHandler, ProfilePostedData):
                 response['facets'] = aggs
             if total is not None:
                 response['total'] = total
-            return self.send_json(response)
+            return await self.send_json(response)
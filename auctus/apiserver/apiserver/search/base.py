@@ -1,3 +1,24 @@
+import contextlib
+import logging
+import opentelemetry.trace
+import prometheus_client
+import time
+
+from ..base import BUCKETS
+
+
+logger = logging.getLogger(__name__)
+tracer = opentelemetry.trace.get_tracer(__name__)
+
+
+PROM_SEARCH_PHASE = prometheus_client.Histogram(
+    'search_phase_seconds',
+    "Time spent in each phase of augmentation search",
+    ['phase'],
+    buckets=BUCKETS,
+)
+
+
 TOP_K_SIZE = 50
 
 
@@ -18,3 +39,34 @@ def get_column_identifiers(es, column_names, dataset_id=None, data_profile=None)
             if columns[i]['name'] == column_names[j]:
                 column_indices[j] = i
     return column_indices
+
+
+class PhaseTimer(object):
+    """Measures the time spent in each phase of a search.
+
+    Phases are recorded in Prometheus and as tracing spans, and the totals
+    can be logged at the end.
+    """
+    def __init__(self):
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            with tracer.start_as_current_span('search/%s' % name):
+                yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            PROM_SEARCH_PHASE.labels(name).observe(elapsed)
+
+    def log(self, what):
+        logger.info(
+            "%s timings: %s",
+            what,
+            ', '.join(
+                '%s=%.3fs' % (name, elapsed)
+                for name, elapsed in self.timings.items()
+            ) or 'nothing',
+        )
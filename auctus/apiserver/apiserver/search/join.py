@@ -1,10 +1,11 @@
+import concurrent.futures
 import logging
 import textwrap
 
 from datamart_core import types
 from datamart_profiler.temporal import temporal_aggregation_keys
 
-from .base import TOP_K_SIZE, get_column_identifiers
+from .base import TOP_K_SIZE, PhaseTimer, get_column_identifiers
 
 
 logger = logging.getLogger(__name__)
@@ -13,6 +14,9 @@ logger = logging.getLogger(__name__)
 MAX_LAZO_CANDIDATES_SIZE = 300
 """Maximum number of Lazo hits to send back to Elasticsearch"""
 
+MAX_CONCURRENT_QUERIES = 8
+"""Maximum number of concurrent Lazo queries for each search"""
+
 
 temporal_resolutions_priorities = {
     n: i
@@ -147,11 +151,14 @@ def get_lazo_sketches(data_profile, filter_=None):
     return lazo_sketches
 
 
-def get_numerical_join_search_results(
-    es, type_, type_value, pivot_column, ranges, dataset_id=None, ignore_datasets=None,
+def get_numerical_join_query(
+    type_, type_value, pivot_column, ranges, dataset_id=None, ignore_datasets=None,
     query_sup_functions=None, query_sup_filters=None,
 ):
-    """Retrieve numerical join search results that intersect with the input numerical ranges.
+    """Build the query for numerical join search results that intersect with
+    the input numerical ranges.
+
+    :return: ``(index, body)``
     """
 
     filter_query = []
@@ -244,20 +251,17 @@ def get_numerical_join_search_results(
         }
     }
 
-    return es.search(
-        index='columns',
-        body=body,
-        size=TOP_K_SIZE,
-        request_timeout=30,
-    )['hits']['hits']
+    return 'columns', body
 
 
-def get_spatial_join_search_results(
-    es, ranges, dataset_id=None, ignore_datasets=None,
+def get_spatial_join_query(
+    ranges, dataset_id=None, ignore_datasets=None,
     query_sup_functions=None, query_sup_filters=None,
 ):
-    """Retrieve spatial join search results that intersect
+    """Build the query for spatial join search results that intersect
     with the input spatial ranges.
+
+    :return: ``(index, body)``
     """
 
     filter_query = []
@@ -350,20 +354,17 @@ def get_spatial_join_search_results(
         }
     }
 
-    return es.search(
-        index='spatial_coverage',
-        body=body,
-        size=TOP_K_SIZE,
-        request_timeout=30,
-    )['hits']['hits']
+    return 'spatial_coverage', body
 
 
-def get_temporal_join_search_results(
-    es, ranges, dataset_id=None, ignore_datasets=None,
+def get_temporal_join_query(
+    ranges, dataset_id=None, ignore_datasets=None,
     query_sup_functions=None, query_sup_filters=None,
 ):
-    """Retrieve temporal join search results that intersect
+    """Build the query for temporal join search results that intersect
     with the input temporal ranges.
+
+    :return: ``(index, body)``
     """
 
     filter_query = []
@@ -451,22 +452,41 @@ def get_temporal_join_search_results(
         }
     }
 
+    return 'temporal_coverage', body
+
+
+def _search_hits(es, query):
+    index, body = query
     return es.search(
-        index='temporal_coverage',
+        index=index,
         body=body,
         size=TOP_K_SIZE,
         request_timeout=30,
     )['hits']['hits']
 
 
-def get_textual_join_search_results(
-    es, query_results,
-    query_sup_functions=None, query_sup_filters=None,
-):
-    """Combine Lazo textual search results with Elasticsearch
-    (keyword search).
+def get_numerical_join_search_results(es, *args, **kwargs):
+    """Retrieve numerical join search results that intersect with the input
+    numerical ranges.
+    """
+    return _search_hits(es, get_numerical_join_query(*args, **kwargs))
+
+
+def get_spatial_join_search_results(es, *args, **kwargs):
+    """Retrieve spatial join search results that intersect
+    with the input spatial ranges.
     """
+    return _search_hits(es, get_spatial_join_query(*args, **kwargs))
 
+
+def get_temporal_join_search_results(es, *args, **kwargs):
+    """Retrieve temporal join search results that intersect
+    with the input temporal ranges.
+    """
+    return _search_hits(es, get_temporal_join_query(*args, **kwargs))
+
+
+def _group_lazo_results(query_results):
     scores_per_dataset = dict()
     column_per_dataset = dict()
     for d_id, name, lazo_score in query_results:
@@ -475,31 +495,54 @@ def get_textual_join_search_results(
             scores_per_dataset[d_id] = dict()
         column_per_dataset[d_id].append(name)
         scores_per_dataset[d_id][name] = lazo_score
+    return column_per_dataset, scores_per_dataset
 
-    # if there is no keyword query
-    if not (query_sup_functions or query_sup_filters):
-        results = list()
-        for dataset_id in column_per_dataset:
-            column_indices = get_column_identifiers(
-                es=es,
-                column_names=column_per_dataset[dataset_id],
-                dataset_id=dataset_id
-            )
-            for j in range(len(column_indices)):
-                column_name = column_per_dataset[dataset_id][j]
-                results.append(
-                    dict(
-                        _score=scores_per_dataset[dataset_id][column_name],
-                        _source=dict(
-                            dataset_id=dataset_id,
-                            name=column_name,
-                            index=column_indices[j]
-                        )
+
+def get_textual_join_results_from_columns(query_results, dataset_columns):
+    """Turn Lazo textual search results into join search results, when there
+    is no keyword query.
+
+    :param dataset_columns: Dictionary mapping dataset IDs to their
+        documents (only ``columns.name`` is needed), as returned by
+        `PrefixedElasticsearch.mget()`
+    """
+    column_per_dataset, scores_per_dataset = _group_lazo_results(
+        query_results,
+    )
+    results = list()
+    for dataset_id in column_per_dataset:
+        if dataset_id not in dataset_columns:
+            logger.warning("Lazo returned unknown dataset %r", dataset_id)
+            continue
+        column_indices = get_column_identifiers(
+            es=None,
+            column_names=column_per_dataset[dataset_id],
+            data_profile=dataset_columns[dataset_id]['_source'],
+        )
+        for j in range(len(column_indices)):
+            column_name = column_per_dataset[dataset_id][j]
+            results.append(
+                dict(
+                    _score=scores_per_dataset[dataset_id][column_name],
+                    _source=dict(
+                        dataset_id=dataset_id,
+                        name=column_name,
+                        index=column_indices[j]
                     )
                 )
-        return results
+            )
+    return results
 
-    # if there is a keyword query
+
+def get_textual_join_query(
+    query_results,
+    query_sup_functions=None, query_sup_filters=None,
+):
+    """Build the query combining Lazo textual search results with
+    Elasticsearch (keyword search).
+
+    :return: ``(index, body)``
+    """
     should_query = list()
     for d_id, name, lazo_score in query_results:
         should_query.append(
@@ -546,12 +589,30 @@ def get_textual_join_search_results(
         }
     }
 
-    return es.search(
-        index='columns',
-        body=body,
-        size=TOP_K_SIZE,
-        request_timeout=30,
-    )['hits']['hits']
+    return 'columns', body
+
+
+def get_textual_join_search_results(
+    es, query_results,
+    query_sup_functions=None, query_sup_filters=None,
+):
+    """Combine Lazo textual search results with Elasticsearch
+    (keyword search).
+    """
+    # if there is no keyword query
+    if not (query_sup_functions or query_sup_filters):
+        column_per_dataset, _ = _group_lazo_results(query_results)
+        return get_textual_join_results_from_columns(
+            query_results,
+            es.mget('datasets', column_per_dataset, _source='columns.name'),
+        )
+
+    # if there is a keyword query
+    return _search_hits(es, get_textual_join_query(
+        query_results,
+        query_sup_functions,
+        query_sup_filters,
+    ))
 
 
 def get_joinable_datasets(
@@ -562,6 +623,10 @@ def get_joinable_datasets(
     """
     Retrieve datasets that can be joined with an input dataset.
 
+    The searches for each column are sent together (using msearch), while the
+    Lazo queries run concurrently, and the metadata of the results is fetched
+    in a single request (using mget).
+
     :param es: Elasticsearch client.
     :param lazo_client: client for the Lazo Index Server
     :param data_profile: Profiled input dataset.
@@ -571,6 +636,7 @@ def get_joinable_datasets(
     :param query_sup_filters: list of query filters over sup index.
     :param tabular_variables: specifies which columns to focus on for the search.
     """
+    timer = PhaseTimer()
 
     # get the coverage for each column of the input dataset
     column_coverage = get_column_coverage(
@@ -578,55 +644,54 @@ def get_joinable_datasets(
         tabular_variables,
     )
 
-    # search results
-    search_results = list()
-
     # numerical, temporal, and spatial attributes
+    # List of (fields to add to results, query)
+    coverage_queries = []
     for column, coverage in column_coverage.items():
         type_ = coverage['type']
         type_value = coverage.get('type_value')
         if type_ == 'spatial':
             if 'ranges' in coverage:
-                spatial_results = get_spatial_join_search_results(
-                    es,
+                coverage_queries.append((
+                    {'companion_column': column},
+                    get_spatial_join_query(
+                        coverage['ranges'],
+                        dataset_id,
+                        ignore_datasets,
+                        query_sup_functions,
+                        query_sup_filters,
+                    ),
+                ))
+        elif type_ == 'temporal':
+            coverage_queries.append((
+                {
+                    'companion_column': column,
+                    'companion_temporal_resolution':
+                        coverage['temporal_resolution'],
+                },
+                get_temporal_join_query(
                     coverage['ranges'],
                     dataset_id,
                     ignore_datasets,
                     query_sup_functions,
                     query_sup_filters,
-                )
-                for result in spatial_results:
-                    result['companion_column'] = column
-                    search_results.append(result)
-        elif type_ == 'temporal':
-            temporal_results = get_temporal_join_search_results(
-                es,
-                coverage['ranges'],
-                dataset_id,
-                ignore_datasets,
-                query_sup_functions,
-                query_sup_filters,
-            )
-            for result in temporal_results:
-                result['companion_column'] = column
-                result['companion_temporal_resolution'] = coverage['temporal_resolution']
-                search_results.append(result)
+                ),
+            ))
         elif len(column) == 1:
             column_name = data_profile['columns'][column[0]]['name']
-            numerical_results = get_numerical_join_search_results(
-                es,
-                type_,
-                type_value,
-                column_name,
-                coverage['ranges'],
-                dataset_id,
-                ignore_datasets,
-                query_sup_functions,
-                query_sup_filters,
-            )
-            for result in numerical_results:
-                result['companion_column'] = column
-                search_results.append(result)
+            coverage_queries.append((
+                {'companion_column': column},
+                get_numerical_join_query(
+                    type_,
+                    type_value,
+                    column_name,
+                    coverage['ranges'],
+                    dataset_id,
+                    ignore_datasets,
+                    query_sup_functions,
+                    query_sup_filters,
+                ),
+            ))
         else:
             raise ValueError("Unknown coverage from multiple columns?")
 
@@ -635,12 +700,49 @@ def get_joinable_datasets(
         data_profile,
         tabular_variables,
     )
-    for column, (n_permutations, hash_values, cardinality) in lazo_sketches.items():
-        query_results = lazo_client.query_lazo_sketch_data(
+
+    def search_coverage():
+        if not coverage_queries:
+            return []
+        with timer.phase('join_coverage'):
+            return es.msearch(
+                [
+                    (index, dict(body, size=TOP_K_SIZE))
+                    for _, (index, body) in coverage_queries
+                ],
+                request_timeout=30,
+            )
+
+    def query_lazo(sketch):
+        n_permutations, hash_values, cardinality = sketch
+        return lazo_client.query_lazo_sketch_data(
             n_permutations,
             hash_values,
             cardinality
         )
+
+    # Run the coverage searches while querying Lazo
+    with concurrent.futures.ThreadPoolExecutor(
+        MAX_CONCURRENT_QUERIES,
+        thread_name_prefix='search',
+    ) as executor:
+        coverage_future = executor.submit(search_coverage)
+        with timer.phase('join_lazo'):
+            lazo_results = list(executor.map(
+                query_lazo,
+                lazo_sketches.values(),
+            ))
+        coverage_responses = coverage_future.result()
+
+    # search results
+    search_results = list()
+    for (fields, _), response in zip(coverage_queries, coverage_responses):
+        for result in response['hits']['hits']:
+            result.update(fields)
+            search_results.append(result)
+
+    textual_queries = []
+    for column, query_results in zip(lazo_sketches, lazo_results):
         if dataset_id:
             query_results = [
                 res for res in query_results if res[0] == dataset_id
@@ -651,15 +753,52 @@ def get_joinable_datasets(
             ]
         if not query_results:
             continue
-        textual_results = get_textual_join_search_results(
-            es,
-            query_results[:MAX_LAZO_CANDIDATES_SIZE],
-            query_sup_functions,
-            query_sup_filters,
+        textual_queries.append(
+            (column, query_results[:MAX_LAZO_CANDIDATES_SIZE]),
         )
-        for result in textual_results:
-            result['companion_column'] = column
-            search_results.append(result)
+
+    if textual_queries:
+        with timer.phase('join_textual'):
+            if not (query_sup_functions or query_sup_filters):
+                # Get the column names of all the candidates at once
+                dataset_columns = es.mget(
+                    'datasets',
+                    {
+                        res[0]
+                        for _, query_results in textual_queries
+                        for res in query_results
+                    },
+                    _source='columns.name',
+                )
+                textual_results = [
+                    get_textual_join_results_from_columns(
+                        query_results,
+                        dataset_columns,
+                    )
+                    for _, query_results in textual_queries
+                ]
+            else:
+                responses = es.msearch(
+                    [
+                        (index, dict(body, size=TOP_K_SIZE))
+                        for index, body in (
+                            get_textual_join_query(
+                                query_results,
+                                query_sup_functions,
+                                query_sup_filters,
+                            )
+                            for _, query_results in textual_queries
+                        )
+                    ],
+                    request_timeout=30,
+                )
+                textual_results = [
+                    response['hits']['hits'] for response in responses
+                ]
+        for (column, _), results in zip(textual_queries, textual_results):
+            for result in results:
+                result['companion_column'] = column
+                search_results.append(result)
 
     search_results = sorted(
         search_results,
@@ -667,10 +806,21 @@ def get_joinable_datasets(
         reverse=True
     )
 
+    # Get the metadata of all the datasets at once
+    with timer.phase('join_metadata'):
+        metadata = es.mget(
+            'datasets',
+            {result['_source']['dataset_id'] for result in search_results},
+        )
+
     results = []
     for result in search_results:
         dt = result['_source']['dataset_id']
-        meta = es.get('datasets', dt)['_source']
+        try:
+            meta = metadata[dt]['_source']
+        except KeyError:
+            logger.warning("Join result for unknown dataset %r", dt)
+            continue
         left_columns = []
         right_columns = []
         left_columns_names = []
@@ -718,4 +868,5 @@ def get_joinable_datasets(
             res['augmentation']['temporal_resolution'] = join_resolution
         results.append(res)
 
+    timer.log("Join search")
     return results
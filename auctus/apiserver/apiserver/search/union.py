@@ -1,7 +1,7 @@
 from collections import Counter
 import logging
 
-from .base import get_column_identifiers
+from .base import PhaseTimer, get_column_identifiers
 
 
 logger = logging.getLogger(__name__)
@@ -69,6 +69,8 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
     :param tabular_variables: specifies which columns to focus on for the search.
     """
 
+    timer = PhaseTimer()
+
     main_dataset_columns = get_columns_by_type(
         data_profile=data_profile,
         filter_=tabular_variables
@@ -78,7 +80,8 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
     for type_ in main_dataset_columns:
         n_columns += len(main_dataset_columns[type_])
 
-    column_pairs = dict()
+    # Build the query for each column
+    column_queries = []
     for type_ in main_dataset_columns:
         for att in main_dataset_columns[type_]:
             partial_query = {
@@ -134,17 +137,27 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
                     }
                 }
             }
+            column_queries.append((att, query_obj))
+
+    # Get the first page for all columns at once
+    with timer.phase('union_columns'):
+        if column_queries:
+            responses = es.msearch(
+                [
+                    ('datasets', dict(query_obj, size=PAGINATION_SIZE))
+                    for _, query_obj in column_queries
+                ],
+                request_timeout=30,
+            )
+        else:
+            responses = []
 
+        column_pairs = dict()
+        for (att, query_obj), response in zip(column_queries, responses):
+            hits = response['hits']['hits']
             # FIXME: Use search-after API here?
             from_ = 0
             while True:
-                hits = es.search(
-                    index='datasets',
-                    body=query_obj,
-                    from_=from_,
-                    size=PAGINATION_SIZE,
-                    request_timeout=30
-                )['hits']['hits']
                 from_ += len(hits)
 
                 for hit in hits:
@@ -166,6 +179,15 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
                 if len(hits) != PAGINATION_SIZE:
                     break
 
+                # Get the next page
+                hits = es.search(
+                    index='datasets',
+                    body=query_obj,
+                    from_=from_,
+                    size=PAGINATION_SIZE,
+                    request_timeout=30
+                )['hits']['hits']
+
     scores = dict()
     for dataset in list(column_pairs.keys()):
 
@@ -203,9 +225,22 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
         reverse=True
     )
 
+    # Get the metadata of all the datasets at once
+    with timer.phase('union_metadata'):
+        metadata = es.mget(
+            'datasets',
+            {dt for dt, _ in sorted_datasets} | (
+                {dataset_id} if dataset_id else set()
+            ),
+        )
+
     results = []
     for dt, score in sorted_datasets:
-        meta = es.get('datasets', dt)['_source']
+        try:
+            meta = metadata[dt]['_source']
+        except KeyError:
+            logger.warning("Union result for unknown dataset %r", dt)
+            continue
         # TODO: augmentation information is incorrect
         left_columns = []
         right_columns = []
@@ -214,7 +249,10 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
         for att_1, att_2, sim, es_score in column_pairs[dt]:
             if dataset_id:
                 left_columns.append(
-                    get_column_identifiers(es, [att_1], dataset_id=dataset_id)
+                    get_column_identifiers(
+                        es, [att_1],
+                        data_profile=metadata[dataset_id]['_source'],
+                    )
                 )
             else:
                 left_columns.append(
@@ -222,7 +260,7 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
                 )
             left_columns_names.append([att_1])
             right_columns.append(
-                get_column_identifiers(es, [att_2], dataset_id=dt)
+                get_column_identifiers(es, [att_2], data_profile=meta)
             )
             right_columns_names.append([att_2])
         results.append(dict(
@@ -238,4 +276,5 @@ def get_unionable_datasets(es, data_profile, dataset_id=None, ignore_datasets=No
             }
         ))
 
+    timer.log("Union search")
     return results
@@ -2,10 +2,12 @@ import asyncio
 from datetime import datetime
 import json
 import logging
+import os
 import prometheus_client
+import tempfile
 import uuid
 
-from datamart_core.common import json2msg
+from datamart_core.common import PROFILE_PRIORITY_USER, profile_message
 from datamart_core.materialize import advocate_session
 from datamart_core.objectstore import get_object_store
 from datamart_core.prom import PromMeasureRequest
@@ -29,6 +31,17 @@ PROM_UPLOAD = PromMeasureRequest(
 )
 
 
+def store_upload(dataset_id, body):
+    """Write an uploaded file to shared storage.
+    """
+    object_store = get_object_store()
+    with tempfile.TemporaryDirectory(prefix='datamart_upload_') as tmp:
+        path = os.path.join(tmp, 'data')
+        with open(path, 'wb') as fp:
+            fp.write(body)
+        object_store.upload_from('datasets', dataset_id, path)
+
+
 class Upload(BaseHandler):
     @PROM_UPLOAD.async_()
     async def post(self):
@@ -75,11 +88,12 @@ class Upload(BaseHandler):
                 metadata['manual_annotations'] = manual_annotations
 
             dataset_id = 'datamart.upload.%s' % uuid.uuid4().hex
+            size = len(file.body)
 
             # Write file to shared storage
-            object_store = get_object_store()
-            with object_store.open('datasets', dataset_id, 'wb') as fp:
-                fp.write(file.body)
+            await self.application.executors.run_in_thread(
+                store_upload, dataset_id, file.body,
+            )
             await asyncio.sleep(3)  # Object store is eventually consistent
         elif self.get_body_argument('address', None):
             # Check the URL
@@ -109,6 +123,7 @@ class Upload(BaseHandler):
             # Set 'direct_url'
             metadata['materialize']['direct_url'] = address
             dataset_id = 'datamart.url.%s' % uuid.uuid4().hex
+            size = len(response.content)
         else:
             return await self.send_error_json(400, "No file")
 
@@ -127,13 +142,12 @@ class Upload(BaseHandler):
 
         # Publish to the profiling queue
         await self.application.profile_exchange.publish(
-            json2msg(
-                dict(
-                    id=dataset_id,
-                    metadata=metadata,
-                ),
-                # Lower priority than on-demand datasets, but higher than base
-                priority=1,
+            profile_message(
+                dataset_id,
+                metadata,
+                # Someone is waiting, but big files still go to the large queue
+                PROFILE_PRIORITY_USER,
+                size,
             ),
             '',
         )
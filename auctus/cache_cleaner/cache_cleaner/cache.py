@@ -1,11 +1,13 @@
 import asyncio
+import json
 import logging
 import os
 import prometheus_client
 import socket
 
 from datamart_core.common import log_future, setup_logging
-from datamart_fslock.cache import clear_cache
+
+from .eviction import CacheIndex
 
 
 logger = logging.getLogger(__name__)
@@ -37,108 +39,132 @@ PROM_CACHE_USER_DATASETS_BYTES = prometheus_client.Gauge(
 )
 
 
+PROM_CACHE_HIT_RATIO = prometheus_client.Gauge(
+    'cache_hit_ratio',
+    "Ratio of entries used to entries created since the last scan, per "
+    "cache directory",
+    ['cache_dir'],
+)
+PROM_CACHE_BUDGET_BYTES = prometheus_client.Gauge(
+    'cache_budget_bytes',
+    "Size limit, per cache directory",
+    ['cache_dir'],
+)
+PROM_CACHE_EVICTED = prometheus_client.Counter(
+    'cache_evicted_count',
+    "Number of entries evicted, per cache directory",
+    ['cache_dir'],
+)
+PROM_CACHE_EVICTED_BYTES = prometheus_client.Counter(
+    'cache_evicted_bytes',
+    "Total size of entries evicted, per cache directory",
+    ['cache_dir'],
+)
+
+
 CACHE_HIGH = os.environ.get('MAX_CACHE_BYTES')
 CACHE_HIGH = int(CACHE_HIGH, 10) if CACHE_HIGH else 100000000000  # 100 GB
-CACHE_LOW = CACHE_HIGH * 0.33
+CACHE_LOW_RATIO = 0.33
+CACHE_LOW = CACHE_HIGH * CACHE_LOW_RATIO
 
 CACHES = ('/cache/datasets', '/cache/aug', '/cache/user_data')
 
-
-def get_tree_size(path):
-    if os.path.isfile(path):
-        return os.path.getsize(path)
-    size = 0
-    for dirpath, _, filenames in os.walk(path):
-        for filename in filenames:
-            try:
-                size += os.path.getsize(os.path.join(dirpath, filename))
-            except OSError:
-                pass
-    return size
-
-
-def clear_caches():
-    logger.warning("Cache size over limit, clearing")
-
-    # Build list of all entries
-    temp_size = 0
-    entries = []
-    for cache in CACHES:
-        for name in os.listdir(cache):
-            path = os.path.join(cache, name)
-            if name.endswith('.temp'):
-                temp_size += get_tree_size(path)
-            elif name.endswith('.cache'):
-                key = name[:-6]
-                stat = os.stat(path)
-                entries.append((cache, key, get_tree_size(path), stat.st_mtime))
-
-    # Sort it by date
-    entries = sorted(entries, key=lambda e: -e[3])
-
-    # Select entries to keep while staying under threshold
-    keep = {cache: set() for cache in CACHES}
-    total_size = temp_size
-    for cache, key, size, mtime in entries:
-        if total_size + size <= CACHE_LOW:
-            keep[cache].add(key)
-            total_size += size
-
-    for cache in CACHES:
-        clear_cache(
-            cache,
-            should_delete=lambda key, keep_set=keep[cache]: key not in keep_set,
+CACHE_INDEX = '/cache/index.json'
+
+CACHE_METRICS = {
+    '/cache/datasets': (PROM_CACHE_DATASETS, PROM_CACHE_DATASETS_BYTES),
+    '/cache/aug': (PROM_CACHE_AUGMENTATIONS, PROM_CACHE_AUGMENTATIONS_BYTES),
+    '/cache/user_data': (
+        PROM_CACHE_USER_DATASETS, PROM_CACHE_USER_DATASETS_BYTES,
+    ),
+}
+
+
+def get_budgets():
+    """Read the size limit of each cache directory from $CACHE_BUDGETS.
+
+    It is a JSON object mapping directory names to bytes, for example
+    ``{"datasets": 50000000000, "aug": 10000000000}``.
+    """
+    budgets = {}
+    env_budgets = os.environ.get('CACHE_BUDGETS', '')
+    if env_budgets:
+        for name, value in json.loads(env_budgets).items():
+            cache_dir = os.path.join('/cache', name)
+            if cache_dir not in CACHES:
+                raise ValueError("Unknown cache directory %r" % name)
+            if not isinstance(value, int) or value <= 0:
+                raise ValueError("Invalid budget for cache %r" % name)
+            budgets[cache_dir] = value
+    return budgets
+
+
+def record_evictions(freed):
+    for cache_dir, (nb_entries, nb_bytes) in freed.items():
+        PROM_CACHE_EVICTED.labels(cache_dir).inc(nb_entries)
+        PROM_CACHE_EVICTED_BYTES.labels(cache_dir).inc(nb_bytes)
+        logger.warning(
+            "Evicted %d entries from %s, %d bytes",
+            nb_entries, cache_dir, nb_bytes,
         )
 
 
-def measure_cache_dir(dirname):
-    entries = 0
-    size_bytes = 0
-    for name in os.listdir(dirname):
-        path = os.path.join(dirname, name)
-        if not name.endswith(('.cache', '.temp')):
-            continue
-        entries += 1
-        size_bytes += get_tree_size(path)
-    return entries, size_bytes
-
-
-def check_cache():
-    try:
-        # Count datasets in cache
-        datasets, datasets_bytes = measure_cache_dir('/cache/datasets')
-        PROM_CACHE_DATASETS.set(datasets)
-        PROM_CACHE_DATASETS_BYTES.set(datasets_bytes)
-        logger.info("%d datasets in cache, %d bytes",
-                    datasets, datasets_bytes)
-
-        # Count augmentations in cache
-        augmentations, augmentations_bytes = measure_cache_dir('/cache/aug')
-        PROM_CACHE_AUGMENTATIONS.set(augmentations)
-        PROM_CACHE_AUGMENTATIONS_BYTES.set(augmentations_bytes)
-        logger.info("%d augmentations in cache, %d bytes",
-                    augmentations, augmentations_bytes)
-
-        # Count user datasets in cache
-        user_datasets, user_data_bytes = measure_cache_dir('/cache/user_data')
-        PROM_CACHE_USER_DATASETS.set(user_datasets)
-        PROM_CACHE_USER_DATASETS_BYTES.set(user_data_bytes)
-        logger.info("%d user datasets in cache, %d bytes",
-                    user_datasets, user_data_bytes)
-
-        # Remove from caches if max is reached
-        if datasets_bytes + augmentations_bytes > CACHE_HIGH:
-            fut = asyncio.get_event_loop().run_in_executor(
-                None,
-                clear_caches,
+def update_caches(index, budgets):
+    # Measure the caches
+    results = {}
+    for cache_dir in CACHES:
+        result = results[cache_dir] = index.scan(cache_dir)
+        count_metric, bytes_metric = CACHE_METRICS[cache_dir]
+        count_metric.set(result.entries + result.temp_entries)
+        bytes_metric.set(result.bytes + result.temp_bytes)
+        if result.hit_ratio is not None:
+            PROM_CACHE_HIT_RATIO.labels(cache_dir).set(result.hit_ratio)
+        logger.info(
+            "%s: %d entries, %d bytes, %d hits, %d created",
+            cache_dir,
+            result.entries, result.bytes, result.hits, result.misses,
+        )
+
+    # Remove from each cache if its budget is reached
+    for cache_dir, budget in budgets.items():
+        result = results[cache_dir]
+        size = result.bytes + result.temp_bytes
+        if size > budget:
+            logger.warning("Cache %s over budget, evicting", cache_dir)
+            freed = index.evict(
+                [cache_dir],
+                size - budget * CACHE_LOW_RATIO,
             )
-            log_future(fut, logger)
-    finally:
+            record_evictions(freed)
+            result.bytes -= freed[cache_dir][1]
+
+    # Remove from all caches if max is reached
+    total_size = sum(
+        result.bytes + result.temp_bytes
+        for result in results.values()
+    )
+    if total_size > CACHE_HIGH:
+        logger.warning("Cache size over limit, evicting")
+        freed = index.evict(CACHES, total_size - CACHE_LOW)
+        record_evictions(freed)
+
+    index.save()
+
+
+def check_cache(index, budgets):
+    def reschedule(future):
         asyncio.get_event_loop().call_later(
             5 * 60,
-            check_cache,
+            check_cache, index, budgets,
         )
 
+    fut = asyncio.get_event_loop().run_in_executor(
+        None,
+        update_caches, index, budgets,
+    )
+    log_future(fut, logger)
+    fut.add_done_callback(reschedule)
+
 
 def main():
     setup_logging()
@@ -154,5 +180,26 @@ def main():
     os.makedirs('/cache/aug', exist_ok=True)
     os.makedirs('/cache/user_data', exist_ok=True)
 
-    check_cache()  # Schedules itself to run periodically
+    budgets = get_budgets()
+    for cache_dir in CACHES:
+        PROM_CACHE_BUDGET_BYTES.labels(cache_dir).set(
+            budgets.get(cache_dir, CACHE_HIGH),
+        )
+        PROM_CACHE_EVICTED.labels(cache_dir).inc(0)
+        PROM_CACHE_EVICTED_BYTES.labels(cache_dir).inc(0)
+    index = CacheIndex(
+        CACHE_INDEX,
+        CACHES,
+        policy=os.environ.get('CACHE_POLICY') or 'cost',
+    )
+    logger.info(
+        "Cache policy: %s, budgets: %s",
+        index.policy,
+        ", ".join(
+            "%s=%d" % (cache_dir, budget)
+            for cache_dir, budget in budgets.items()
+        ) or "none",
+    )
+
+    check_cache(index, budgets)  # Schedules itself to run periodically
     asyncio.get_event_loop().run_forever()
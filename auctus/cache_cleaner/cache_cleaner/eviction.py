@@ -0,0 +1,209 @@
+"""Index of the cache entries, used to pick which ones to evict.
+
+For each entry in each cache directory, the index records its size, when it
+was last used (the mtime of its ``.lock`` file, which `datamart_fslock.cache`
+updates on every hit), in how many scans it was seen used, and how long it
+took to create. It is saved to disk so that it survives restarts, and so that
+the size of entries is only computed again when they change.
+
+Two policies are available to order entries for eviction:
+
+* ``lru``: least recently used first
+* ``cost``: GreedyDual-Size-Frequency, lowest ``hits * cost / size`` first,
+  where the cost is the time it took to create the entry. Entries that are
+  big, cheap to create again, or rarely used go first, and the "clock" is
+  advanced on eviction so that entries that used to be popular eventually
+  age out
+"""
+
+import json
+import logging
+import os
+
+from datamart_fslock.cache import delete_cache_entry, get_creation_time
+
+
+logger = logging.getLogger(__name__)
+
+
+POLICIES = ('lru', 'cost')
+
+# Cost of entries whose creation time is unknown, in seconds
+DEFAULT_COST = 1.0
+
+
+def get_tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return size
+
+
+class ScanResult(object):
+    def __init__(self):
+        self.entries = 0
+        self.bytes = 0
+        self.temp_entries = 0
+        self.temp_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_ratio(self):
+        if self.hits + self.misses == 0:
+            return None
+        return self.hits / (self.hits + self.misses)
+
+
+class CacheIndex(object):
+    """Persistent index of the entries of some cache directories.
+    """
+    def __init__(self, path, cache_dirs, policy='cost'):
+        if policy not in POLICIES:
+            raise ValueError("Unknown cache policy %r" % policy)
+        self.path = path
+        self.policy = policy
+
+        try:
+            with open(path) as fp:
+                data = json.load(fp)
+        except FileNotFoundError:
+            data = {}
+        except ValueError:
+            logger.warning("Invalid cache index, starting over")
+            data = {}
+        self.clock = data.get('clock', 0.0)
+        entries = data.get('entries', {})
+        self.entries = {
+            cache_dir: entries.get(cache_dir, {})
+            for cache_dir in cache_dirs
+        }
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as fp:
+            json.dump(
+                {'clock': self.clock, 'entries': self.entries},
+                fp,
+                # Compact
+                sort_keys=True, indent=None, separators=(',', ':'),
+            )
+        os.rename(temp_path, self.path)
+
+    def _priority(self, entry):
+        return (
+            self.clock
+            + entry['hits'] * entry['cost'] / max(entry['size'], 1)
+        )
+
+    def scan(self, cache_dir):
+        """Update the index from the content of a cache directory.
+
+        :return: a `ScanResult`, where ``hits`` and ``misses`` count the
+            entries that were used and created since the previous scan
+        """
+        result = ScanResult()
+        entries = self.entries[cache_dir]
+        seen = set()
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.endswith('.temp'):
+                result.temp_entries += 1
+                result.temp_bytes += get_tree_size(path)
+                continue
+            elif not name.endswith('.cache'):
+                continue
+            key = name[:-6]
+            try:
+                mtime = os.stat(path).st_mtime
+                access = os.stat(os.path.join(cache_dir, key + '.lock')) \
+                    .st_mtime
+            except FileNotFoundError:
+                # Deleted while we were looking
+                continue
+            seen.add(key)
+
+            entry = entries.get(key)
+            if entry is None or entry['mtime'] != mtime:
+                # New entry (or created again)
+                cost = get_creation_time(cache_dir, key)
+                entry = entries[key] = {
+                    'size': get_tree_size(path),
+                    'mtime': mtime,
+                    'access': access,
+                    'hits': 1,
+                    'cost': DEFAULT_COST if cost is None else cost,
+                }
+                entry['priority'] = self._priority(entry)
+                result.misses += 1
+            elif access > entry['access']:
+                # Used since the last scan
+                entry['access'] = access
+                entry['hits'] += 1
+                entry['priority'] = self._priority(entry)
+                result.hits += 1
+
+            result.entries += 1
+            result.bytes += entry['size']
+
+        # Forget entries that are gone
+        for key in entries.keys() - seen:
+            del entries[key]
+
+        return result
+
+    def evict(self, cache_dirs, target_bytes):
+        """Delete entries from the given directories to free some space.
+
+        Entries that are currently locked are skipped.
+
+        :return: a dict with the number of entries and bytes freed in each
+            directory
+        """
+        if self.policy == 'lru':
+            def sort_key(item):
+                return item[2]['access']
+        else:
+            def sort_key(item):
+                return item[2]['priority']
+
+        candidates = sorted(
+            (
+                (cache_dir, key, entry)
+                for cache_dir in cache_dirs
+                for key, entry in self.entries[cache_dir].items()
+            ),
+            key=sort_key,
+        )
+
+        freed = {cache_dir: (0, 0) for cache_dir in cache_dirs}
+        total_freed = 0
+        for cache_dir, key, entry in candidates:
+            if total_freed >= target_bytes:
+                break
+            try:
+                delete_cache_entry(cache_dir, key, timeout=0)
+            except TimeoutError:
+                logger.info("Entry is locked: %r", key)
+                continue
+            except FileNotFoundError:
+                # Already deleted
+                pass
+            logger.info(
+                "Evicted entry %r from %s, %d bytes",
+                key, cache_dir, entry['size'],
+            )
+            del self.entries[cache_dir][key]
+            nb_entries, nb_bytes = freed[cache_dir]
+            freed[cache_dir] = nb_entries + 1, nb_bytes + entry['size']
+            total_freed += entry['size']
+            if self.policy == 'cost':
+                # Age the remaining entries
+                self.clock = max(self.clock, entry['priority'])
+        return freed
@@ -16,7 +16,8 @@ import tornado.web
 from tornado.web import HTTPError
 from urllib.parse import quote_plus
 
-from datamart_core.common import PrefixedElasticsearch, json2msg, \
+from datamart_core.common import PrefixedElasticsearch, \
+    PROFILE_PRIORITY_LOW, PROFILE_PRIORITY_USER, profile_message, \
     delete_dataset_from_index, setup_logging
 
 from .coordinator import Coordinator
@@ -207,8 +208,9 @@ class ReprocessDataset(BaseHandler):
         if obj.get('manual_annotations'):
             metadata['manual_annotations'] = obj['manual_annotations']
         await self.coordinator.profile_exchange.publish(
-            json2msg(
-                dict(id=dataset_id, metadata=metadata),
+            profile_message(
+                dataset_id, metadata,
+                PROFILE_PRIORITY_USER, obj.get('size'),
             ),
             '',
         )
@@ -260,8 +262,9 @@ class QueryReprocess(BaseHandler):
             if obj.get('manual_annotations'):
                 metadata['manual_annotations'] = obj['manual_annotations']
             await self.coordinator.profile_exchange.publish(
-                json2msg(
-                    dict(id=dataset_id, metadata=metadata),
+                profile_message(
+                    dataset_id, metadata,
+                    PROFILE_PRIORITY_LOW, obj.get('size'),
                 ),
                 '',
             )
@@ -1,11 +1,15 @@
 import itertools
 import logging
 import numpy as np
+import os
 import pandas as pd
 from sklearn.neighbors._kd_tree import KDTree
+import sys
 import time
 
 from datamart_materialize import types
+from datamart_materialize.parquet import read_frames_as_csv, \
+    read_parquet_as_csv
 from datamart_profiler.spatial import median_smallest_distance
 from datamart_profiler.temporal import get_temporal_resolution, \
     temporal_aggregation_keys
@@ -336,9 +340,325 @@ def perform_aggregations(
     return data
 
 
+# Aggregation functions that need numbers
+NUMERIC_AGGREGATIONS = {'mean', 'sum', 'max', 'min'}
+
+
+class _ColumnAggregates(object):
+    """Running aggregates of a companion column, per original row.
+    """
+    def __init__(self, nb_rows):
+        # Kinds of the column's dtype in the joined chunks
+        self.kinds = set()
+        self.first = np.full(nb_rows, np.nan, dtype=object)
+        self.count = np.zeros(nb_rows, dtype=np.int64)
+        self.sum = np.zeros(nb_rows, dtype=np.float64)
+        self.min = np.full(nb_rows, np.nan, dtype=np.float64)
+        self.max = np.full(nb_rows, np.nan, dtype=np.float64)
+        # Only used if the column only ever has integers
+        self.int_sum = np.zeros(nb_rows, dtype=np.int64)
+        self.int_min = np.zeros(nb_rows, dtype=np.int64)
+        self.int_max = np.zeros(nb_rows, dtype=np.int64)
+        # The joined values, if they have to be aggregated by pandas
+        self.joined = None
+
+    def add(self, rows, values, is_first):
+        """Add the values of a joined chunk.
+
+        :param rows: The original row each value goes with
+        :param values: The values, missing for rows that were not matched
+        :param is_first: Whether each value is the first one for its row
+        """
+        kind = values.dtype.kind
+        self.kinds.add(kind)
+        if self.joined is not None:
+            self.joined.append((rows, pd.Series(values)))
+
+        self.first[rows[is_first]] = values[is_first]
+        present = ~pd.isna(values)
+        rows = rows[present]
+        values = values[present]
+
+        if self.kinds <= set('iuf') and len(rows):
+            # Reduce the values of each row, then update the aggregates
+            order = np.argsort(rows, kind='stable')
+            values = values[order]
+            sorted_rows = rows[order]
+            starts = np.flatnonzero(np.concatenate([
+                [True], sorted_rows[1:] != sorted_rows[:-1],
+            ]))
+            unique_rows = sorted_rows[starts]
+            floats = values.astype(np.float64)
+            self.sum[unique_rows] += np.add.reduceat(floats, starts)
+            self.min[unique_rows] = np.fmin(
+                self.min[unique_rows], np.minimum.reduceat(floats, starts),
+            )
+            self.max[unique_rows] = np.fmax(
+                self.max[unique_rows], np.maximum.reduceat(floats, starts),
+            )
+            if kind in 'iu':
+                new = self.count[unique_rows] == 0
+                self.int_sum[unique_rows] += np.add.reduceat(values, starts)
+                min_ = np.minimum.reduceat(values, starts)
+                self.int_min[unique_rows] = np.where(
+                    new, min_, np.minimum(self.int_min[unique_rows], min_),
+                )
+                max_ = np.maximum.reduceat(values, starts)
+                self.int_max[unique_rows] = np.where(
+                    new, max_, np.maximum(self.int_max[unique_rows], max_),
+                )
+
+        self.count += np.bincount(rows, minlength=len(self.count))
+
+    def dtype_kind(self):
+        """The kind of dtype the column has in the concatenated chunks.
+        """
+        if self.kinds <= set('iu'):
+            return 'i'
+        elif self.kinds <= set('iuf'):
+            return 'f'
+        elif self.kinds == {'b'}:
+            return 'b'
+        else:
+            return 'O'
+
+    def aggregate(self, func, rows):
+        """Get the result of an aggregation function for the given rows.
+        """
+        kind = self.dtype_kind()
+        if self.joined is not None and func in NUMERIC_AGGREGATIONS:
+            keys, values = zip(*self.joined)
+            values = pd.concat(values, ignore_index=True)
+            return values.groupby(np.concatenate(keys)).agg(
+                AGGREGATION_FUNCTIONS[func].aggfunc,
+            ).reindex(rows).values
+        elif func == 'first':
+            values = self.first[rows]
+            if kind == 'i':
+                values = values.astype(np.int64)
+            elif kind == 'f':
+                values = values.astype(np.float64)
+            elif kind == 'b':
+                values = values.astype(bool)
+            return values
+        elif func == 'count':
+            return self.count[rows]
+        elif func == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return self.sum[rows] / self.count[rows]
+        elif kind == 'i':
+            return {
+                'sum': self.int_sum,
+                'min': self.int_min,
+                'max': self.int_max,
+            }[func][rows]
+        else:
+            values = {
+                'sum': self.sum,
+                'min': self.min,
+                'max': self.max,
+            }[func][rows]
+            return np.where(self.count[rows] > 0, values, np.nan)
+
+
+class _JoinAggregator(object):
+    """Join chunks of companion data and aggregate them as they come.
+
+    This gives the same result as joining each chunk, concatenating them, and
+    calling :func:`perform_aggregations` on the result. Instead of keeping the
+    joined chunks, aggregates are kept in arrays with one entry per original
+    row (i.e. per `UNIQUE_INDEX_KEY`), so memory doesn't grow with the number
+    of matches. Only the columns that get numerical aggregation functions but
+    don't have numbers are kept, and those functions are computed by pandas.
+
+    Sums and means are computed in a different order than pandas does, so
+    they might differ in the last digits.
+    """
+    def __init__(self, original_data, how, agg_functions=None):
+        self.original_data = original_data
+        self.how = how
+        if agg_functions:
+            agg_functions = {
+                # Turn single value into list
+                col: [funcs] if isinstance(funcs, str) else funcs
+                for col, funcs in agg_functions.items()
+            }
+        self.agg_functions = agg_functions
+        self.present = np.zeros(len(original_data), dtype=bool)
+        self.columns = {}
+
+    def add_chunk(self, original_data_res, augment_data):
+        # Get the rows that DataFrame.join() would give, without the values
+        joined = original_data_res[[UNIQUE_INDEX_KEY]].join(
+            pd.DataFrame(
+                {'position': np.arange(len(augment_data))},
+                index=augment_data.index,
+            ),
+            how=self.how,
+        )
+        rows = joined[UNIQUE_INDEX_KEY].values
+        positions = joined['position'].values
+        if positions.dtype.kind == 'f':
+            # Some rows were not matched
+            positions = np.where(
+                np.isnan(positions), -1, positions,
+            ).astype(np.int64)
+
+        # Find the first value for each row
+        is_first = np.zeros(len(rows), dtype=bool)
+        is_first[np.unique(rows, return_index=True)[1]] = True
+        is_first &= ~self.present[rows]
+        self.present[rows] = True
+
+        for col in augment_data.columns:
+            values = pd.api.extensions.take(
+                augment_data[col].to_numpy(), positions,
+                allow_fill=True,
+            )
+            try:
+                aggregates = self.columns[col]
+            except KeyError:
+                aggregates = self.columns[col] = _ColumnAggregates(
+                    len(self.original_data),
+                )
+            if (
+                aggregates.joined is None
+                and values.dtype.kind not in 'iuf'
+                and self.agg_functions
+                and NUMERIC_AGGREGATIONS.intersection(
+                    self.agg_functions.get(col, ()),
+                )
+            ):
+                if aggregates.count.any():
+                    raise AugmentationError(
+                        "Can't aggregate column %r, it is not numerical" % (
+                            col,
+                        ),
+                    )
+                # No values so far (numerical aggregations skip missing
+                # values), pandas will aggregate from now on
+                aggregates.joined = []
+            aggregates.add(rows, values, is_first)
+
+    def aggregate(self, augment_columns_name):
+        """Get the aggregated data, like :func:`perform_aggregations` does.
+        """
+        start = time.perf_counter()
+        rows = np.flatnonzero(self.present)
+
+        # The original columns are the same for all matches
+        result = self.original_data.iloc[rows].reset_index(drop=True)
+        data = {}
+        for col, aggregates in self.columns.items():
+            name = augment_columns_name[col]
+            if self.agg_functions:
+                try:
+                    funcs = self.agg_functions[col]
+                except KeyError:
+                    continue
+            elif aggregates.dtype_kind() in 'if':
+                funcs = ['mean', 'sum', 'max', 'min']
+            else:
+                funcs = ['first']
+
+            for func in funcs:
+                if func not in AGGREGATION_FUNCTIONS:
+                    raise KeyError(func)
+                if func == 'first' and len(funcs) <= 1:
+                    key = name
+                else:
+                    key = '%s %s' % (func, name)
+                data[key] = aggregates.aggregate(func, rows)
+
+        result = pd.concat([result, pd.DataFrame(data)], axis=1)
+        logger.info(
+            "Aggregations completed in %.4fs",
+            time.perf_counter() - start,
+        )
+        return result
+
+
 CHUNK_SIZE_ROWS = 10000
 
 
+PARQUET_MAGIC = b'PAR1'
+
+
+def _is_arrow_table(data):
+    # If the caller has an Arrow table, pyarrow has already been imported
+    pyarrow = sys.modules.get('pyarrow')
+    return pyarrow is not None and isinstance(data, pyarrow.Table)
+
+
+def _is_parquet(data):
+    """Check whether a path or binary file object points to Parquet data.
+    """
+    if isinstance(data, (str, os.PathLike)):
+        with open(data, 'rb') as fp:
+            return fp.read(len(PARQUET_MAGIC)) == PARQUET_MAGIC
+    elif hasattr(data, 'read') and hasattr(data, 'seekable') \
+            and data.seekable():
+        pos = data.tell()
+        magic = data.read(len(PARQUET_MAGIC))
+        data.seek(pos)
+        return magic == PARQUET_MAGIC
+    else:
+        return False
+
+
+def _read_chunks(data, columns=None, **kwargs):
+    """Read companion data in chunks of `CHUNK_SIZE_ROWS`.
+
+    Arrow tables and Parquet files are read like their CSV version would be
+    (see `datamart_materialize.parquet.read_frames_as_csv()`), so the result
+    doesn't depend on the format.
+
+    :param data: An Arrow table, or a path or file object pointing to a
+        Parquet or CSV file.
+    :param columns: Names of the columns to load, in that order
+    :param kwargs: Extra arguments for ``pandas.read_csv()``
+    """
+    if _is_arrow_table(data):
+        if columns is not None:
+            data = data.select(columns)
+        return read_frames_as_csv(
+            (
+                batch.to_pandas()
+                for batch in data.to_batches(max_chunksize=CHUNK_SIZE_ROWS)
+            ),
+            data.column_names,
+            CHUNK_SIZE_ROWS,
+            **kwargs,
+        )
+    elif _is_parquet(data):
+        return read_parquet_as_csv(
+            data,
+            CHUNK_SIZE_ROWS,
+            columns=columns,
+            **kwargs,
+        )
+    else:
+        chunks = pd.read_csv(
+            data,
+            error_bad_lines=False,
+            chunksize=CHUNK_SIZE_ROWS,
+            usecols=columns,
+            **kwargs,
+        )
+        if columns is not None:
+            # usecols keeps the order of the file
+            chunks = (chunk[columns] for chunk in chunks)
+        return chunks
+
+
+def _is_data_path_or_file(data):
+    return (
+        isinstance(data, (str, os.PathLike))
+        or hasattr(data, 'read')
+        or _is_arrow_table(data)
+    )
+
+
 def _tree_nearest(tree, max_dist):
     def transform(df):
         # Convert to numeric numpy array
@@ -381,8 +701,10 @@ def join(
     agg_functions=None, temporal_resolution=None,
 ):
     """
-    Performs a join between original_data (pandas.DataFrame or path to CSV)
-    and augment_data (pandas.DataFrame) using left_columns and right_columns.
+    Performs a join between original_data (pandas.DataFrame, Arrow table, or
+    path or file object of a Parquet or CSV file) and augment_data_path (Arrow
+    table, or path to Parquet or CSV file) using left_columns and
+    right_columns. Arrow and Parquet data is read like the equivalent CSV.
 
     The result is written to the writer object.
 
@@ -391,16 +713,19 @@ def join(
 
     if isinstance(original_data, pd.DataFrame):
         pass
-    elif hasattr(original_data, 'read'):
-        original_data = pd.read_csv(
-            original_data,
-            error_bad_lines=False,
-            dtype=str,
-            na_filter=False,
+    elif _is_data_path_or_file(original_data):
+        original_data = pd.concat(
+            _read_chunks(
+                original_data,
+                dtype=str,
+                na_filter=False,
+            ),
+            ignore_index=True,
         )
     else:
         raise TypeError(
-            "join() argument 1 should be a file or a DataFrame, got "
+            "join() argument 1 should be a file, a path, a DataFrame, or an "
+            "Arrow table, got "
             "%r" % type(original_data)
         )
 
@@ -439,7 +764,7 @@ def join(
             logger.info("Using nearest spatial join, max=%r", max_dist)
             # Store transformation
             augment_columns_transform.append((
-                right,
+                [augment_data_columns[c] for c in right],
                 _tree_nearest(tree, max_dist),
             ))
 
@@ -464,32 +789,32 @@ def join(
 
     logger.info("Performing join...")
 
+    # Columns to drop
+    drop_columns = None
+    load_columns = None
+    if columns:
+        # Keep only the requested columns and the join columns
+        keep_columns = set(columns) | set(augment_join_columns_idx)
+        drop_columns = [
+            name for i, name in enumerate(augment_data_columns)
+            if i not in keep_columns
+        ]
+        # Don't even load the others if possible
+        load_columns = [
+            name for i, name in enumerate(augment_data_columns)
+            if i in keep_columns
+        ]
+
     # Stream the data in
-    augment_data_chunks = pd.read_csv(
+    augment_data_chunks = iter(_read_chunks(
         augment_data_path,
-        error_bad_lines=False,
-        chunksize=CHUNK_SIZE_ROWS,
-    )
+        columns=load_columns,
+    ))
     try:
         first_augment_data = next(augment_data_chunks)
     except StopIteration:
         raise AugmentationError("Empty augmentation data")
 
-    # Columns to drop
-    drop_columns = None
-    if columns:
-        drop_columns = list(
-            # Drop all the columns in augment_data
-            set(augment_data_columns[c] for c in columns)
-            # except
-            - (
-                # the requested columns
-                set(columns)
-                # and the join columns
-                | {col[0] for col in right_columns}
-            )
-        )
-
     # Defer temporal alignment until reading the first block from companion
     # (and converting it to the right data types!)
     update_idx = None
@@ -497,6 +822,11 @@ def join(
 
     # Streaming join
     start = time.perf_counter()
+    if how in ('left', 'inner'):
+        # Aggregate as we go, only keeping one entry per original row
+        aggregator = _JoinAggregator(original_data, how, agg_functions)
+    else:
+        aggregator = None
     join_ = []
     # Iterate over chunks of augment data
     for augment_data in itertools.chain(
@@ -504,7 +834,7 @@ def join(
     ):
         # Run transforms
         for cols, transform in augment_columns_transform:
-            augment_data.iloc[:, cols] = transform(augment_data.iloc[:, cols])
+            augment_data.loc[:, cols] = transform(augment_data.loc[:, cols])
 
         # Convert data types
         augment_data = set_data_index(
@@ -530,9 +860,15 @@ def join(
 
         # Filter columns
         if drop_columns:
-            augment_data = augment_data.drop(drop_columns, axis=1)
+            augment_data = augment_data.drop(
+                drop_columns, axis=1,
+                errors='ignore',  # Might not have been loaded
+            )
 
         # Join
+        if aggregator is not None:
+            aggregator.add_chunk(original_data_res, augment_data)
+            continue
         joined_chunk = original_data_res.join(
             augment_data,
             how=how,
@@ -544,7 +880,8 @@ def join(
 
         join_.append(joined_chunk)
 
-    join_ = pd.concat(join_)
+    if aggregator is None:
+        join_ = pd.concat(join_)
     logger.info("Join completed in %.4fs", time.perf_counter() - start)
 
     intersection = set(original_data.columns).intersection(set(first_augment_data.columns))
@@ -555,16 +892,22 @@ def join(
     # map column names for the augmentation data
     augment_columns_map = {
         name: name + '_r' if name in intersection else name
-        for name in first_augment_data.columns
+        for name in itertools.chain(
+            augment_data_columns,
+            first_augment_data.columns,
+        )
     }
 
     # aggregations
-    join_ = perform_aggregations(
-        join_,
-        list(original_data.columns),
-        agg_functions,
-        augment_columns_map,
-    )
+    if aggregator is not None:
+        join_ = aggregator.aggregate(augment_columns_map)
+    else:
+        join_ = perform_aggregations(
+            join_,
+            list(original_data.columns),
+            agg_functions,
+            augment_columns_map,
+        )
 
     # drop unique index
     join_.drop([UNIQUE_INDEX_KEY], axis=1, inplace=True)
@@ -628,8 +971,10 @@ def union(original_data, augment_data_path, original_metadata, augment_metadata,
           writer,
           left_columns, right_columns):
     """
-    Performs a union between original_data (pandas.DataFrame or path to CSV)
-    and augment_data_path (path to CSV file) using columns.
+    Performs a union between original_data (pandas.DataFrame, Arrow table, or
+    path or file object of a Parquet or CSV file) and augment_data_path (Arrow
+    table, or path to Parquet or CSV file) using columns. Arrow and Parquet
+    data is read like the equivalent CSV.
 
     The result is streamed to the writer object.
 
@@ -638,17 +983,16 @@ def union(original_data, augment_data_path, original_metadata, augment_metadata,
 
     if isinstance(original_data, pd.DataFrame):
         original_data = iter((original_data,))
-    elif hasattr(original_data, 'read'):
-        original_data = iter(pd.read_csv(
+    elif _is_data_path_or_file(original_data):
+        original_data = iter(_read_chunks(
             original_data,
-            error_bad_lines=False,
             dtype=str,
             na_filter=False,
-            chunksize=CHUNK_SIZE_ROWS,
         ))
     else:
         raise TypeError(
-            "union() argument 1 should be a file or a DataFrame, got "
+            "union() argument 1 should be a file, a path, a DataFrame, or an "
+            "Arrow table, got "
             "%r" % type(original_data)
         )
 
@@ -706,12 +1050,15 @@ def union(original_data, augment_data_path, original_metadata, augment_metadata,
         total_rows = orig_rows
 
         # Iterate on chunks of augment data
-        augment_data_chunks = pd.read_csv(
+        augment_data_chunks = _read_chunks(
             augment_data_path,
-            error_bad_lines=False,
+            # Only load the columns that will be kept
+            columns=[
+                name for name in augment_data_columns
+                if rename.get(name, name) in first_original_data.columns
+            ],
             dtype=str,
             na_filter=False,
-            chunksize=CHUNK_SIZE_ROWS,
         )
         for augment_data in augment_data_chunks:
             # Rename columns to match
@@ -8,5 +8,5 @@ __all__ = ['Discoverer', 'AsyncDiscoverer']
 
 
 PROM_VERSION = prometheus_client.Gauge('version', "Datamart version",
-                                       ['version'])
+                                       ['version'], multiprocess_mode='max')
 PROM_VERSION.labels(os.environ['DATAMART_VERSION']).set(1)
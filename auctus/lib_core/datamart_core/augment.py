@@ -13,7 +13,7 @@ def augment(data, newdata, metadata, task, writer, columns=None):
     Augments original data based on the task.
 
     :param data: the data to be augmented, as binary file object.
-    :param newdata: the path to the CSV file to augment with.
+    :param newdata: the path to the CSV or Parquet file to augment with.
     :param metadata: the metadata of the data to be augmented.
     :param task: the augmentation task.
     :param writer: Writer on which to save the files.
@@ -8,10 +8,13 @@ import html.entities
 import json
 import logging
 import os
+import prometheus_client
+import prometheus_client.multiprocess
 import re
 import sentry_sdk
 import sys
 import threading
+import time
 
 from . import types
 
@@ -145,6 +148,22 @@ def setup_logging(clear=True, thread=True):
         )
 
 
+def start_metrics_server(port=8000):
+    """Serve the Prometheus metrics over HTTP.
+
+    If ``$PROMETHEUS_MULTIPROC_DIR`` is set, this serves the metrics collected
+    from all the processes writing to that directory, including the worker
+    processes of pools, which would otherwise be lost. That directory should
+    be emptied before the service starts.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = prometheus_client.CollectorRegistry()
+        prometheus_client.multiprocess.MultiProcessCollector(registry)
+        prometheus_client.start_http_server(port, registry=registry)
+    else:
+        prometheus_client.start_http_server(port)
+
+
 def block_wait_future(future):
     """Block the current thread until the future is done, return result.
 
@@ -175,6 +194,49 @@ def msg2json(msg):
     return json.loads(msg.body.decode('utf-8'))
 
 
+# Priorities of the messages on the 'profile' queue (x-max-priority is 3)
+PROFILE_PRIORITY_LOW = 0  # Large datasets, bulk reprocessing
+PROFILE_PRIORITY_DISCOVERY = 1  # Found by discoverers
+PROFILE_PRIORITY_USER = 2  # Someone is waiting: uploads, reprocessing one
+
+
+def get_profile_large_size():
+    """Size from which datasets are considered large, ``$PROFILE_LARGE_SIZE``.
+    """
+    return int(os.environ.get('PROFILE_LARGE_SIZE', '') or 1073741824)
+
+
+def profile_message(dataset_id, metadata, priority=None, size=None):
+    """Make the message to send to the 'profile' exchange for a dataset.
+
+    :param priority: Defaults to ``PROFILE_PRIORITY_DISCOVERY``, or
+        ``PROFILE_PRIORITY_LOW`` for large datasets.
+    :param size: Size hint in bytes, defaults to ``metadata['size']`` if
+        set. It is sent in the headers, for the profiler to route large
+        datasets to their own queue.
+    """
+    if size is None:
+        size = metadata.get('size')
+    if size is not None:
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            size = None
+    if priority is None:
+        if size is not None and size >= get_profile_large_size():
+            priority = PROFILE_PRIORITY_LOW
+        else:
+            priority = PROFILE_PRIORITY_DISCOVERY
+    headers = {'sent': time.time()}
+    if size is not None:
+        headers['size'] = size
+    return json2msg(
+        dict(id=dataset_id, metadata=metadata),
+        priority=priority,
+        headers=headers,
+    )
+
+
 _log_future_references = {}
 
 
@@ -223,6 +285,63 @@ class PrefixedElasticsearch(object):
             body=body, size=size, from_=from_, request_timeout=request_timeout,
         )
 
+    def msearch(self, searches, request_timeout=None):
+        """Run multiple searches in a single request.
+
+        :param searches: List of ``(index, body)`` pairs, the body can set
+            ``size``.
+        :return: List of responses, in the same order. Raises if any failed.
+        """
+        body = []
+        for index, search in searches:
+            body.append({'index': self.add_prefix(index)})
+            body.append(search)
+        responses = self.es.msearch(
+            body=body,
+            request_timeout=request_timeout,
+        )['responses']
+        for response in responses:
+            if 'error' in response:
+                error = response['error']
+                raise elasticsearch.TransportError(
+                    response.get('status', 'N/A'),
+                    error.get('type') if isinstance(error, dict) else error,
+                    error,
+                )
+        return responses
+
+    def mget(self, index, ids, _source=None):
+        """Get multiple documents from an index in a single request.
+
+        :return: Dictionary mapping the IDs to the documents that were found.
+        """
+        if not ids:
+            return {}
+        docs = self.es.mget(
+            body={'ids': list(ids)},
+            index=self.add_prefix(index),
+            _source=_source,
+        )['docs']
+        return {doc['_id']: doc for doc in docs if doc.get('found')}
+
+    def bulk(self, actions, request_timeout=None):
+        """Run multiple index and delete operations in a single request.
+
+        :param actions: List of ``(op_type, index, id, body)`` tuples, where
+            ``op_type`` is ``'index'`` or ``'delete'``. ``id`` can be None
+            when indexing, and ``body`` is ignored when deleting.
+        :return: The response, with one item per action in ``items``.
+        """
+        body = []
+        for op_type, index, id, document in actions:
+            action = {'_index': self.add_prefix(index)}
+            if id is not None:
+                action['_id'] = id
+            body.append({op_type: action})
+            if op_type != 'delete':
+                body.append(document)
+        return self.es.bulk(body=body, request_timeout=request_timeout)
+
     def delete(self, index, id):
         return self.es.delete(self.add_prefix(index), id)
 
@@ -248,6 +367,112 @@ class PrefixedElasticsearch(object):
         self.es.close()
 
 
+class BulkIndexer(object):
+    """Buffers writes to Elasticsearch and sends them using the bulk API.
+
+    Documents are buffered by `index()` and `delete()`, and sent by
+    `flush()` in requests of at most `batch_size` operations.
+    `flush_if_needed()` only sends them once there are `batch_size` of them,
+    or once the oldest one has waited for `flush_interval` seconds. Those
+    default to ``$ELASTICSEARCH_BULK_SIZE`` (500) and
+    ``$ELASTICSEARCH_BULK_INTERVAL`` (5 seconds).
+
+    If a request fails, its operations stay in the buffer so that `flush()`
+    can be called again. If only some of the operations fail,
+    `elasticsearch.helpers.BulkIndexError` is raised, and they are dropped.
+    """
+    def __init__(self, es, batch_size=None, flush_interval=None):
+        self.es = es
+        if batch_size is None:
+            batch_size = int(
+                os.environ.get('ELASTICSEARCH_BULK_SIZE', '') or 500,
+            )
+        if flush_interval is None:
+            flush_interval = float(
+                os.environ.get('ELASTICSEARCH_BULK_INTERVAL', '') or 5.0,
+            )
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._actions = []
+        self._oldest = None
+
+        # Statistics
+        self.documents = 0
+        self.requests = 0
+        self.elapsed = 0.0
+
+    def __len__(self):
+        return len(self._actions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.flush()
+
+    @property
+    def rate(self):
+        """Documents sent per second spent in bulk requests.
+        """
+        if not self.elapsed:
+            return None
+        return self.documents / self.elapsed
+
+    def _add(self, action):
+        if not self._actions:
+            self._oldest = time.perf_counter()
+        self._actions.append(action)
+
+    def index(self, index, body, id=None):
+        self._add(('index', index, id, body))
+
+    def delete(self, index, id):
+        self._add(('delete', index, id, None))
+
+    def flush_if_needed(self):
+        if not self._actions:
+            return
+        if (
+            len(self._actions) >= self.batch_size
+            or time.perf_counter() - self._oldest >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """Send all the buffered operations.
+        """
+        while self._actions:
+            batch = self._actions[:self.batch_size]
+            start = time.perf_counter()
+            response = self.es.bulk(batch)
+            elapsed = time.perf_counter() - start
+            del self._actions[:len(batch)]
+            if self._actions:
+                self._oldest = time.perf_counter()
+
+            self.documents += len(batch)
+            self.requests += 1
+            self.elapsed += elapsed
+            logger.info(
+                "Bulk request: %d documents in %.2fs (%.0f documents/sec)",
+                len(batch), elapsed, len(batch) / max(elapsed, 1e-6),
+            )
+
+            if response.get('errors'):
+                errors = [
+                    item
+                    for item in response['items']
+                    for result in item.values()
+                    if 'error' in result
+                ]
+                if errors:
+                    raise elasticsearch.helpers.BulkIndexError(
+                        "%d document(s) failed to index" % len(errors),
+                        errors,
+                    )
+
+
 re_non_path_safe = re.compile(r'[^A-Za-z0-9_.-]')
 
 
@@ -338,11 +563,19 @@ def strip_html(text):
 
 def contextdecorator(factory, argname):
     def inner(wrapped):
-        @functools.wraps(wrapped)
-        def wrapper(*args, **kwargs):
-            with factory() as ctx:
-                kwargs.update({argname: ctx})
-                return wrapped(*args, **kwargs)
+        if asyncio.iscoroutinefunction(wrapped):
+            # Keep the context open until the coroutine is done
+            @functools.wraps(wrapped)
+            async def wrapper(*args, **kwargs):
+                with factory() as ctx:
+                    kwargs.update({argname: ctx})
+                    return await wrapped(*args, **kwargs)
+        else:
+            @functools.wraps(wrapped)
+            def wrapper(*args, **kwargs):
+                with factory() as ctx:
+                    kwargs.update({argname: ctx})
+                    return wrapped(*args, **kwargs)
         return wrapper
     return inner
 
@@ -366,11 +599,20 @@ def safe_extract_tar(tar, directory='.', members=None, *, numeric_owner=False):
     tar.extractall(directory, members, numeric_owner=numeric_owner)
 
 
-def add_dataset_to_sup_index(es, dataset_id, metadata):
+def add_dataset_to_sup_index(es, dataset_id, metadata, bulk=None):
     """
     Adds dataset to the supplementary Datamart indices: 'columns',
     'spatial_coverage', and 'temporal_coverage'.
+
+    The documents are added to `bulk` if provided (a `BulkIndexer`, which the
+    caller is responsible for flushing), or sent in a single bulk request
+    otherwise.
     """
+    if bulk is None:
+        with BulkIndexer(es) as bulk:
+            add_dataset_to_sup_index(es, dataset_id, metadata, bulk)
+        return
+
     DISCARD_DATASET_FIELDS = [
         'columns', 'sample', 'materialize',
         'spatial_coverage', 'temporal_coverage',
@@ -399,7 +641,7 @@ def add_dataset_to_sup_index(es, dataset_id, metadata):
                 )
                 for num_range in column_metadata['coverage']
             ]
-        es.index(
+        bulk.index(
             'columns',
             column_metadata
         )
@@ -423,7 +665,7 @@ def add_dataset_to_sup_index(es, dataset_id, metadata):
                         min_lat=coordinates[1][1],
                     ))
                 spatial_coverage_metadata['ranges'] = ranges
-            es.index(
+            bulk.index(
                 'spatial_coverage',
                 spatial_coverage_metadata,
             )
@@ -442,19 +684,26 @@ def add_dataset_to_sup_index(es, dataset_id, metadata):
                 )
                 for temporal_range in temporal_coverage_metadata['ranges']
             ]
-            es.index(
+            bulk.index(
                 'temporal_coverage',
                 temporal_coverage_metadata,
             )
 
 
-def add_dataset_to_index(es, dataset_id, metadata):
+def add_dataset_to_index(es, dataset_id, metadata, bulk=None):
     """
     Safely adds a dataset to all the Datamart indices.
+
+    Like `add_dataset_to_sup_index()`, this uses `bulk` if provided, or a
+    single bulk request otherwise.
     """
+    if bulk is None:
+        with BulkIndexer(es) as bulk:
+            add_dataset_to_index(es, dataset_id, metadata, bulk)
+        return
 
     # 'datasets' index
-    es.index(
+    bulk.index(
         'datasets',
         dict(metadata, id=dataset_id),
         id=dataset_id,
@@ -463,19 +712,27 @@ def add_dataset_to_index(es, dataset_id, metadata):
     add_dataset_to_sup_index(
         es,
         dataset_id,
-        metadata
+        metadata,
+        bulk,
     )
 
 
-def add_dataset_to_lazo_storage(es, id, metadata):
+def add_dataset_to_lazo_storage(es, id, metadata, bulk=None):
     """Adds a dataset to Lazo.
     """
 
-    es.index(
-        'lazo',
-        metadata,
-        id=id,
-    )
+    if bulk is None:
+        es.index(
+            'lazo',
+            metadata,
+            id=id,
+        )
+    else:
+        bulk.index(
+            'lazo',
+            metadata,
+            id=id,
+        )
 
 
 def delete_dataset_from_lazo(es, dataset_id, lazo_client):
@@ -551,13 +808,8 @@ def delete_dataset_from_index(es, dataset_id, lazo_client=None):
             'term': {'dataset_id': dataset_id}
         }
     }
-    for index in (
-        'columns',
-        'spatial_coverage',
-        'temporal_coverage',
-    ):
-        nb = es.delete_by_query(
-            index=index,
-            body=query,
-        )['deleted']
-        logger.info("Deleted %d documents from %s", nb, index)
+    nb = es.delete_by_query(
+        index='columns,spatial_coverage,temporal_coverage',
+        body=query,
+    )['deleted']
+    logger.info("Deleted %d documents from supplementary indices", nb)
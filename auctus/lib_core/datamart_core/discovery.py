@@ -7,9 +7,10 @@ import logging
 import os
 import sentry_sdk
 import sys
+import tempfile
 import uuid
 
-from .common import PrefixedElasticsearch, block_run, json2msg, \
+from .common import PrefixedElasticsearch, block_run, profile_message, \
     encode_dataset_id, delete_dataset_from_index, strip_html
 from .objectstore import get_object_store
 
@@ -82,7 +83,7 @@ class Discoverer(object):
         pass
 
     async def _a_record_dataset(self, materialize, metadata,
-                                dataset_id=None):
+                                dataset_id=None, priority=None, size=None):
         if dataset_id is None:
             dataset_id = uuid.uuid4().hex
         dataset_id = self.identifier + '.' + dataset_id
@@ -94,22 +95,23 @@ class Discoverer(object):
                             identifier=self.identifier,
                             date=datetime.utcnow().isoformat() + 'Z'))
         await self.profile_exchange.publish(
-            json2msg(
-                dict(
-                    id=dataset_id,
-                    metadata=metadata,
-                ),
-            ),
+            profile_message(dataset_id, metadata, priority, size),
             '',
         )
         logger.info("Discovered %s", dataset_id)
         return dataset_id
 
     def record_dataset(self, materialize, metadata,
-                       dataset_id=None):
+                       dataset_id=None, *, priority=None, size=None):
         """Publish a found dataset.
 
         The dataset will be profiled if necessary and recorded in the index.
+
+        :param priority: Priority for profiling, one of the
+            ``PROFILE_PRIORITY_*`` constants. By default, datasets over
+            ``$PROFILE_LARGE_SIZE`` get a low priority.
+        :param size: Size of the file in bytes, if known. Defaults to
+            ``metadata['size']``.
         """
         if 'name' not in metadata:
             metadata['name'] = dataset_id
@@ -118,7 +120,8 @@ class Discoverer(object):
         if 'description' in metadata:
             metadata['description'] = strip_html(metadata['description'])
         coro = self._a_record_dataset(materialize, metadata,
-                                      dataset_id=dataset_id)
+                                      dataset_id=dataset_id,
+                                      priority=priority, size=size)
         if self._async:
             return self.loop.create_task(coro)
         else:
@@ -131,12 +134,17 @@ class Discoverer(object):
         This is useful if there is no way to materialize this dataset again in
         the future, and you need to store it to refer to it. Materialization
         won't occur for datasets that are in shared storage already.
+
+        The file is written locally, then uploaded if no exception is raised.
         """
         # TODO: Add a mechanism to clean datasets from storage
         object_store = get_object_store()
         key = encode_dataset_id(self.identifier + '.' + dataset_id)
-        with object_store.open('datasets', key, 'wb') as fp:
-            yield fp
+        with tempfile.TemporaryDirectory(prefix='datamart_') as tmp:
+            path = os.path.join(tmp, 'data')
+            with open(path, 'wb') as fp:
+                yield fp
+            object_store.upload_from('datasets', key, path)
 
     def delete_dataset(self, *, full_id=None, dataset_id=None):
         """Delete a dataset that is no longer present in the source.
@@ -1,6 +1,7 @@
 import advocate
 import contextlib
 import datamart_materialize
+import datamart_materialize.parquet
 import ipaddress
 import logging
 import opentelemetry.trace
@@ -10,7 +11,7 @@ import shutil
 import socket
 import zipfile
 
-from datamart_fslock.cache import cache_get_or_set
+from datamart_fslock.cache import cache_get, cache_get_or_set
 
 from .common import hash_json
 from .discovery import encode_dataset_id
@@ -72,45 +73,136 @@ def dataset_cache_key(dataset_id, metadata, format, format_options):
     )
 
 
+def dataset_sidecar_key(dataset_id, metadata):
+    """Cache key for the typed Parquet version of a dataset.
+
+    Unlike `dataset_cache_key()`, this only depends on what goes in the file
+    (the materialization info and the column types), so it can still be used
+    after the dataset is profiled again.
+    """
+    h = hash_json({
+        'format': 'parquet-sidecar',
+        'version': 2,
+        'materialize': metadata.get('materialize', {}),
+        'columns': [
+            [column['name'], column['structural_type']]
+            for column in metadata['columns']
+        ],
+    })
+    return '%s_%s.parquet' % (encode_dataset_id(dataset_id), h)
+
+
+def parquet_sidecar_enabled():
+    """Whether the typed Parquet version of datasets should be used.
+
+    This is set with ``$PARQUET_SIDECAR``.
+    """
+    return os.environ.get('PARQUET_SIDECAR') not in (
+        None, '', 'no', 'off', 'false',
+    )
+
+
+def make_dataset_sidecar(metadata, dataset_id, csv_path):
+    """Get the typed Parquet version of a dataset, creating it from the CSV.
+
+    Use as a context manager, the file is locked until it exits. The caller
+    should hold the CSV (e.g. with `get_dataset()`).
+    """
+    def create(cache_temp):
+        logger.info("Writing Parquet sidecar for %r", dataset_id)
+        with tracer.start_as_current_span(
+            'materialize/parquet-sidecar',
+            attributes={'dataset_id': dataset_id},
+        ):
+            with PROM_CONVERT.time():
+                datamart_materialize.parquet.csv_to_parquet(
+                    csv_path, cache_temp,
+                    metadata['columns'],
+                )
+
+    return cache_get_or_set(
+        '/cache/datasets',
+        dataset_sidecar_key(dataset_id, metadata),
+        create,
+    )
+
+
+@contextlib.contextmanager
+def get_dataset_sidecar(metadata, dataset_id):
+    """Get the typed Parquet version of a dataset.
+
+    It is stored in the dataset cache next to the CSV, and created from it
+    under its lock if it's missing. Reading it with
+    `datamart_materialize.parquet.read_parquet_as_csv()` gives the same data
+    as reading the CSV.
+    """
+    key = dataset_sidecar_key(dataset_id, metadata)
+    with cache_get('/cache/datasets', key) as path:
+        if path is not None:
+            yield path
+            return
+
+    with contextlib.ExitStack() as dataset_lock:
+        csv_path = dataset_lock.enter_context(
+            get_dataset(metadata, dataset_id),
+        )
+        # Release the CSV once the sidecar is locked
+        with dataset_lock.pop_all():
+            path = dataset_lock.enter_context(
+                make_dataset_sidecar(metadata, dataset_id, csv_path),
+            )
+        yield path
+
+
 def get_from_dataset_storage(metadata, dataset_id, destination):
     object_store = get_object_store()
 
-    with contextlib.ExitStack() as s3_stack:
+    materialize = metadata.get('materialize', {})
+    if not materialize.get('convert'):
         try:
-            csv_file = s3_stack.enter_context(
-                object_store.open('datasets', encode_dataset_id(dataset_id))
+            object_store.download_to(
+                'datasets', encode_dataset_id(dataset_id),
+                destination,
             )
         except FileNotFoundError:
             return False
+        logger.info("Read from datasets bucket")
+        return True
+
+    # Download next to the destination, and apply converters
+    orig_temp = destination + '.orig'
+    try:
+        try:
+            object_store.download_to(
+                'datasets', encode_dataset_id(dataset_id),
+                orig_temp,
+            )
+        except FileNotFoundError:
+            return False
+        logger.info("Read from datasets bucket")
+
+        writer = datamart_materialize.make_writer(
+            destination,
+            format='csv',
+        )
+        for converter in reversed(materialize.get('convert', [])):
+            converter_args = dict(converter)
+            converter_id = converter_args.pop('identifier')
+            converter_class = datamart_materialize.converters[converter_id]
+            writer = converter_class(writer, **converter_args)
+
+        if hasattr(writer, 'convert_file'):
+            # Converter reads the file directly
+            writer.convert_file(orig_temp)
         else:
-            logger.info("Reading from datasets bucket")
-            with open(destination, 'wb') as fp:
-                shutil.copyfileobj(csv_file, fp)
-
-            # Apply converters
-            materialize = metadata.get('materialize', {})
-            if materialize.get('convert'):
-                orig_temp = destination + '.orig'
-                try:
-                    os.rename(destination, orig_temp)
-                    writer = datamart_materialize.make_writer(
-                        destination,
-                        format='csv',
-                    )
-                    for converter in reversed(materialize.get('convert', [])):
-                        converter_args = dict(converter)
-                        converter_id = converter_args.pop('identifier')
-                        converter_class = datamart_materialize.converters[converter_id]
-                        writer = converter_class(writer, **converter_args)
-
-                    with writer.open_file('wb') as f_out:
-                        with open(orig_temp, 'rb') as f_in:
-                            for chunk in iter(lambda: f_in.read(4096), b''):
-                                f_out.write(chunk)
-                finally:
-                    os.remove(orig_temp)
-
-            return True
+            with writer.open_file('wb') as f_out:
+                with open(orig_temp, 'rb') as f_in:
+                    shutil.copyfileobj(f_in, f_out, 1 << 20)
+    finally:
+        if os.path.exists(orig_temp):
+            os.remove(orig_temp)
+
+    return True
 
 
 def advocate_session():
@@ -1,4 +1,5 @@
 from base64 import b64decode
+import concurrent.futures
 import contextlib
 from io import BufferedReader
 import json
@@ -22,14 +23,31 @@ def get_object_store():
 
 
 class ObjectStore(object):
+    """Storage for datasets and snapshots, on top of an fsspec filesystem.
+
+    Big transfers (`download_to()`, `upload_from()`) are split in parts of
+    `part_size` bytes, `concurrency` of which are transferred at a time. They
+    default to ``$OBJECT_STORE_PART_SIZE`` (16 MB) and
+    ``$OBJECT_STORE_CONCURRENCY`` (8).
+    """
     BUCKETS = (
         'datasets',
         'snapshots',
     )
 
-    def __init__(self, fs, prefix=None):
+    def __init__(self, fs, prefix=None, *, part_size=None, concurrency=None):
         self.fs = fs
         self.prefix = prefix
+        if part_size is None:
+            part_size = int(
+                os.environ.get('OBJECT_STORE_PART_SIZE', '') or 16777216,
+            )
+        if concurrency is None:
+            concurrency = int(
+                os.environ.get('OBJECT_STORE_CONCURRENCY', '') or 8,
+            )
+        self.part_size = part_size
+        self.concurrency = concurrency
         for bucket in self.BUCKETS:
             try:
                 self.fs.mkdir(self.bucket(bucket))
@@ -53,6 +71,57 @@ class ObjectStore(object):
             logger.info("Opened for reading: %s", full_name)
             return fp
 
+    def _run_parts(self, func, parts):
+        """Call a function for each part, in parallel, and get the results.
+        """
+        with concurrent.futures.ThreadPoolExecutor(
+            self.concurrency,
+            thread_name_prefix='objectstore',
+        ) as executor:
+            return list(executor.map(func, parts))
+
+    def download_to(self, bucket, name, path):
+        """Download an object to a local file.
+
+        Big objects are downloaded with concurrent ranged requests.
+
+        :raises FileNotFoundError: if the object doesn't exist
+        :return: the size of the object
+        """
+        full_name = '%s/%s' % (self.bucket(bucket), name)
+        size = self.fs.size(full_name)
+        part_size = self.part_size
+        logger.info(
+            "Downloading %s, %d bytes, %d parts",
+            full_name, size, max(-(-size // part_size), 1),
+        )
+
+        with open(path, 'wb') as fp:
+            if size <= part_size:
+                fp.write(self.fs.cat_file(full_name))
+                return size
+
+            fd = fp.fileno()
+
+            def get_part(start):
+                end = min(start + part_size, size)
+                data = self.fs.cat_file(full_name, start=start, end=end)
+                if len(data) != end - start:
+                    raise IOError("Short read from %s" % full_name)
+                os.pwrite(fd, data, start)
+
+            self._run_parts(get_part, range(0, size, part_size))
+        logger.info("Downloaded %s", full_name)
+        return size
+
+    def upload_from(self, bucket, name, path):
+        """Upload a local file as an object.
+        """
+        full_name = '%s/%s' % (self.bucket(bucket), name)
+        logger.info("Uploading %s", full_name)
+        self.fs.put_file(path, full_name)
+        logger.info("Uploaded %s", full_name)
+
     def delete(self, bucket, name):
         self.fs.rm(
             '%s/%s' % (self.bucket(bucket), name),
@@ -163,6 +232,47 @@ class GCSObjectStore(ObjectStore):
 
         super(GCSObjectStore, self).__init__(fs, prefix)
 
+    # Maximum number of objects that can be composed into one
+    MAX_PARTS = 32
+
+    def upload_from(self, bucket, name, path):
+        """Upload a local file as an object.
+
+        Big files are uploaded as concurrent parts, which are then composed
+        into the object.
+        """
+        size = os.path.getsize(path)
+        if size <= self.part_size:
+            return super(GCSObjectStore, self).upload_from(bucket, name, path)
+
+        full_name = '%s/%s' % (self.bucket(bucket), name)
+        part_size = max(self.part_size, -(-size // self.MAX_PARTS))
+        part_names = [
+            '%s.part%d' % (full_name, i)
+            for i in range(-(-size // part_size))
+        ]
+        logger.info(
+            "Uploading %s, %d bytes, %d parts",
+            full_name, size, len(part_names),
+        )
+
+        with open(path, 'rb') as fp:
+            fd = fp.fileno()
+
+            def put_part(idx):
+                data = os.pread(fd, part_size, idx * part_size)
+                self.fs.pipe_file(part_names[idx], data)
+
+            try:
+                self._run_parts(put_part, range(len(part_names)))
+                self.fs.merge(full_name, part_names)
+            finally:
+                try:
+                    self.fs.rm(part_names, recursive=False)
+                except Exception:
+                    logger.exception("Error removing parts of %s", full_name)
+        logger.info("Uploaded %s", full_name)
+
     def clear_bucket(self, bucket):
         bucket = self.bucket(bucket)
         files = self.fs.ls(bucket, detail=False)
@@ -188,6 +298,70 @@ class S3ObjectStore(ObjectStore):
 
         super(S3ObjectStore, self).__init__(fs, prefix)
 
+    # Limits on multipart uploads
+    MIN_PART_SIZE = 5242880  # 5 MB
+    MAX_PARTS = 10000
+
+    def upload_from(self, bucket, name, path):
+        """Upload a local file as an object.
+
+        Big files are uploaded with a multipart upload, sending concurrent
+        parts.
+        """
+        size = os.path.getsize(path)
+        if size <= self.part_size:
+            return super(S3ObjectStore, self).upload_from(bucket, name, path)
+
+        full_name = '%s/%s' % (self.bucket(bucket), name)
+        s3_bucket, key, _ = self.fs.split_path(full_name)
+        part_size = max(
+            self.part_size,
+            self.MIN_PART_SIZE,
+            -(-size // self.MAX_PARTS),
+        )
+        nb_parts = -(-size // part_size)
+        logger.info(
+            "Uploading %s, %d bytes, %d parts",
+            full_name, size, nb_parts,
+        )
+
+        mpu = self.fs.call_s3(
+            'create_multipart_upload',
+            Bucket=s3_bucket, Key=key,
+        )
+        try:
+            with open(path, 'rb') as fp:
+                fd = fp.fileno()
+
+                def put_part(number):
+                    data = os.pread(fd, part_size, (number - 1) * part_size)
+                    out = self.fs.call_s3(
+                        'upload_part',
+                        Bucket=s3_bucket, Key=key,
+                        UploadId=mpu['UploadId'],
+                        PartNumber=number,
+                        Body=data,
+                    )
+                    return {'PartNumber': number, 'ETag': out['ETag']}
+
+                parts = self._run_parts(put_part, range(1, nb_parts + 1))
+            self.fs.call_s3(
+                'complete_multipart_upload',
+                Bucket=s3_bucket, Key=key,
+                UploadId=mpu['UploadId'],
+                MultipartUpload={'Parts': parts},
+            )
+        except BaseException:
+            logger.info("Exception, aborting upload of %s", full_name)
+            self.fs.call_s3(
+                'abort_multipart_upload',
+                Bucket=s3_bucket, Key=key,
+                UploadId=mpu['UploadId'],
+            )
+            raise
+        self.fs.invalidate_cache(full_name)
+        logger.info("Uploaded %s", full_name)
+
     def clear_bucket(self, bucket):
         bucket = self.bucket(bucket)
         files = self.fs.ls(bucket, detail=False)
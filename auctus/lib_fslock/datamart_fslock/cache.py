@@ -3,6 +3,8 @@ import logging
 import os
 import prometheus_client
 import shutil
+import threading
+import time
 
 from . import FSLockExclusive, FSLockShared
 
@@ -21,12 +23,86 @@ PROM_CACHE_MISSES = prometheus_client.Counter(
     ['cache_dir'],
 )
 
+PROM_CACHE_COALESCED = prometheus_client.Counter(
+    'cache_coalesced',
+    "Number of cache lookups that waited for another thread creating the "
+    "same entry, per cache directory",
+    ['cache_dir'],
+)
+
 PROM_CACHE_HITS.labels('/cache/datasets').inc(0)
 PROM_CACHE_MISSES.labels('/cache/datasets').inc(0)
+PROM_CACHE_COALESCED.labels('/cache/datasets').inc(0)
 PROM_CACHE_HITS.labels('/cache/aug').inc(0)
 PROM_CACHE_MISSES.labels('/cache/aug').inc(0)
+PROM_CACHE_COALESCED.labels('/cache/aug').inc(0)
 PROM_CACHE_HITS.labels('/cache/user_data').inc(0)
 PROM_CACHE_MISSES.labels('/cache/user_data').inc(0)
+PROM_CACHE_COALESCED.labels('/cache/user_data').inc(0)
+
+
+class _InFlight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+# Entries being created by a thread of this process, (cache_dir, key) -> flight
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _wait_flight(cache_dir, key, flight):
+    PROM_CACHE_COALESCED.labels(cache_dir).inc(1)
+    logger.info("Waiting for entry being created: %r", key)
+    flight.done.wait()
+    if flight.error is not None:
+        raise flight.error
+
+
+def _wait_in_flight(cache_dir, key):
+    """Wait for another thread of this process creating the entry, if any.
+    """
+    with _in_flight_lock:
+        flight = _in_flight.get((cache_dir, key))
+    if flight is not None:
+        _wait_flight(cache_dir, key, flight)
+
+
+@contextlib.contextmanager
+def _coalesce(cache_dir, key):
+    """Only let one thread of this process create a given entry.
+
+    Yields True if this thread should go on and create the entry, or False
+    once the other thread is done with it, in which case the entry should be
+    looked up again. If the other thread failed, its error is raised here too.
+
+    This avoids having each thread wait on the exclusive lock (and start a
+    locking subprocess) just to find out that the entry now exists.
+    """
+    flight_key = (cache_dir, key)
+    with _in_flight_lock:
+        flight = _in_flight.get(flight_key)
+        if flight is None:
+            flight = _in_flight[flight_key] = _InFlight()
+            leader = True
+        else:
+            leader = False
+
+    if not leader:
+        _wait_flight(cache_dir, key, flight)
+        yield False
+        return
+
+    try:
+        yield True
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _in_flight_lock:
+            del _in_flight[flight_key]
+        flight.done.set()
 
 
 @contextlib.contextmanager
@@ -47,6 +123,9 @@ def cache_get_or_set(cache_dir, key, create_function, cache_invalid=False):
             # won't be changed or removed
             with open(entry_path) as fp:
                 print(fp.read())
+
+    The ``.lock`` file is touched on every hit, and holds the time it took to
+    create the entry, so they can be used to pick entries to evict.
     """
     entry_path = os.path.join(cache_dir, key + '.cache')
     lock_path = os.path.join(cache_dir, key + '.lock')
@@ -54,6 +133,9 @@ def cache_get_or_set(cache_dir, key, create_function, cache_invalid=False):
     metric_set = False
     while True:
         if not cache_invalid:
+            # Don't wait on the lock if we know it's being created
+            _wait_in_flight(cache_dir, key)
+
             with contextlib.ExitStack() as lock:
                 try:
                     lock.enter_context(FSLockShared(lock_path))
@@ -66,53 +148,63 @@ def cache_get_or_set(cache_dir, key, create_function, cache_invalid=False):
                             PROM_CACHE_HITS.labels(cache_dir).inc(1)
 
                         # Update time on the file
-                        with open(lock_path, 'a'):
-                            pass
+                        os.utime(lock_path)
 
                         # Entry exists and we have it locked, return it
                         yield entry_path
                         return
                     # Entry was removed while we waited -- we'll try creating
 
-        with FSLockExclusive(lock_path):
-            if cache_invalid:
-                # Remove the cache that's invalid
-                if os.path.isdir(entry_path):
-                    shutil.rmtree(entry_path)
-                elif os.path.isfile(entry_path):
-                    os.remove(entry_path)
-
+        with _coalesce(cache_dir, key) as leader:
+            if not leader:
+                # Another thread just created it (or tried to)
                 cache_invalid = False
-            elif os.path.exists(entry_path):
-                # Cache was created while we waited
-                # We can't downgrade to a shared lock, so restart
                 continue
 
-            # Remove temporary file
-            if os.path.isdir(temp_path):
-                shutil.rmtree(temp_path)
-            elif os.path.isfile(temp_path):
-                os.remove(temp_path)
-
-            try:
-                if not metric_set:
-                    metric_set = True
-                    PROM_CACHE_MISSES.labels(cache_dir).inc(1)
-                # Cache doesn't exist and we have it locked -- create
-                create_function(temp_path)
-            except BaseException:
-                # Creation failed, clean up before unlocking!
+            with FSLockExclusive(lock_path):
+                if cache_invalid:
+                    # Remove the cache that's invalid
+                    if os.path.isdir(entry_path):
+                        shutil.rmtree(entry_path)
+                    elif os.path.isfile(entry_path):
+                        os.remove(entry_path)
+
+                    cache_invalid = False
+                elif os.path.exists(entry_path):
+                    # Cache was created while we waited
+                    # We can't downgrade to a shared lock, so restart
+                    continue
+
+                # Remove temporary file
                 if os.path.isdir(temp_path):
                     shutil.rmtree(temp_path)
                 elif os.path.isfile(temp_path):
                     os.remove(temp_path)
-                os.remove(lock_path)
-                raise
-            else:
-                # Rename it to destination
-                os.rename(temp_path, entry_path)
 
-            # We can't downgrade to a shared lock, so restart
+                try:
+                    if not metric_set:
+                        metric_set = True
+                        PROM_CACHE_MISSES.labels(cache_dir).inc(1)
+                    # Cache doesn't exist and we have it locked -- create
+                    start = time.perf_counter()
+                    create_function(temp_path)
+                except BaseException:
+                    # Creation failed, clean up before unlocking!
+                    if os.path.isdir(temp_path):
+                        shutil.rmtree(temp_path)
+                    elif os.path.isfile(temp_path):
+                        os.remove(temp_path)
+                    os.remove(lock_path)
+                    raise
+                else:
+                    # Rename it to destination
+                    os.rename(temp_path, entry_path)
+
+                    # Record how long it took, see `get_creation_time()`
+                    with open(lock_path, 'w') as fp:
+                        fp.write('%.3f\n' % (time.perf_counter() - start))
+
+                # We can't downgrade to a shared lock, so restart
 
 
 @contextlib.contextmanager
@@ -144,8 +236,7 @@ def cache_get(cache_dir, key):
                 PROM_CACHE_HITS.labels(cache_dir).inc(1)
 
                 # Update time on the file
-                with open(lock_path, 'a'):
-                    pass
+                os.utime(lock_path)
 
                 # Entry exists and we have it locked, return it
                 yield entry_path
@@ -157,6 +248,20 @@ def cache_get(cache_dir, key):
             return
 
 
+def get_creation_time(cache_dir, key):
+    """Get the time it took to create an entry, in seconds.
+
+    :return: the time in seconds, or None if it wasn't recorded (the entry
+        predates this or is being created)
+    """
+    lock_path = os.path.join(cache_dir, key + '.lock')
+    try:
+        with open(lock_path) as fp:
+            return float(fp.read())
+    except (OSError, ValueError):
+        return None
+
+
 def clear_cache(cache_dir, should_delete=None, only_if_possible=True):
     """Function used to safely clear a cache.
 
@@ -28,7 +28,16 @@ PROM_LOCKS_HELD = prometheus_client.Gauge(
     'cache_locks_held',
     "Number of locks on cache currently held",
     ['type'],
+    multiprocess_mode='livesum',
 )
+PROM_LOCKS_ACQUIRED = prometheus_client.Counter(
+    'cache_locks_acquired',
+    "Number of locks on cache acquired, in-process (fast) or by a subprocess",
+    ['type', 'path'],
+)
+for _type in ('exclusive', 'shared'):
+    for _path in ('fast', 'subprocess'):
+        PROM_LOCKS_ACQUIRED.labels(_type, _path).inc(0)
 
 
 @contextlib.contextmanager
@@ -65,7 +74,10 @@ def _lock_process(pipe, filepath, exclusive, timeout=None):
     We run the locking in a subprocess so that we are the main thread
     (required to use SIGALRM) and to avoid spurious unlocking on Linux (which
     can happen if a different file descriptor for the same file gets closed,
-    even by another thread).
+    even by another thread, when flock(2) is emulated with fcntl(2) locks).
+
+    This is only used when the lock is not immediately available, see
+    `_lock()`.
     """
     try:
         # Reset signal handlers
@@ -123,8 +135,69 @@ def join_process(proc, timeout):
         now = time.perf_counter()
 
 
+def _try_lock(filepath, exclusive):
+    """Try to lock the file without blocking, in this process.
+
+    :return: the file descriptor holding the lock, or None if it would block
+    :raises FileNotFoundError: if the file doesn't exist (for shared locks)
+    """
+    mode = os.O_RDONLY | os.O_CREAT if exclusive else os.O_RDONLY
+    fd = os.open(filepath, mode)
+    try:
+        op = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        fcntl.flock(fd, op | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    except BaseException:
+        os.close(fd)
+        raise
+    return fd
+
+
 @contextlib.contextmanager
 def _lock(filepath, exclusive, timeout=None):
+    """Get a lock, without starting a subprocess if it is available now.
+
+    flock(2) locks belong to the open file description, so taking them with
+    our own descriptor is safe from any thread. Waiting is done in a
+    subprocess, see `_lock_process()`.
+
+    Note that the descriptor is not inherited by executed programs, but it is
+    by processes forked while the lock is held, which then keep the lock
+    until they exit. This also relies on the filesystem supporting flock(2)
+    natively (NFS emulates it with fcntl(2) locks, which are per-process).
+    """
+    type_ = "exclusive" if exclusive else "shared"
+
+    # Fast path: lock in-process without blocking
+    start = time.perf_counter()
+    fd = _try_lock(filepath, exclusive)
+    if fd is None:
+        if timeout == 0:
+            logger.debug("Timeout getting %s lock: %r", type_, filepath)
+            raise TimeoutError
+
+        # Wait for the lock in a subprocess
+        with _lock_subprocess(filepath, exclusive, timeout=timeout):
+            yield
+        return
+
+    PROM_LOCK_ACQUIRE.labels(type_).observe(time.perf_counter() - start)
+    logger.info("Acquired %s lock: %r", type_, filepath)
+    PROM_LOCKS_ACQUIRED.labels(type_, 'fast').inc()
+    PROM_LOCKS_HELD.labels(type_).inc()
+    try:
+        yield
+    finally:
+        logger.debug("Releasing %s lock: %r", type_, filepath)
+        os.close(fd)
+        logger.info("Released %s lock: %r", type_, filepath)
+        PROM_LOCKS_HELD.labels(type_).dec()
+
+
+@contextlib.contextmanager
+def _lock_subprocess(filepath, exclusive, timeout=None):
     type_ = "exclusive" if exclusive else "shared"
 
     started = False
@@ -143,6 +216,7 @@ def _lock(filepath, exclusive, timeout=None):
             if out == 'LOCKED':
                 logger.info("Acquired %s lock: %r", type_, filepath)
                 locked = True
+                PROM_LOCKS_ACQUIRED.labels(type_, 'subprocess').inc()
                 PROM_LOCKS_HELD.labels(type_).inc()
             elif out == 'TIMEOUT':
                 logger.debug("Timeout getting %s lock: %r", type_, filepath)
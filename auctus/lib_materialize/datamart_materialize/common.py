@@ -1,6 +1,6 @@
 import csv
 
-from datamart_materialize.utils import SimpleConverter
+from datamart_materialize.utils import StreamingConverter
 
 
 class UnsupportedConversion(ValueError):
@@ -26,12 +26,27 @@ def skip_rows(source_filename, dest_fileobj, nb_rows):
             dst.writerow(row)
 
 
-class SkipRowsConverter(SimpleConverter):
+class SkipRowsConverter(StreamingConverter):
     """Adapter skipping a given number of rows from a CSV file.
     """
     def __init__(self, writer, *, nb_rows):
         super(SkipRowsConverter, self).__init__(writer)
         self.nb_rows = nb_rows
 
-    def transform(self, source_filename, dest_fileobj):
-        skip_rows(source_filename, dest_fileobj, self.nb_rows)
+    def begin(self):
+        self._skipped = 0
+
+    def transform_row(self, row):
+        if self._skipped < self.nb_rows:
+            self._skipped += 1
+            return ()
+        return (row,)
+
+    def end(self):
+        if self._skipped < self.nb_rows:
+            raise ValueError(
+                "Can't skip %d rows, table only has %d" % (
+                    self.nb_rows, self._skipped,
+                ),
+            )
+        return ()
@@ -1,19 +1,23 @@
 import csv
 from datetime import datetime
+import io
+import itertools
 import logging
 import zipfile
 
 from datamart_profiler import parse_date
-from datamart_profiler.core import count_rows_to_skip
+from datamart_profiler.core import HEADER_CONSISTENT_ROWS, MAX_SKIPPED_ROWS, \
+    count_rows_to_skip
 
-from .common import skip_rows
+from .common import SkipRowsConverter
 from .excel import xlsx_to_csv
 from .excel97 import xls_to_csv
 from .parquet import parquet_to_csv
-from .pivot import pivot_table
+from .pivot import PivotConverter
 from .spss import spss_to_csv
 from .stata import stata_to_csv
-from .tsv import tsv_to_csv
+from .tsv import TsvConverter
+from .utils import stream_rows
 
 
 logger = logging.getLogger(__name__)
@@ -91,103 +95,140 @@ def detect_format_convert_to_csv(dataset_path, convert_dataset, materialize):
         # Update file
         dataset_path = convert_dataset(spss_to_csv, dataset_path)
 
-    # Check for TSV file format
+    # Detect the layout of the CSV file from its first lines
+    delimiter, non_data_rows, pivot = detect_csv_layout(dataset_path)
+
+    # Update metadata
+    converters = []
+    if delimiter != ',':
+        logger.info("Detected separator is %r", delimiter)
+        materialize.setdefault('convert', []).append({
+            'identifier': 'tsv',
+            'separator': delimiter,
+        })
+        converters.append(TsvConverter(None, separator=delimiter))
+    if non_data_rows > 0:
+        logger.info("Detected %d lines to skip", non_data_rows)
+        materialize.setdefault('convert', []).append({
+            'identifier': 'skip_rows',
+            'nb_rows': non_data_rows,
+        })
+        converters.append(SkipRowsConverter(None, nb_rows=non_data_rows))
+    if pivot is not None:
+        except_columns, date_label = pivot
+        logger.info("Detected pivoted table")
+        materialize.setdefault('convert', []).append({
+            'identifier': 'pivot',
+            'except_columns': except_columns,
+            'date_label': date_label,
+        })
+        converters.append(PivotConverter(
+            None,
+            except_columns=except_columns,
+            date_label=date_label,
+        ))
+
+    # Update file, applying all the conversions at once
+    if converters:
+        def convert(source_filename, dest_fileobj):
+            with open(source_filename, 'r') as src_fp:
+                src = csv.reader(src_fp, delimiter=delimiter)
+                dst = csv.writer(dest_fileobj)
+                dst.writerows(stream_rows(converters, src))
+
+        dataset_path = convert_dataset(convert, dataset_path)
+
+    return dataset_path
+
+
+def _is_year(name, max_year=datetime.utcnow().year + 2):
+    if len(name) != 4:
+        return False
+    try:
+        return 1900 <= int(name) <= max_year
+    except ValueError:
+        return False
+
+
+def _detect_pivot(columns):
+    """Detect a pivoted temporal table from its header.
+
+    :return: ``(except_columns, date_label)`` or None
+    """
+    if len(columns) < 3:
+        return None
+    max_non_matches = max(2.0, 0.20 * len(columns))
+
+    # Look for years
+    non_years = [
+        i for i, name in enumerate(columns)
+        if not _is_year(name)
+    ]
+
+    # Look for dates, which is slower, so stop as soon as the result can't
+    # be used: either too many non-dates, or more than non-years
+    if len(non_years) <= max_non_matches:
+        max_non_dates = len(non_years)
+    else:
+        max_non_dates = max_non_matches
+    non_dates = []
+    for i, name in enumerate(columns):
+        if parse_date(name) is None:
+            non_dates.append(i)
+            if len(non_dates) > max_non_dates:
+                break
+
+    # If there's enough matches, pivot
+    if len(non_dates) <= max_non_dates:
+        return non_dates, 'date'
+    elif len(non_years) <= max_non_matches:
+        return non_years, 'year'
+    else:
+        return None
+
+
+def detect_csv_layout(dataset_path):
+    """Detect the separator, non-data rows, and pivoting of a CSV file.
+
+    This only reads the beginning of the file, once.
+
+    :return: ``(delimiter, non_data_rows, pivot)`` where `pivot` is either
+        None or ``(except_columns, date_label)``
+    """
+    min_lines = MAX_SKIPPED_ROWS + HEADER_CONSISTENT_ROWS + 1
     with open(dataset_path, 'r') as fp:
-        # Read at least 65kB and 3 lines, and at most 5MB
+        # Read at least 65kB and enough lines, and at most 5MB
         sample = fp.read(65536)
         newlines = sample.count('\n')
-        while newlines < 3 and len(sample) < 5242880:
+        at_end = len(sample) < 65536
+        while newlines < min_lines and len(sample) < 5242880:
             more = fp.read(65536)
             if not more:
+                at_end = True
                 break
             sample += more
             newlines += more.count('\n')
+    if not at_end and newlines > 0:
+        # Drop the last line, which is likely incomplete
+        sample = sample[:sample.rindex('\n') + 1]
 
-        # Run the sniffer
-        dialect = csv.get_dialect('excel')
-        if newlines >= 3:
-            try:
-                dialect = csv.Sniffer().sniff(sample, DELIMITERS)
-            except Exception as error:  # csv.Error, UnicodeDecodeError
-                logger.warning("csv.Sniffer error: %s", error)
-        else:
-            logger.warning("Lines are too long to use csv.Sniffer")
-    if getattr(dialect, 'delimiter', ',') != ',':
-        # Update metadata
-        logger.info("Detected separator is %r", dialect.delimiter)
-        materialize.setdefault('convert', []).append({
-            'identifier': 'tsv',
-            'separator': dialect.delimiter,
-        })
-
-        # Update file
-        dataset_path = convert_dataset(
-            lambda s, d: tsv_to_csv(s, d, separator=dialect.delimiter),
-            dataset_path,
-        )
+    # Run the sniffer
+    dialect = csv.get_dialect('excel')
+    if newlines >= 3:
+        try:
+            dialect = csv.Sniffer().sniff(sample, DELIMITERS)
+        except Exception as error:  # csv.Error, UnicodeDecodeError
+            logger.warning("csv.Sniffer error: %s", error)
+    else:
+        logger.warning("Lines are too long to use csv.Sniffer")
+    delimiter = getattr(dialect, 'delimiter', ',')
 
     # Check for non-data rows at the top of the file
-    with open(dataset_path, 'r') as fp:
-        non_data_rows = count_rows_to_skip(fp)
-        if non_data_rows > 0:
-            # Update metadata
-            logger.info("Detected %d lines to skip", non_data_rows)
-            materialize.setdefault('convert', []).append({
-                'identifier': 'skip_rows',
-                'nb_rows': non_data_rows,
-            })
-
-            # Update file
-            dataset_path = convert_dataset(
-                lambda s, d: skip_rows(s, d, nb_rows=non_data_rows),
-                dataset_path,
-            )
+    non_data_rows = count_rows_to_skip(io.StringIO(sample), delimiter)
 
     # Check for pivoted temporal table
-    with open(dataset_path, 'r') as fp:
-        reader = csv.reader(fp)
-        try:
-            columns = next(iter(reader))
-        except StopIteration:
-            columns = []
-    if len(columns) >= 3:
-        # Look for dates
-        non_dates = [
-            i for i, name in enumerate(columns)
-            if parse_date(name) is None
-        ]
-
-        # Look for years
-        def is_year(name, max_year=datetime.utcnow().year + 2):
-            if len(name) != 4:
-                return False
-            try:
-                return 1900 <= int(name) <= max_year
-            except ValueError:
-                return False
-        non_years = [
-            i for i, name in enumerate(columns)
-            if not is_year(name)
-        ]
-
-        # If there's enough matches, pivot
-        non_matches = min([non_dates, non_years], key=len)
-        if len(non_matches) <= max(2.0, 0.20 * len(columns)):
-            date_label = 'year' if non_matches is non_years else 'date'
-
-            # Update metadata
-            logger.info("Detected pivoted table")
-            materialize.setdefault('convert', []).append({
-                'identifier': 'pivot',
-                'except_columns': non_matches,
-                'date_label': date_label,
-            })
-
-            # Update file
-            dataset_path = convert_dataset(
-                lambda path, dst: pivot_table(path, dst,
-                                              non_matches, date_label),
-                dataset_path,
-            )
+    rows = csv.reader(io.StringIO(sample), delimiter=delimiter)
+    columns = next(itertools.islice(rows, non_data_rows, None), [])
+    pivot = _detect_pivot(columns)
 
-    return dataset_path
+    return delimiter, non_data_rows, pivot
@@ -1,21 +1,321 @@
 import fastparquet
+import io
+import numpy
+import pandas
+import re
 
+from datamart_materialize import types
 from datamart_materialize.utils import SimpleConverter
 
 
+# Number of rows in each row group of the Parquet files we write
+ROW_GROUP_ROWS = 100000
+
+# How values are formatted in the CSV version of a Parquet file
+FLOAT_FORMAT = '%g'
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
 def parquet_to_csv(source_filename, dest_fileobj):
     src = fastparquet.ParquetFile(source_filename)
     for i, chunk in enumerate(src.iter_row_groups()):
         chunk.to_csv(
             dest_fileobj,
             header=(i == 0),
-            float_format='%g',
-            date_format='%Y-%m-%dT%H:%M:%S',
+            float_format=FLOAT_FORMAT,
+            date_format=DATE_FORMAT,
             index=False,
             line_terminator='\r\n',
         )
 
 
+def _rechunk(frames, rows):
+    """Split and concatenate DataFrames into chunks of `rows` rows.
+    """
+    pending = []
+    pending_rows = 0
+    for frame in frames:
+        while len(frame):
+            part = frame.iloc[:rows - pending_rows]
+            frame = frame.iloc[len(part):]
+            pending.append(part)
+            pending_rows += len(part)
+            if pending_rows == rows:
+                yield pandas.concat(pending) if len(pending) > 1 else part
+                pending = []
+                pending_rows = 0
+    if pending:
+        yield pandas.concat(pending) if len(pending) > 1 else pending[0]
+
+
+def _format_column(values):
+    """Format the values of a column like `parquet_to_csv()` does.
+
+    Missing values become empty strings. Returns None if the column has a
+    type that this doesn't handle.
+    """
+    dtype = values.dtype
+    if not isinstance(dtype, numpy.dtype):
+        # Extension type (e.g. nullable integers)
+        return None
+    elif dtype.kind in 'iub':
+        return values.astype(str).values
+    elif dtype.kind == 'f':
+        return numpy.array(
+            [FLOAT_FORMAT % v if v == v else '' for v in values.tolist()],
+            dtype=object,
+        )
+    elif dtype.kind == 'M':
+        return values.dt.strftime(DATE_FORMAT).fillna('').values
+    elif (
+        dtype.kind == 'O'
+        and pandas.api.types.infer_dtype(values, skipna=True) in (
+            'string', 'empty',
+        )
+    ):
+        if values.hasnans:
+            values = values.fillna('')
+        return values.values
+    else:
+        return None
+
+
+def _format_as_text(frame):
+    """Format all the values like `parquet_to_csv()` does.
+
+    Returns None if a column has a type that this doesn't handle.
+    """
+    columns = []
+    for _, values in frame.items():
+        text = _format_column(values)
+        if text is None:
+            return None
+        columns.append(text)
+    result = pandas.DataFrame(dict(enumerate(columns)), dtype=object)
+    result.columns = [str(name) for name in frame.columns]
+    return result
+
+
+# Values that pandas.read_csv() reads as missing by default
+NA_VALUES = list(pandas._libs.parsers.STR_NA_VALUES)
+
+# Text that pandas.read_csv() reads as an integer or float, as written by
+# parquet_to_csv(), and anything else it might read as a number
+_INTEGER_RE = r'-?[0-9]{1,18}'
+_FLOAT_RE = r'-?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?|-?inf'
+_NUMBER_RE = (
+    r'[^\S\n]*[-+]?'
+    r'(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?'
+    r'[^\S\n]*'
+    r'|[^\S\n]*[-+]?(?i:inf|infinity)[^\S\n]*'
+)
+
+
+def _lines_re(pattern):
+    """Match lines that all match a pattern.
+    """
+    return re.compile(r'(?:(?:{0})\n)*(?:{0})'.format(pattern))
+
+
+_INTEGER_LINES = _lines_re(_INTEGER_RE)
+_FLOAT_LINES = _lines_re(_FLOAT_RE)
+_NUMBER_LINES = _lines_re(_NUMBER_RE)
+_BIG_INTEGER_LINE = re.compile(r'^-?[0-9]{19,}$', re.MULTILINE)
+
+_TRUE_VALUES = {'True', 'TRUE', 'true'}
+_FALSE_VALUES = {'False', 'FALSE', 'false'}
+
+
+def _parse_float_column(values):
+    """Read floats like `pandas.read_csv()` reads them from `%g` text.
+    """
+    values = numpy.array(
+        [float(FLOAT_FORMAT % v) for v in values.tolist()],
+        dtype=numpy.float64,
+    )
+    # Integers without an exponent are read as int64
+    if (
+        len(values)
+        and numpy.isfinite(values).all()
+        and (numpy.abs(values) < 1e6).all()
+        and (numpy.floor(values) == values).all()
+    ):
+        return values.astype(numpy.int64)
+    return values
+
+
+def _parse_text_column(text):
+    """Read text like `pandas.read_csv()` does, with its default options.
+
+    Returns None for values that this can't be sure about (such as numbers
+    with spaces or signs), for which the CSV parser has to be used.
+    """
+    text = pandas.Series(text, dtype=object)
+    missing = text.isin(NA_VALUES).values
+    present = text.values[~missing].tolist()
+    if not present:
+        return numpy.full(len(text), numpy.nan)
+
+    # Check all the values at once, one per line
+    lines = '\n'.join(present)
+    if lines.count('\n') != len(present) - 1:
+        # Some values have line breaks, this is text
+        if _NUMBER_LINES.fullmatch(lines):
+            return None
+        numbers = None
+    elif _INTEGER_LINES.fullmatch(lines):
+        numbers = numpy.array(present, dtype=str).astype(numpy.int64)
+    elif (
+        _FLOAT_LINES.fullmatch(lines)
+        # Integers that might overflow are not read as floats
+        and not _BIG_INTEGER_LINE.search(lines)
+    ):
+        # Use the parser's own float conversion, which is not always the
+        # same as Python's for long decimals
+        numbers = pandas.read_csv(
+            io.StringIO(lines),
+            header=None,
+            dtype=numpy.float64,
+            na_filter=False,
+        ).iloc[:, 0].values
+    elif _NUMBER_LINES.fullmatch(lines):
+        return None
+    else:
+        numbers = None
+
+    if numbers is None:
+        # Not numbers, maybe booleans
+        if present[0] in _TRUE_VALUES or present[0] in _FALSE_VALUES:
+            is_true = numpy.isin(present, list(_TRUE_VALUES))
+            is_false = numpy.isin(present, list(_FALSE_VALUES))
+            if (is_true | is_false).all():
+                numbers = is_true
+        if numbers is None:
+            result = text.values.copy()
+            result[missing] = numpy.nan
+            return result
+        elif not missing.any():
+            return numbers
+        result = numpy.full(len(text), numpy.nan, dtype=object)
+    else:
+        if not missing.any():
+            return numbers
+        result = numpy.full(len(text), numpy.nan)
+    result[~missing] = numbers
+    return result
+
+
+def _parse_column(values):
+    """Get what `pandas.read_csv()` reads from the CSV version of a column.
+
+    Returns None if the CSV parser has to be used.
+    """
+    dtype = values.dtype
+    if isinstance(dtype, numpy.dtype):
+        if dtype.kind in 'ib':
+            return values.values
+        elif dtype.kind == 'f' and not values.isna().any():
+            return _parse_float_column(values)
+    text = _format_column(values)
+    if text is None:
+        return None
+    return _parse_text_column(text)
+
+
+def _read_as_csv(frame, **kwargs):
+    """Write a DataFrame to CSV like `parquet_to_csv()` and read it back.
+    """
+    buf = io.StringIO()
+    frame.to_csv(
+        buf,
+        float_format=FLOAT_FORMAT,
+        date_format=DATE_FORMAT,
+        index=False,
+    )
+    buf.seek(0)
+    return pandas.read_csv(buf, **kwargs)
+
+
+def _read_typed(frame):
+    """Get what ``pandas.read_csv()`` reads from the CSV version of a chunk.
+
+    Each column is converted directly, applying the type and missing value
+    rules of the CSV parser, only the columns that can't be are written out
+    as CSV and parsed back.
+    """
+    if frame.shape[1] == 1:
+        # Rows with an empty value are blank lines, which the parser skips
+        return _read_as_csv(frame)
+    columns = []
+    for i in range(frame.shape[1]):
+        values = frame.iloc[:, i]
+        result = _parse_column(values)
+        if result is None:
+            # Add another column so there are no blank lines
+            result = _read_as_csv(
+                pandas.DataFrame({'values': values.values, 'other': 0}),
+            ).iloc[:, 0].values
+        columns.append(result)
+    result = pandas.DataFrame(dict(enumerate(columns)))
+    result.columns = [str(name) for name in frame.columns]
+    return result
+
+
+def read_frames_as_csv(frames, names, chunksize, **kwargs):
+    """Turn DataFrames read from Parquet into what reading the CSV gives.
+
+    The chunks are the same as what ``pandas.read_csv(chunksize=chunksize,
+    **kwargs)`` returns when reading the CSV version of the data, as written
+    by `parquet_to_csv()`. Without options, or for text (``dtype=str,
+    na_filter=False``), the values are converted directly, with other options
+    each chunk goes through CSV.
+
+    :param frames: Iterable of DataFrames
+    :param names: The column names, in case there are no rows
+    """
+    if kwargs == {'dtype': str, 'na_filter': False}:
+        convert = _format_as_text
+    elif not kwargs:
+        convert = _read_typed
+    else:
+        convert = None
+    start = 0
+    for chunk in _rechunk(frames, chunksize):
+        result = None
+        if convert is not None:
+            result = convert(chunk)
+        if result is None:
+            result = _read_as_csv(chunk, **kwargs)
+        result.index = pandas.RangeIndex(start, start + len(result))
+        start += len(result)
+        yield result
+    if start == 0:
+        # Like pandas.read_csv(), return a single empty chunk
+        yield pandas.DataFrame(
+            columns=[str(name) for name in names],
+            index=pandas.RangeIndex(0),
+            dtype=object,
+        )
+
+
+def read_parquet_as_csv(source, chunksize, columns=None, **kwargs):
+    """Read a Parquet file like its CSV version, with `read_frames_as_csv()`.
+
+    :param columns: Names of the columns to read, only those are loaded
+    """
+    src = fastparquet.ParquetFile(source)
+    if columns is None:
+        names = src.columns
+    else:
+        names = columns
+    return read_frames_as_csv(
+        src.iter_row_groups(columns=columns),
+        names,
+        chunksize,
+        **kwargs,
+    )
+
+
 class ParquetConverter(SimpleConverter):
     """Adapter pivoting a table.
     """
@@ -24,3 +324,84 @@ class ParquetConverter(SimpleConverter):
             source_filename,
             dest_fileobj,
         )
+
+
+def _parse_exactly(values, dtype):
+    """Parse text into numbers, if `parquet_to_csv()` writes them back as-is.
+
+    Returns None if some values can't be stored as numbers of this type
+    without changing the text (e.g. ``1.50``, ``1e3``, or empty values).
+    """
+    try:
+        numbers = values.astype(dtype)
+    except (ValueError, OverflowError):
+        return None
+    if numbers.dtype.kind == 'f':
+        text = [FLOAT_FORMAT % v for v in numbers.tolist()]
+    else:
+        text = numbers.astype(str).tolist()
+    if text != values.tolist():
+        return None
+    return numbers.values
+
+
+def csv_to_parquet(source_filename, destination, columns,
+                   row_group_rows=ROW_GROUP_ROWS):
+    """Convert a CSV file to a typed Parquet file.
+
+    Columns profiled as integers or floats are stored as numbers if all their
+    values would be written back the same by `parquet_to_csv()`, other columns
+    are stored as text. This way, reading the file with
+    `read_parquet_as_csv()` gives the same data as reading the CSV. Each row
+    group holds `row_group_rows` rows and has statistics (minimum and maximum
+    values).
+
+    The CSV is read twice, first to find which columns can be stored as
+    numbers, then to write the file.
+
+    :param columns: Column metadata, from the profiler
+    """
+    numeric = {}
+    for i, column in enumerate(columns):
+        if column['structural_type'] == types.INTEGER:
+            numeric[i] = 'int64'
+        elif column['structural_type'] == types.FLOAT:
+            numeric[i] = 'float64'
+
+    def read_chunks():
+        return pandas.read_csv(
+            source_filename,
+            dtype=str,
+            na_filter=False,
+            chunksize=row_group_rows,
+        )
+
+    # Find the columns that can be stored as numbers
+    for chunk in read_chunks():
+        if chunk.shape[1] != len(columns):
+            raise ValueError(
+                "CSV has %d columns, metadata has %d" % (
+                    chunk.shape[1], len(columns),
+                ),
+            )
+        for i, dtype in list(numeric.items()):
+            if _parse_exactly(chunk.iloc[:, i], dtype) is None:
+                del numeric[i]
+
+    # Write the file, one row group per chunk
+    for nb, chunk in enumerate(read_chunks()):
+        arrays = {}
+        for i in range(chunk.shape[1]):
+            if i in numeric:
+                arrays[i] = _parse_exactly(chunk.iloc[:, i], numeric[i])
+            else:
+                arrays[i] = chunk.iloc[:, i].values
+        table = pandas.DataFrame(arrays)
+        table.columns = chunk.columns
+        fastparquet.write(
+            destination, table,
+            row_group_offsets=row_group_rows,
+            write_index=False,
+            object_encoding='utf8',
+            append=nb > 0,
+        )
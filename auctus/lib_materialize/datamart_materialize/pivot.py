@@ -1,6 +1,6 @@
 import csv
 
-from datamart_materialize.utils import SimpleConverter
+from datamart_materialize.utils import StreamingConverter
 
 
 VALUE_COLUMN_LABEL = 'value'
@@ -39,7 +39,7 @@ def pivot_table(
                 dst.writerow(carried_values + [date, row[date_idx]])
 
 
-class PivotConverter(SimpleConverter):
+class PivotConverter(StreamingConverter):
     """Adapter pivoting a table.
     """
     def __init__(self, writer, *, except_columns, date_label='date'):
@@ -47,10 +47,30 @@ class PivotConverter(SimpleConverter):
         self.except_columns = except_columns
         self.date_label = date_label
 
-    def transform(self, source_filename, dest_fileobj):
-        pivot_table(
-            source_filename,
-            dest_fileobj,
-            self.except_columns,
-            self.date_label,
-        )
+    def begin(self):
+        self._dates = None
+
+    def transform_row(self, row):
+        if self._dates is None:
+            # Read original columns, some are carried over
+            carried_columns = [row[i] for i in self.except_columns]
+            self._dates = [
+                (i, name) for i, name in enumerate(row)
+                if i not in self.except_columns
+            ]
+
+            # Generate new header
+            return [
+                carried_columns + [self.date_label, VALUE_COLUMN_LABEL],
+            ]
+
+        carried_values = [row[i] for i in self.except_columns]
+        return [
+            carried_values + [date, row[date_idx]]
+            for date_idx, date in self._dates
+        ]
+
+    def end(self):
+        if self._dates is None:
+            raise ValueError("Empty table")
+        return ()
@@ -1,6 +1,6 @@
 import csv
 
-from datamart_materialize.utils import SimpleConverter
+from datamart_materialize.utils import StreamingConverter
 
 
 def tsv_to_csv(source_filename, dest_fileobj, separator='\t'):
@@ -11,12 +11,12 @@ def tsv_to_csv(source_filename, dest_fileobj, separator='\t'):
             dst.writerow(line)
 
 
-class TsvConverter(SimpleConverter):
+class TsvConverter(StreamingConverter):
     """Adapter converting a TSV or other separated file to CSV.
     """
     def __init__(self, writer, separator='\t'):
-        self.separator = separator
+        self.separator = self.delimiter = separator
         super(TsvConverter, self).__init__(writer)
 
-    def transform(self, source_filename, dest_fileobj):
-        tsv_to_csv(source_filename, dest_fileobj, separator=self.separator)
+    def transform_row(self, row):
+        return (row,)
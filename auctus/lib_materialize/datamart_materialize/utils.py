@@ -1,4 +1,8 @@
+import codecs
+import csv
+import io
 import os
+import sys
 import tempfile
 
 
@@ -63,6 +67,12 @@ class SimpleConverter(object):
             temp_file, fp,
         )
 
+    def convert_file(self, source_filename, name=None):
+        """Convert an existing file, writing to the next writer.
+        """
+        with self.writer.open_file('w', name) as dst:
+            self.transform(source_filename, dst)
+
     def finish(self):
         self.dir.cleanup()
         self.dir = None
@@ -70,3 +80,281 @@ class SimpleConverter(object):
     @staticmethod
     def transform(source_filename, dest_fileobj):
         raise NotImplementedError
+
+
+class _CsvRowSink(object):
+    """Writes rows to a file object as CSV.
+    """
+    def __init__(self, fileobj):
+        self._fp = fileobj
+        self._writer = csv.writer(fileobj)
+
+    def writerow(self, row):
+        self._writer.writerow(row)
+
+    def close(self, exc=None, value=None, tb=None):
+        self._fp.__exit__(exc, value, tb)
+
+
+class _ConverterRowSink(object):
+    """Feeds rows through a `StreamingConverter` then to the next sink.
+    """
+    def __init__(self, converter, downstream):
+        self._converter = converter
+        self._downstream = downstream
+        converter.begin()
+
+    def writerow(self, row):
+        for out in self._converter.transform_row(row):
+            self._downstream.writerow(out)
+
+    def close(self, exc=None, value=None, tb=None):
+        if exc is None:
+            try:
+                for out in self._converter.end():
+                    self._downstream.writerow(out)
+            except BaseException:
+                self._downstream.close(*sys.exc_info())
+                raise
+        self._downstream.close(exc, value, tb)
+
+
+# If a record is longer than this, the rest of the stream goes through a
+# temporary file instead of memory
+MAX_PENDING = 16 << 20  # 16 MB
+
+# States of the record scanner, see StreamingConverterProxy._scan()
+_START_FIELD, _IN_FIELD, _IN_QUOTED_FIELD, _QUOTE_IN_QUOTED_FIELD = range(4)
+
+
+class StreamingConverterProxy(object):
+    """File object parsing CSV data as it is written, feeding rows to a sink.
+
+    Only complete records are parsed, records can span multiple writes and
+    multiple lines (quoted fields). If a record gets longer than
+    `MAX_PENDING` characters, for example because of an unterminated quoted
+    field, the rest of the data is written to a temporary file and parsed
+    when the file is closed.
+    """
+    def __init__(self, sink, mode, delimiter):
+        if mode == 'wb':
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            self._empty = b''
+        elif mode == 'w':
+            decoder = None
+            self._empty = ''
+        else:
+            raise ValueError("Invalid write mode %r" % mode)
+        # Translate newlines like open() does in text mode
+        self._decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+        self._sink = sink
+        self._delimiter = delimiter
+        # Text written after the last complete record
+        self._pending = []
+        self._pending_size = 0
+        # Where the scanner is at the end of the pending text
+        self._state = _START_FIELD
+        self._spool = None
+        self._closed = False
+
+    def _parse(self, fp):
+        for row in csv.reader(fp, delimiter=self._delimiter):
+            self._sink.writerow(row)
+
+    def _scan(self, text):
+        """Find the end of the last complete record in new text.
+
+        This follows the states of `csv.reader`, resuming from where the
+        previous text left off: a quote only starts a quoted field at the
+        beginning of a field, elsewhere it is a literal character.
+
+        Returns the position after the last record's newline, or -1.
+        """
+        last = -1
+        pos = 0
+        state = self._state
+        while True:
+            if state == _IN_QUOTED_FIELD:
+                quote = text.find('"', pos)
+                if quote == -1:
+                    break
+                pos = quote + 1
+                state = _QUOTE_IN_QUOTED_FIELD
+            elif state == _QUOTE_IN_QUOTED_FIELD:
+                if pos == len(text):
+                    break
+                if text[pos] == '"':
+                    # Escaped quote
+                    pos += 1
+                    state = _IN_QUOTED_FIELD
+                else:
+                    # End of the quoted part, anything until the delimiter
+                    # gets added to the field
+                    state = _IN_FIELD
+            else:
+                # Unquoted text, up to the next quote
+                quote = text.find('"', pos)
+                end = len(text) if quote == -1 else quote
+                if end > pos:
+                    newline = text.rfind('\n', pos, end)
+                    if newline != -1:
+                        last = newline + 1
+                    if text[end - 1] in ('\n', self._delimiter):
+                        state = _START_FIELD
+                    else:
+                        state = _IN_FIELD
+                if quote == -1:
+                    break
+                if state == _START_FIELD:
+                    state = _IN_QUOTED_FIELD
+                pos = quote + 1
+        self._state = state
+        return last
+
+    def write(self, buffer):
+        text = self._decoder.decode(buffer)
+        if self._spool is not None:
+            self._spool.write(text)
+            return len(buffer)
+
+        cut = self._scan(text)
+        if cut == -1:
+            self._pending.append(text)
+            self._pending_size += len(text)
+            if self._pending_size > MAX_PENDING:
+                self._spool = tempfile.TemporaryFile(
+                    'w+', encoding='utf-8', newline='',
+                    prefix='datamart_stream_',
+                )
+                self._spool.writelines(self._pending)
+                self._pending = None
+            return len(buffer)
+
+        self._pending.append(text[:cut])
+        records = ''.join(self._pending)
+        self._pending = [text[cut:]]
+        self._pending_size = len(self._pending[0])
+        self._parse(io.StringIO(records))
+        return len(buffer)
+
+    def flush(self):
+        pass
+
+    def _finish(self, exc=None, value=None, tb=None):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if exc is None:
+                text = self._decoder.decode(self._empty, final=True)
+                if self._spool is not None:
+                    self._spool.write(text)
+                    self._spool.seek(0, 0)
+                    self._parse(self._spool)
+                else:
+                    self._pending.append(text)
+                    self._parse(io.StringIO(''.join(self._pending)))
+        except BaseException:
+            self._sink.close(*sys.exc_info())
+            raise
+        finally:
+            if self._spool is not None:
+                self._spool.close()
+        self._sink.close(exc, value, tb)
+
+    def close(self):
+        self._finish()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, tb):
+        self._finish(exc, value, tb)
+
+
+class StreamingConverter(object):
+    """Base class for converters transforming CSV rows one at a time.
+
+    Subclasses implement `transform_row()` (and optionally `begin()` and
+    `end()`). Unlike `SimpleConverter`, no temporary file is used: data is
+    parsed as it is written, and rows are handed directly to the next
+    converter if it is also a `StreamingConverter`.
+    """
+    delimiter = ','
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    def set_metadata(self, dataset_id, metadata):
+        self.writer.set_metadata(dataset_id, metadata)
+
+    def open_rows(self, name=None):
+        """Get a sink to which rows can be written, and that needs closing.
+        """
+        if isinstance(self.writer, StreamingConverter):
+            downstream = self.writer.open_rows(name)
+        else:
+            downstream = _CsvRowSink(
+                self.writer.open_file('w', name).__enter__(),
+            )
+        return _ConverterRowSink(self, downstream)
+
+    def open_file(self, mode='wb', name=None):
+        return StreamingConverterProxy(
+            self.open_rows(name),
+            mode,
+            self.delimiter,
+        )
+
+    def convert_file(self, source_filename, name=None):
+        """Convert an existing file, writing to the next writer.
+        """
+        sink = self.open_rows(name)
+        try:
+            with open(source_filename, 'r', encoding='utf-8') as src_fp:
+                for row in csv.reader(src_fp, delimiter=self.delimiter):
+                    sink.writerow(row)
+        except BaseException:
+            sink.close(*sys.exc_info())
+            raise
+        sink.close()
+
+    def transform(self, source_filename, dest_fileobj):
+        dst = csv.writer(dest_fileobj)
+        self.begin()
+        with open(source_filename, 'r', encoding='utf-8') as src_fp:
+            for row in csv.reader(src_fp, delimiter=self.delimiter):
+                dst.writerows(self.transform_row(row))
+        dst.writerows(self.end())
+
+    def finish(self):
+        return self.writer.finish()
+
+    def begin(self):
+        """Called before the first row."""
+
+    def transform_row(self, row):
+        """Transform a row, returning the resulting rows (maybe none)."""
+        raise NotImplementedError
+
+    def end(self):
+        """Called after the last row, returning more rows to write."""
+        return ()
+
+
+def stream_rows(converters, rows):
+    """Run rows through some `StreamingConverter`, ignoring their writers.
+
+    :param converters: Converters to apply, in order
+    :param rows: Iterable of input rows
+    :return: Iterator of output rows
+    """
+    def stage(converter, rows):
+        converter.begin()
+        for row in rows:
+            yield from converter.transform_row(row)
+        yield from converter.end()
+
+    for converter in converters:
+        rows = stage(converter, rows)
+    return iter(rows)
@@ -8,6 +8,7 @@ import sys
 import tempfile
 
 from datamart_profiler import process_dataset
+from datamart_profiler.numerical import RANGE_ESTIMATORS
 
 
 logger = logging.getLogger('datamart_profiler.__main__')
@@ -74,6 +75,16 @@ def main():
     parser.add_argument('--load-max-size', action='store', nargs=1,
                         help="target size of the data to be analyzed. The "
                              "data will be randomly sampled if it is bigger")
+    parser.add_argument('--load-single-pass',
+                        action='store_true', default=False,
+                        help="sample the data while reading it only once")
+    parser.add_argument('--workers', action='store', type=int, default=None,
+                        help="number of processes used to profile columns "
+                             "in parallel")
+    parser.add_argument('--range-estimator', action='store',
+                        choices=sorted(RANGE_ESTIMATORS), default='kmeans',
+                        help="clustering algorithm used to compute data "
+                             "ranges")
     parser.add_argument('file', nargs=1, help="file to profile")
     if detect_format_convert_to_csv is None:
         parser.add_argument(
@@ -174,6 +185,9 @@ def main():
                 coverage=args.coverage,
                 plots=args.plots,
                 load_max_size=load_max_size,
+                load_single_pass=args.load_single_pass,
+                workers=args.workers,
+                range_estimator=args.range_estimator,
             )
         except (pandas.errors.ParserError, UnicodeError):
             if detect_format_convert_to_csv is None:
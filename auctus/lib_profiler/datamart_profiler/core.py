@@ -1,12 +1,17 @@
 import codecs
 import collections
+import concurrent.futures
 import contextlib
 import csv
 from datetime import datetime
+import io
 import itertools
 import logging
 import math
+import multiprocessing
 import numpy
+import opentelemetry.context
+import opentelemetry.propagate
 import opentelemetry.trace
 import os
 import pandas
@@ -18,7 +23,8 @@ import random
 import re
 import warnings
 
-from .numerical import mean_stddev, get_numerical_ranges
+from .numerical import RANGE_ESTIMATORS, mean_stddev, \
+    get_numerical_ranges, parse_numerical_values
 from .profile_types import identify_types, determine_dataset_type
 from .spatial import LatLongColumn, Geohasher, nominatim_resolve_all, \
     pair_latlong_columns, get_spatial_ranges, parse_wkt_column
@@ -35,6 +41,12 @@ RANDOM_SEED = 89
 MAX_SIZE = 5000000  # 5 MB
 SAMPLE_ROWS = 20
 
+SINGLE_PASS_OVERSAMPLE = 1.1
+"""Rows are kept with a probability that much higher than the sample ratio
+during single-pass sampling, to have enough to choose from at the end"""
+
+SINGLE_PASS_BLOCK_SIZE = 1 << 20  # 1 MiB
+
 MAX_UNCLEAN_ADDRESSES = 0.20  # 20%
 
 
@@ -132,7 +144,7 @@ def _lazo_retry(func):
     return func()
 
 
-def count_rows_to_skip(file):
+def count_rows_to_skip(file, delimiter=','):
     """Count non-data rows at the top, such as titles etc.
     """
     # Check whether this is a binary file
@@ -143,9 +155,9 @@ def count_rows_to_skip(file):
     # Decode CSV
     if binary:
         codec_reader = codecs.getreader('utf-8')(file)
-        reader = csv.reader(codec_reader)
+        reader = csv.reader(codec_reader, delimiter=delimiter)
     else:
-        reader = csv.reader(file)
+        reader = csv.reader(file, delimiter=delimiter)
 
     # Read rows until the number of items stabilizes
     run_start = 0
@@ -173,7 +185,124 @@ def count_rows_to_skip(file):
         file.seek(0, 0)
 
 
-def load_data(data, load_max_size=None, indexes=True):
+def iter_csv_records(file):
+    """Iterate on the records of a CSV file, as raw lines.
+
+    Lines are joined back together when a quoted value spans multiple lines.
+    """
+    quote = None
+    pending = None
+    for line in file:
+        if quote is None:
+            quote = b'"' if isinstance(line, bytes) else '"'
+        if pending is not None:
+            line = pending + line
+        if line.count(quote) % 2 == 1:
+            # Quote is still open, the record continues on the next line
+            pending = line
+            continue
+        pending = None
+        yield line
+    if pending is not None:
+        yield pending
+
+
+def iter_csv_record_blocks(file, block_size=SINGLE_PASS_BLOCK_SIZE):
+    """Iterate on the records of a binary CSV file, a block at a time.
+
+    This finds the ends of the records with numpy: a newline ends a record if
+    the number of quotes before it is even.
+
+    :return: Iterator of ``(buffer, starts, ends)`` where the records are
+        ``buffer[start:end]``
+    """
+    pending = b''
+    while True:
+        block = file.read(block_size)
+        if not block:
+            break
+        buf = pending + block
+        array = numpy.frombuffer(buf, dtype=numpy.uint8)
+        newlines = numpy.flatnonzero(array == ord('\n'))
+        quote_parity = numpy.bitwise_xor.accumulate(
+            (array == ord('"')).view(numpy.uint8),
+        )
+        ends = newlines[quote_parity[newlines] == 0] + 1
+        if len(ends):
+            starts = numpy.empty_like(ends)
+            starts[0] = 0
+            starts[1:] = ends[:-1]
+            yield buf, starts, ends
+            pending = buf[ends[-1]:]
+        else:
+            pending = buf
+    if pending:
+        yield pending, numpy.array([0]), numpy.array([len(pending)])
+
+
+def sample_single_pass(file, ratio):
+    """Randomly sample the rows of a CSV file, reading it only once.
+
+    Each row gets a random priority, and only those under a threshold slightly
+    above `ratio` are kept in memory. Once the file has been read and the
+    number of rows is known, we select as many rows as the two-pass method
+    would, those with the lowest priority (or all the kept rows if there are
+    not enough).
+
+    :return: ``(dataframe, nb_rows)``, `nb_rows` counting the header like the
+        two-pass method
+    """
+    rand = numpy.random.RandomState(RANDOM_SEED)
+    threshold = ratio * SINGLE_PASS_OVERSAMPLE
+
+    # Go over the records, keeping the header and a candidate sample
+    header = None
+    kept = []
+    nb_rows = 0
+    if isinstance(file.read(0), bytes):
+        for buf, starts, ends in iter_csv_record_blocks(file):
+            priorities = rand.random_sample(len(ends))
+            for i in numpy.flatnonzero(priorities < threshold):
+                kept.append((
+                    priorities[i], nb_rows + i,
+                    buf[starts[i]:ends[i]],
+                ))
+            if header is None:
+                header = buf[starts[0]:ends[0]]
+            nb_rows += len(ends)
+    else:
+        for record in iter_csv_records(file):
+            priority = rand.random_sample()
+            if priority < threshold:
+                kept.append((priority, nb_rows, record))
+            if header is None:
+                header = record
+            nb_rows += 1
+
+    if header is None:
+        # Empty file
+        header = file.read(0)
+
+    # Keep the rows with the lowest priority, in their original order
+    kept = [row for row in kept if row[1] != 0]
+    kept.sort()
+    kept = kept[:math.ceil(ratio * (nb_rows - 1))]
+    kept.sort(key=lambda row: row[1])
+    sample = [header]
+    sample.extend(record for _, _, record in kept)
+
+    if isinstance(header, bytes):
+        sample = io.BytesIO(b''.join(sample))
+    else:
+        sample = io.StringIO(''.join(sample))
+    data = pandas.read_csv(
+        sample,
+        dtype=str, na_filter=False,
+    )
+    return data, nb_rows
+
+
+def load_data(data, load_max_size=None, indexes=True, single_pass=False):
     metadata = {}
 
     if isinstance(data, pandas.DataFrame):
@@ -245,7 +374,18 @@ def load_data(data, load_max_size=None, indexes=True):
             data.seek(0, 0)
 
             # Load the data
-            if metadata['size'] > load_max_size:
+            if metadata['size'] > load_max_size and single_pass:
+                ratio = load_max_size / metadata['size']
+                logger.info(
+                    "Loading dataframe in a single pass, sample ratio=%r...",
+                    ratio,
+                )
+                data, metadata['nb_rows'] = sample_single_pass(data, ratio)
+                if metadata['nb_rows'] > 0:
+                    metadata['average_row_size'] = (
+                        metadata['size'] / metadata['nb_rows']
+                    )
+            elif metadata['size'] > load_max_size:
                 logger.info("Counting rows...")
                 metadata['nb_rows'] = sum(1 for _ in data)
                 if metadata['nb_rows'] > 0:
@@ -293,7 +433,38 @@ def process_column(
     coverage=True,
     geo_data=None,
     nominatim=None,
+    range_estimator='kmeans',
 ):
+    resolved, is_address = _profile_column(
+        array, column_meta,
+        manual=manual,
+        plots=plots,
+        coverage=coverage,
+        geo_data=geo_data,
+        range_estimator=range_estimator,
+    )
+
+    # Resolve addresses into coordinates
+    if nominatim is not None and is_address:
+        resolve_addresses(array, column_meta, resolved, nominatim)
+
+    return resolved
+
+
+def _profile_column(
+    array, column_meta,
+    *,
+    manual,
+    plots,
+    coverage,
+    geo_data,
+    range_estimator='kmeans',
+):
+    """Profile a column, everything but resolving addresses with Nominatim.
+
+    :return: A tuple ``(resolved, is_address)`` where `is_address` indicates
+        whether addresses should be resolved for this column.
+    """
     # Identify types
     with tracer.start_as_current_span('profile/identify_types'):
         structural_type, semantic_types_dict, additional_meta = \
@@ -325,15 +496,7 @@ def process_column(
     ):
         # Get numerical values needed for either ranges or plot
         with tracer.start_as_current_span('profile/parse_numerical_values'):
-            numerical_values = []
-            for e in array:
-                try:
-                    e = float(e)
-                except ValueError:
-                    pass
-                else:
-                    if -3.4e38 < e < 3.4e38:  # Overflows in ES
-                        numerical_values.append(e)
+            numerical_values = parse_numerical_values(array)
 
         # Compute ranges from numerical values
         if coverage:
@@ -341,7 +504,10 @@ def process_column(
                 column_meta['mean'], column_meta['stddev'] = \
                     mean_stddev(numerical_values)
 
-                ranges = get_numerical_ranges(numerical_values)
+                ranges = get_numerical_ranges(
+                    numerical_values,
+                    range_estimator,
+                )
                 if ranges:
                     column_meta['coverage'] = ranges
 
@@ -443,25 +609,6 @@ def process_column(
                 ]
             }
 
-    # Resolve addresses into coordinates
-    if (
-        nominatim is not None and
-        structural_type == types.TEXT and
-        types.TEXT in semantic_types_dict and
-        types.ADMIN not in semantic_types_dict
-    ):
-        with tracer.start_as_current_span('profile/nominatim'):
-            locations, non_empty = nominatim_resolve_all(
-                nominatim,
-                array,
-            )
-        if non_empty > 0:
-            unclean_ratio = 1.0 - len(locations) / non_empty
-            if unclean_ratio <= MAX_UNCLEAN_ADDRESSES:
-                resolved['addresses'] = locations
-                if types.ADDRESS not in column_meta['semantic_types']:
-                    column_meta['semantic_types'].append(types.ADDRESS)
-
     # Set level of administrative areas
     if types.ADMIN in semantic_types_dict:
         level, areas = semantic_types_dict[types.ADMIN]
@@ -469,7 +616,183 @@ def process_column(
             column_meta['admin_area_level'] = level
         resolved['admin_areas'] = areas
 
-    return resolved
+    is_address = (
+        structural_type == types.TEXT and
+        types.TEXT in semantic_types_dict and
+        types.ADMIN not in semantic_types_dict
+    )
+
+    return resolved, is_address
+
+
+def resolve_addresses(array, column_meta, resolved, nominatim):
+    """Resolve the addresses in a column into coordinates, using Nominatim.
+    """
+    with tracer.start_as_current_span('profile/nominatim'):
+        locations, non_empty = nominatim_resolve_all(
+            nominatim,
+            array,
+        )
+    if non_empty > 0:
+        unclean_ratio = 1.0 - len(locations) / non_empty
+        if unclean_ratio <= MAX_UNCLEAN_ADDRESSES:
+            resolved['addresses'] = locations
+            if types.ADDRESS not in column_meta['semantic_types']:
+                column_meta['semantic_types'].append(types.ADDRESS)
+
+
+_worker_geo_data = None
+
+
+def _init_column_worker(geo_data_path):
+    global _worker_geo_data
+
+    if geo_data_path is not None:
+        from datamart_geo import GeoData
+
+        _worker_geo_data = GeoData(geo_data_path)
+
+
+def _dump_areas(areas):
+    """Turn admin areas into plain tuples that can be sent between processes.
+
+    `Area` objects reference the `GeoData` they come from, which can't be
+    pickled. They are rebuilt by `_load_areas()` in the parent process.
+    """
+    dumped = {}
+    result = []
+    for area in areas:
+        if area is None:
+            result.append(None)
+        else:
+            if area.id not in dumped:
+                dumped[area.id] = (
+                    area.id, area.name, area.type.value, area.levels,
+                    area.latitude, area.longitude, area.bounds,
+                )
+            result.append(dumped[area.id])
+    return result
+
+
+def _load_areas(areas, geo_data):
+    from datamart_geo import Area, Type
+
+    loaded = {}
+    result = []
+    for area in areas:
+        if area is None:
+            result.append(None)
+        else:
+            id, name, type_, levels, latitude, longitude, bounds = area
+            if id not in loaded:
+                loaded[id] = Area(
+                    geo_data, id, name, Type(type_), levels,
+                    latitude, longitude, bounds,
+                )
+            result.append(loaded[id])
+    return result
+
+
+def _profile_column_worker(
+    carrier, array, column_meta, manual, plots, coverage, range_estimator,
+):
+    # Continue the trace of the parent process
+    token = opentelemetry.context.attach(
+        opentelemetry.propagate.extract(carrier),
+    )
+    try:
+        resolved, is_address = _profile_column(
+            array, column_meta,
+            manual=manual,
+            plots=plots,
+            coverage=coverage,
+            geo_data=_worker_geo_data,
+            range_estimator=range_estimator,
+        )
+    finally:
+        opentelemetry.context.detach(token)
+    if 'admin_areas' in resolved:
+        resolved['admin_areas'] = _dump_areas(resolved['admin_areas'])
+    return column_meta, resolved, is_address
+
+
+def process_columns_parallel(
+    data, columns, manual_columns,
+    *,
+    workers,
+    plots=True,
+    coverage=True,
+    geo_data=None,
+    geo_data_path=None,
+    nominatim=None,
+    range_estimator='kmeans',
+):
+    """Profile the columns in a pool of processes.
+
+    This updates the metadata dicts in `columns` and returns the resolved
+    values like a loop over `process_column()` would. Addresses are resolved
+    with Nominatim in this process, after the column is profiled.
+
+    The worker processes open their own copy of the geo data from
+    `geo_data_path`, which should be the directory `geo_data` was loaded from.
+    """
+    if geo_data is not None and geo_data_path is None:
+        raise ValueError("geo_data_path is required to use geo_data")
+
+    resolved_columns = {}
+    # Using the 'fork' method causes deadlocks because other threads hold locks
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_column_worker,
+        initargs=(geo_data_path if geo_data is not None else None,),
+    ) as executor:
+        # Submit all the columns, each with its own span
+        tasks = []
+        for column_idx, column_meta in enumerate(columns):
+            name = column_meta['name']
+            span = tracer.start_span(
+                'profile/column',
+                attributes={'idx': column_idx, 'name': name},
+            )
+            carrier = {}
+            opentelemetry.propagate.inject(
+                carrier,
+                context=opentelemetry.trace.set_span_in_context(span),
+            )
+            logger.info("Processing column %d %r...", column_idx, name)
+            future = executor.submit(
+                _profile_column_worker,
+                carrier,
+                data.iloc[:, column_idx],
+                column_meta,
+                manual_columns.get(name),
+                plots,
+                coverage,
+                range_estimator,
+            )
+            tasks.append((span, future))
+
+        # Collect the results in order
+        for column_idx, (span, future) in enumerate(tasks):
+            with opentelemetry.trace.use_span(span, end_on_exit=True):
+                column_meta, resolved, is_address = future.result()
+                columns[column_idx].update(column_meta)
+                if 'admin_areas' in resolved:
+                    resolved['admin_areas'] = _load_areas(
+                        resolved['admin_areas'],
+                        geo_data,
+                    )
+                if nominatim is not None and is_address:
+                    resolve_addresses(
+                        data.iloc[:, column_idx],
+                        columns[column_idx],
+                        resolved,
+                        nominatim,
+                    )
+                resolved_columns[column_idx] = resolved
+
+    return resolved_columns
 
 
 @PROM_LAZO.time()
@@ -526,7 +849,8 @@ def process_dataset(data, dataset_id=None, metadata=None,
                     lazo_client=None, nominatim=None, geo_data=None,
                     search=False, include_sample=False,
                     coverage=True, plots=False, indexes=True,
-                    load_max_size=None,
+                    load_max_size=None, load_single_pass=False,
+                    workers=None, range_estimator='kmeans',
                     **kwargs):
     """Compute all metafeatures from a dataset.
 
@@ -536,8 +860,10 @@ def process_dataset(data, dataset_id=None, metadata=None,
         very limited).
     :param lazo_client: client for the Lazo Index Server
     :param nominatim: URL of the Nominatim server
-    :param geo_data: ``True`` or a datamart_geo.GeoData instance to use to
-        resolve named administrative territorial entities
+    :param geo_data: ``True``, the path to the data directory, or a
+        datamart_geo.GeoData instance to use to resolve named administrative
+        territorial entities. When using `workers`, pass ``True`` or a path so
+        the worker processes can open the data themselves.
     :param search: True if this method is being called during the search
         operation (and not for indexing).
     :param include_sample: Set to True to include a few random rows to the
@@ -550,6 +876,18 @@ def process_dataset(data, dataset_id=None, metadata=None,
     :param load_max_size: Target size of the data to be analyzed. The data will
         be randomly sampled if it is bigger. Defaults to `MAX_SIZE`, currently
         5 MB. This is different from the sample data included in the result.
+    :param load_single_pass: If True, sample the data while reading it once,
+        instead of counting the rows first then reading the selected ones.
+        This is faster and uses less memory on big files, but selects
+        different rows.
+    :param workers: Number of processes used to profile the columns in
+        parallel. Defaults to None, profiling the columns one after the other
+        in this process.
+    :param range_estimator: The clustering algorithm used to compute the
+        numerical and temporal ranges, one of the keys of
+        `datamart_profiler.numerical.RANGE_ESTIMATORS`: ``'kmeans'`` (the
+        default) or ``'ckmeans'``, an exact 1-D K-Means which is much faster
+        on long columns.
     :return: JSON structure (dict)
     """
     if 'sample_size' in kwargs:
@@ -564,10 +902,18 @@ def process_dataset(data, dataset_id=None, metadata=None,
             next(iter(kwargs))
         )
 
-    if geo_data is True:
+    if range_estimator not in RANGE_ESTIMATORS:
+        raise ValueError("Unknown range estimator %r" % (range_estimator,))
+
+    geo_data_path = None
+    if geo_data is True or isinstance(geo_data, str):
         from datamart_geo import GeoData
 
-        geo_data = GeoData.from_local_cache()
+        if geo_data is True:
+            geo_data_path = GeoData.get_local_cache_path()
+        else:
+            geo_data_path = geo_data
+        geo_data = GeoData(geo_data_path)
 
     if metadata is None:
         metadata = {}
@@ -578,6 +924,7 @@ def process_dataset(data, dataset_id=None, metadata=None,
             data,
             load_max_size=load_max_size,
             indexes=indexes,
+            single_pass=load_single_pass,
         )
     except EmptyDataError:
         logger.warning("Dataframe is empty!")
@@ -628,24 +975,37 @@ def process_dataset(data, dataset_id=None, metadata=None,
     logger.info("Identifying types, %d columns...", len(columns))
     with PROM_TYPES.time():
         with tracer.start_as_current_span('profile/columns'):
-            for column_idx, column_meta in enumerate(columns):
-                name = column_meta['name']
-                with tracer.start_as_current_span('profile/column', attributes={'idx': column_idx, 'name': name}):
-                    logger.info("Processing column %d %r...", column_idx, name)
-                    array = data.iloc[:, column_idx]
-                    if name in manual_columns:
-                        manual = manual_columns[name]
-                    else:
-                        manual = None
-                    # Process the column, updating the column_meta dict
-                    resolved_columns[column_idx] = process_column(
-                        array, column_meta,
-                        manual=manual,
-                        plots=plots,
-                        coverage=coverage,
-                        geo_data=geo_data,
-                        nominatim=nominatim,
-                    )
+            if workers is not None and workers > 1 and len(columns) > 1:
+                resolved_columns = process_columns_parallel(
+                    data, columns, manual_columns,
+                    workers=min(workers, len(columns)),
+                    plots=plots,
+                    coverage=coverage,
+                    geo_data=geo_data,
+                    geo_data_path=geo_data_path,
+                    nominatim=nominatim,
+                    range_estimator=range_estimator,
+                )
+            else:
+                for column_idx, column_meta in enumerate(columns):
+                    name = column_meta['name']
+                    with tracer.start_as_current_span('profile/column', attributes={'idx': column_idx, 'name': name}):
+                        logger.info("Processing column %d %r...", column_idx, name)
+                        array = data.iloc[:, column_idx]
+                        if name in manual_columns:
+                            manual = manual_columns[name]
+                        else:
+                            manual = None
+                        # Process the column, updating the column_meta dict
+                        resolved_columns[column_idx] = process_column(
+                            array, column_meta,
+                            manual=manual,
+                            plots=plots,
+                            coverage=coverage,
+                            geo_data=geo_data,
+                            nominatim=nominatim,
+                            range_estimator=range_estimator,
+                        )
 
     # Textual columns
     columns_textual = [
@@ -941,7 +1301,7 @@ def process_dataset(data, dataset_id=None, metadata=None,
                 )
 
                 # Get temporal ranges
-                ranges = get_numerical_ranges(timestamps)
+                ranges = get_numerical_ranges(timestamps, range_estimator)
                 if not ranges:
                     continue
 
@@ -13,33 +13,190 @@ logger = logging.getLogger(__name__)
 N_RANGES = 3
 MIN_RANGE_SIZE = 0.1  # 10%
 
+PARSE_BLOCK_SIZE = 4096
+
+CKMEANS_MAX_POINTS = 1024
+"""Above that many distinct values, Ckmeans runs on a quantile summary"""
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return numpy.nan
+
+
+def parse_numerical_values(array):
+    """Parse the numbers in an array of strings, as a float array.
+
+    Values that are not numbers, or that would overflow in Elasticsearch, are
+    dropped. This gives the same values as calling ``float()`` on each
+    element.
+    """
+    array = numpy.asarray(array, dtype=object)
+    array = array[array != '']
+
+    # Convert whole blocks at once, only going element by element in blocks
+    # that have values that are not numbers
+    values = numpy.empty(len(array), dtype=numpy.float64)
+    for start in range(0, len(array), PARSE_BLOCK_SIZE):
+        block = array[start:start + PARSE_BLOCK_SIZE]
+        try:
+            values[start:start + len(block)] = block.astype(numpy.float64)
+        except ValueError:
+            values[start:start + len(block)] = [
+                _parse_float(e) for e in block
+            ]
+
+    with numpy.errstate(invalid='ignore'):
+        return values[(-3.4e38 < values) & (values < 3.4e38)]
+
 
 def mean_stddev(array):
     """Compute the mean (average) and standard deviation of a numerical array.
     """
-    total = 0
-    count = 0
-    for elem in array:
-        if elem is not None:
-            total += elem
-            count += 1
-    mean = total / count if count > 0 else 0
-
-    total = 0
-    for elem in array:
-        if elem is not None:
-            elem = elem - mean
-            total += elem * elem
-    stddev = math.sqrt(total / count) if count > 0 else 0
+    array = numpy.asarray(array)
+    if array.dtype == object:
+        array = array[array != None].astype(numpy.float64)  # noqa: E711
+    if not len(array):
+        return 0, 0
+
+    # Add up in order with cumsum(), rather than the pairwise summation of
+    # sum(), to get the exact same result as adding them one by one
+    mean = float(numpy.cumsum(array, dtype=numpy.float64)[-1]) / len(array)
+    centered = array - mean
+    stddev = math.sqrt(
+        float(numpy.cumsum(centered * centered)[-1]) / len(array)
+    )
 
     return mean, stddev
 
 
-def get_numerical_ranges(values):
+def kmeans_clusters(values, n_clusters):
+    """Cluster values using scikit-learn's K-Means.
+
+    :param values: 1-D array of numbers
+    :return: The cluster label of each value
+    """
+    clustering = KMeans(n_clusters=n_clusters, random_state=0)
+    with ignore_warnings(ConvergenceWarning):
+        clustering.fit(values.reshape(-1, 1))
+    logger.info("K-Means clusters: %r", list(clustering.cluster_centers_))
+    return clustering.labels_
+
+
+def _ckmeans_starts(points, weights, n_clusters):
+    """Optimal 1-D K-Means of weighted sorted points, by dynamic programming.
+
+    This is the algorithm from Ckmeans.1d.dp (Wang & Song, 2011), using the
+    monotonicity of the split points to fill each row of the table by divide
+    and conquer.
+
+    :return: The index of the first point of each cluster
+    """
+    nb_points = len(points)
+    # Centered, to limit the loss of precision of the prefix sums
+    points = points - numpy.average(points, weights=weights)
+    cum_w = numpy.concatenate([[0.0], numpy.cumsum(weights)])
+    cum_x = numpy.concatenate([[0.0], numpy.cumsum(weights * points)])
+    cum_xx = numpy.concatenate(
+        [[0.0], numpy.cumsum(weights * points * points)],
+    )
+
+    def cost(i, j):
+        # Sum of squared distances to the mean for points i to j-1
+        sum_x = cum_x[j] - cum_x[i]
+        return numpy.maximum(
+            cum_xx[j] - cum_xx[i] - sum_x * sum_x / (cum_w[j] - cum_w[i]),
+            0.0,
+        )
+
+    # cost of the best clustering of the first j points, for 1 cluster
+    costs = cost(0, numpy.arange(1, nb_points + 1))
+    costs = numpy.concatenate([[numpy.inf], costs])
+    splits = []
+    for cluster in range(1, n_clusters):
+        new_costs = numpy.full(nb_points + 1, numpy.inf)
+        split = numpy.zeros(nb_points + 1, dtype=numpy.int64)
+        # Fill j = cluster + 1 .. nb_points; the last cluster starts at
+        # split[j], which doesn't decrease with j
+        stack = [(cluster + 1, nb_points, cluster, nb_points - 1)]
+        while stack:
+            j_lo, j_hi, i_lo, i_hi = stack.pop()
+            if j_lo > j_hi:
+                continue
+            j = (j_lo + j_hi) // 2
+            candidates = numpy.arange(i_lo, min(i_hi, j - 1) + 1)
+            totals = costs[candidates] + cost(candidates, j)
+            best = int(numpy.argmin(totals))
+            new_costs[j] = totals[best]
+            split[j] = candidates[best]
+            stack.append((j_lo, j - 1, i_lo, split[j]))
+            stack.append((j + 1, j_hi, split[j], i_hi))
+        costs = new_costs
+        splits.append(split)
+
+    # Backtrack
+    starts = [0] * n_clusters
+    end = nb_points
+    for cluster in range(n_clusters - 1, 0, -1):
+        end = starts[cluster] = int(splits[cluster - 1][end])
+    return starts
+
+
+def ckmeans_clusters(values, n_clusters):
+    """Cluster values using exact 1-D K-Means (Ckmeans).
+
+    Clusters are computed on the distinct values, or on a quantile summary of
+    `CKMEANS_MAX_POINTS` points if there are more.
+
+    :param values: 1-D array of numbers
+    :return: The cluster label of each value
+    """
+    sorted_values = numpy.sort(values.astype(numpy.float64))
+    points, counts = numpy.unique(sorted_values, return_counts=True)
+    if len(points) > CKMEANS_MAX_POINTS:
+        # Summarize the sorted values as buckets of (about) the same size
+        bounds = numpy.linspace(
+            0, len(sorted_values), CKMEANS_MAX_POINTS + 1,
+        ).astype(numpy.int64)
+        counts = numpy.diff(bounds)
+        points = numpy.add.reduceat(sorted_values, bounds[:-1]) / counts
+        firsts = sorted_values[bounds[:-1]]
+    else:
+        firsts = points
+    counts = counts.astype(numpy.float64)
+
+    n_clusters = min(n_clusters, len(points))
+    starts = _ckmeans_starts(points, counts, n_clusters)
+    logger.info("Ckmeans clusters start at: %r", list(firsts[starts]))
+    return numpy.searchsorted(
+        firsts[starts[1:]],
+        values.astype(numpy.float64),
+        side='right',
+    )
+
+
+RANGE_ESTIMATORS = {
+    'kmeans': kmeans_clusters,
+    'ckmeans': ckmeans_clusters,
+}
+"""The algorithms available to cluster values into ranges, by name
+
+Each is a function taking a 1-D array of values and a number of clusters, and
+returning the cluster label of each value.
+"""
+
+
+def get_numerical_ranges(values, estimator='kmeans'):
     """
     Retrieve the numeral ranges given the input (timestamp, integer, or float).
 
-    This performs K-Means clustering, returning a maximum of 3 ranges.
+    This clusters the values (with K-Means by default), returning a maximum of
+    3 ranges.
+
+    :param estimator: The clustering algorithm to use, one of the keys of
+        `RANGE_ESTIMATORS`
     """
 
     if not len(values):
@@ -47,30 +204,29 @@ def get_numerical_ranges(values):
 
     logger.info("Computing numerical ranges, %d values", len(values))
 
-    clustering = KMeans(n_clusters=min(N_RANGES, len(values)),
-                        random_state=0)
-    values_array = numpy.array(values).reshape(-1, 1)
-    with ignore_warnings(ConvergenceWarning):
-        clustering.fit(values_array)
-    logger.info("K-Means clusters: %r", list(clustering.cluster_centers_))
+    values_array = numpy.asarray(values).reshape(-1)
+    labels = RANGE_ESTIMATORS[estimator](
+        values_array,
+        min(N_RANGES, len(values)),
+    )
 
     # Compute confidence intervals for each range
     ranges = []
     sizes = []
     for rg in range(N_RANGES):
-        cluster = [values[i]
-                   for i in range(len(values))
-                   if clustering.labels_[i] == rg]
-        if not cluster:
+        cluster = values_array[labels == rg]
+        if not len(cluster):
             continue
 
         # Eliminate clusters of outliers
         if len(cluster) < MIN_RANGE_SIZE * len(values):
             continue
 
-        cluster.sort()
+        # Take the 5th and 95th percentiles (the values at those indexes in
+        # the sorted cluster, not interpolated)
         min_idx = int(0.05 * len(cluster))
         max_idx = int(0.95 * len(cluster))
+        cluster = numpy.partition(cluster, (min_idx, max_idx))
         ranges.append([
             cluster[min_idx],
             cluster[max_idx],
@@ -1,7 +1,9 @@
 import collections
 from datetime import datetime
 import dateutil.tz
+import numpy
 import opentelemetry.trace
+import pandas
 import re
 import regex
 
@@ -78,6 +80,32 @@ _re_latlong_point = re.compile(
 _re_whitespace = re.compile(r'\s+')
 
 
+# All the structural patterns above, in the order in which they are tried.
+# The first alternative that matches wins, so a single match against this
+# pattern classifies a value like the sequence of individual matches would.
+# The 'geo_combined' pattern needs the regex module, it is checked separately
+# and only on values that end with a parenthesis
+_RE_TYPES_ORDER = (
+    ('int', _re_int),
+    ('float', _re_float),
+    ('url', _re_url),
+    ('file', _re_file),
+    ('point', _re_wkt_point),
+    ('geo_combined', _re_geo_combined),
+    ('other_point', _re_other_point),
+    ('latlong_point', _re_latlong_point),
+    ('polygon', _re_wkt_polygon),
+)
+_re_types = re.compile('|'.join(
+    '(?P<%s>%s)' % (name, pattern.pattern)
+    for name, pattern in _RE_TYPES_ORDER
+    if name != 'geo_combined'
+))
+_GEO_COMBINED_AFTER = {None, 'other_point', 'latlong_point', 'polygon'}
+
+_BOOL_VALUES = {'0', '1', 'true', 'false', 'y', 'n', 'yes', 'no'}
+
+
 # Tolerable ratio of unclean data
 MAX_UNCLEAN = 0.02  # 2%
 
@@ -94,34 +122,41 @@ MAX_CATEGORICAL_RATIO = 0.10  # 10%
 
 def regular_exp_count(array):
     """Count instances matching the structure of each data type, using regexes.
+
+    Each distinct value is only classified once, using a single pattern
+    combining all the types, and its count is added to the total for its type.
     """
     re_count = collections.Counter()
 
-    for elem in array:
+    if isinstance(array, pandas.Series):
+        distinct_counts = array.value_counts(sort=False).items()
+    else:
+        distinct_counts = collections.Counter(array).items()
+
+    for elem, count in distinct_counts:
         if not elem:
-            re_count['empty'] += 1
-        elif _re_int.match(elem):
-            re_count['int'] += 1
-        elif _re_float.match(elem):
-            re_count['float'] += 1
-        elif _re_url.match(elem):
-            re_count['url'] += 1
-        elif _re_file.match(elem):
-            re_count['file'] += 1
-        elif _re_wkt_point.match(elem):
-            re_count['point'] += 1
-        elif _re_geo_combined.match(elem):
-            re_count['geo_combined'] += 1
-        elif _re_other_point.match(elem):
-            re_count['other_point'] += 1
-        elif _re_latlong_point.match(elem):
-            re_count['latlong_point'] += 1
-        elif _re_wkt_polygon.match(elem):
-            re_count['polygon'] += 1
-        elif len(_re_whitespace.findall(elem)) >= TEXT_WORDS - 1:
-            re_count['text'] += 1
-        if elem.lower() in ('0', '1', 'true', 'false', 'y', 'n', 'yes', 'no'):
-            re_count['bool'] += 1
+            re_count['empty'] += count
+        else:
+            m = _re_types.match(elem)
+            re_type = None
+            if m is not None:
+                # Named groups are listed in order, the first one is the type
+                for name, group in m.groupdict().items():
+                    if group is not None:
+                        re_type = name
+                        break
+            if (
+                re_type in _GEO_COMBINED_AFTER
+                and elem.endswith((')', ')\n'))
+                and _re_geo_combined.match(elem)
+            ):
+                re_type = 'geo_combined'
+            if re_type is not None:
+                re_count[re_type] += count
+            elif len(_re_whitespace.findall(elem)) >= TEXT_WORDS - 1:
+                re_count['text'] += count
+        if elem.lower() in _BOOL_VALUES:
+            re_count['bool'] += count
 
     return re_count
 
@@ -152,13 +187,16 @@ def unclean_values_ratio(c_type, re_count, num_total):
 
 def parse_dates(array):
     """Parse the valid dates in an array of strings.
+
+    Each distinct string is only parsed once, the results are then expanded
+    back to the order of the array.
     """
-    parsed_dates = []
-    for elem in array:
-        elem = parse_date(elem)
-        if elem is not None:
-            parsed_dates.append(elem)
-    return parsed_dates
+    codes, uniques = pandas.factorize(numpy.asarray(array, dtype=object))
+    # The last entry stays None, for missing values (code -1)
+    parsed = numpy.empty(len(uniques) + 1, dtype=object)
+    parsed[:-1] = [parse_date(elem) for elem in uniques]
+    valid = numpy.array([dt is not None for dt in parsed])
+    return list(parsed[codes[valid[codes]]])
 
 
 def identify_types(array, name, geo_data, manual=None):
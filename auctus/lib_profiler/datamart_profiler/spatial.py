@@ -1,5 +1,6 @@
 import collections
 from dataclasses import dataclass
+import functools
 import json
 import logging
 import math
@@ -475,6 +476,63 @@ def hash_location(point, base=32, precision=16):
     return bits_to_chars(bits, base_bits)
 
 
+def _cell_indexes(values, min_value, max_value, nb_bits):
+    # Same cells as the repeated halving in location_to_bits(): cell i is
+    # (min + i * step, min + (i + 1) * step], whose bounds are exactly the
+    # midpoints it compares to. NaN goes to cell 0, like it does there
+    nb_cells = 1 << nb_bits
+    step = (max_value - min_value) / nb_cells
+    with numpy.errstate(invalid='ignore'):
+        indexes = numpy.ceil((values - min_value) / step) - 1
+    indexes = numpy.clip(numpy.nan_to_num(indexes, nan=0.0), 0, nb_cells - 1)
+
+    # Fix rounding errors by comparing to the exact bounds
+    indexes[(values <= min_value + indexes * step) & (indexes > 0)] -= 1
+    indexes[
+        (values > min_value + (indexes + 1) * step)
+        & (indexes < nb_cells - 1)
+    ] += 1
+
+    return indexes.astype(numpy.uint64)
+
+
+def hash_locations(points, base=32, precision=16):
+    """Hash an array of coordinates at once, as integers.
+
+    This gives the same hashes as :func:`hash_location`, but as the integers
+    that its characters encode (`base_bits * precision` bits, which have to fit
+    in 64 bits).
+
+    :param points: Array of shape ``(N, 2)`` of ``(latitude, longitude)``
+    :return: Array of N ``uint64``
+    """
+    base_bits = base.bit_length() - 1
+    if 2 ** base_bits != base:
+        raise ValueError("Base is not a power of 2")
+    precision_bits = base_bits * precision
+    if precision_bits > 64:
+        raise ValueError("Hashes don't fit in 64 bits")
+
+    points = numpy.asarray(points, dtype=numpy.float64).reshape((-1, 2))
+
+    # Bits alternate between longitude and latitude, starting with longitude
+    nb_long_bits = (precision_bits + 1) // 2
+    nb_lat_bits = precision_bits // 2
+    long_cells = _cell_indexes(points[:, 1], -180.0, 180.0, nb_long_bits)
+    lat_cells = _cell_indexes(points[:, 0], -90.0, 90.0, nb_lat_bits)
+
+    # Interleave
+    hashes = numpy.zeros(len(points), dtype=numpy.uint64)
+    one = numpy.uint64(1)
+    for i in range(precision_bits):
+        if i % 2 == 0:
+            bit = (long_cells >> numpy.uint64(nb_long_bits - 1 - i // 2)) & one
+        else:
+            bit = (lat_cells >> numpy.uint64(nb_lat_bits - 1 - i // 2)) & one
+        hashes |= bit << numpy.uint64(precision_bits - 1 - i)
+    return hashes
+
+
 def decode_hash(hash, base=32):
     """Turn a hash back into a rectangle.
 
@@ -521,6 +579,36 @@ def bitrange(from_bits, to_bits):
     yield bits
 
 
+@functools.lru_cache()
+def _level_chars(base_bits, level):
+    """Get the characters for a level, from the new bits of cell coordinates.
+
+    The character at a level is made of the low bits of the longitude and
+    latitude cell coordinates, interleaved starting with longitude on even
+    bit positions. The result is indexed by ``(long_low << new_lat_bits) |
+    lat_low``.
+    """
+    new_long_bits = (
+        math.ceil(level * base_bits / 2)
+        - math.ceil((level - 1) * base_bits / 2)
+    )
+    new_lat_bits = base_bits - new_long_bits
+    chars = []
+    for long_low in range(1 << new_long_bits):
+        for lat_low in range(1 << new_lat_bits):
+            bits = []
+            long_shift, lat_shift = new_long_bits, new_lat_bits
+            for pos in range((level - 1) * base_bits, level * base_bits):
+                if pos % 2 == 0:
+                    long_shift -= 1
+                    bits.append((long_low >> long_shift) & 1)
+                else:
+                    lat_shift -= 1
+                    bits.append((lat_low >> lat_shift) & 1)
+            chars.append(bits_to_chars(bits, base_bits))
+    return chars
+
+
 class Geohasher(object):
     def __init__(self, *, number, base=4, precision=16):
         self.number = number
@@ -531,6 +619,14 @@ class Geohasher(object):
         self.number_at_level = [0] * (precision)
 
     def add_points(self, points):
+        if (
+            self.tree_root[0] == 0
+            and (self.base.bit_length() - 1) * self.precision <= 64
+        ):
+            # Nothing added yet, we can do it all at once
+            self._add_points_array(points)
+            return
+
         for point in points:
             geohash = hash_location(point, self.base, self.precision)
             # Add this hash to the tree
@@ -551,6 +647,57 @@ class Geohasher(object):
                         break
             node[0] += 1
 
+    def _add_points_array(self, points):
+        """Add points to an empty tree, using numpy.
+
+        This builds the same tree as adding the points one by one, down to
+        the final precision.
+        """
+        hashes = hash_locations(points, self.base, self.precision)
+        if not len(hashes):
+            return
+        base_bits = self.base.bit_length() - 1
+        precision_bits = base_bits * self.precision
+
+        def prefixes(hashes, level):
+            return hashes >> numpy.uint64(precision_bits - level * base_bits)
+
+        # Find the precision: the last level with few enough different hashes
+        # Sorting preserves the order of prefixes, the distinct prefixes of
+        # each level are the changes in that sorted array
+        sorted_hashes = numpy.sort(hashes)
+        number_at_level = []
+        for level in range(1, self.precision + 1):
+            level_prefixes = prefixes(sorted_hashes, level)
+            number = 1 + int(numpy.count_nonzero(
+                level_prefixes[1:] != level_prefixes[:-1]
+            ))
+            if number > self.number:
+                self.precision = level - 1
+                break
+            number_at_level.append(number)
+        self.number_at_level[:len(number_at_level)] = number_at_level
+
+        # Build the tree, inserting the nodes in the order in which the points
+        # would have created them
+        self.tree_root[0] = len(hashes)
+        nodes = {0: self.tree_root}
+        mask = numpy.uint64(self.base - 1)
+        for level in range(1, self.precision + 1):
+            level_nodes = {}
+            uniques, first_idx, counts = numpy.unique(
+                prefixes(hashes, level),
+                return_index=True,
+                return_counts=True,
+            )
+            for i in numpy.argsort(first_idx, kind='stable'):
+                prefix = uniques[i]
+                node = [int(counts[i]), {}]
+                parent = nodes[int(prefix >> numpy.uint64(base_bits))]
+                parent[1][GEOHASH_CHARS[int(prefix & mask)]] = node
+                level_nodes[int(prefix)] = node
+            nodes = level_nodes
+
     def add_aab(self, box):
         base_bits = self.base.bit_length() - 1
 
@@ -558,50 +705,127 @@ class Geohasher(object):
         min_bits = location_to_bits(
             (min_lat, min_long), self.base, self.precision,
         )
-        min_long_bits = min_bits[0::2]
-        min_lat_bits = min_bits[1::2]
         max_bits = location_to_bits(
             (max_lat, max_long), self.base, self.precision,
         )
-        max_long_bits = max_bits[0::2]
-        max_lat_bits = max_bits[1::2]
+
+        # Integer cell coordinates at full precision
+        def to_int(bits):
+            value = 0
+            for bit in bits:
+                value = (value << 1) | bit
+            return value
+
+        total_long_bits = len(min_bits[0::2])
+        total_lat_bits = len(min_bits[1::2])
+        min_long_cell = to_int(min_bits[0::2])
+        max_long_cell = to_int(max_bits[0::2])
+        min_lat_cell = to_int(min_bits[1::2])
+        max_lat_cell = to_int(max_bits[1::2])
 
         self.tree_root[0] += 1
+        # Nodes covered by the box at the previous level, by cell coordinates
+        nodes = {(0, 0): self.tree_root}
+        n_long_bits = n_lat_bits = 0
         level = 1
         while level <= self.precision:
+            prev_long_bits, prev_lat_bits = n_long_bits, n_lat_bits
             n_long_bits = math.ceil(level * base_bits / 2)
             n_lat_bits = math.floor(level * base_bits / 2)
-            for long_bits in bitrange(
-                    min_long_bits[:n_long_bits],
-                    max_long_bits[:n_long_bits],
-            ):
-                for lat_bits in bitrange(
-                        min_lat_bits[:n_lat_bits],
-                        max_lat_bits[:n_lat_bits],
-                ):
-                    bits = [0] * (n_long_bits + n_lat_bits)
-                    bits[0::2] = long_bits
-                    bits[1::2] = lat_bits
-                    geohash = bits_to_chars(bits, base_bits)
-
-                    # Add this hash to the tree
-                    node = self.tree_root
-                    for lvl, key in enumerate(geohash):
-                        try:
-                            node = node[1][key]
-                        except KeyError:
-                            new_node = [0, {}]
-                            node[1][key] = new_node
-                            node = new_node
-                            self.number_at_level[lvl] += 1
+
+            # Ranges of cells at this level. They wrap around if the box
+            # does, like bitrange()
+            long_start = min_long_cell >> (total_long_bits - n_long_bits)
+            long_end = max_long_cell >> (total_long_bits - n_long_bits)
+            long_count = (long_end - long_start) % (1 << n_long_bits) + 1
+            lat_start = min_lat_cell >> (total_lat_bits - n_lat_bits)
+            lat_end = max_lat_cell >> (total_lat_bits - n_lat_bits)
+            lat_count = (lat_end - lat_start) % (1 << n_lat_bits) + 1
+
+            # A range that wraps around under a single cell of the previous
+            # level covers cells whose parents were not visited
+            orphans = (
+                (long_start > long_end and prev_long_bits > 0
+                 and long_start >> (n_long_bits - prev_long_bits)
+                 == long_end >> (n_long_bits - prev_long_bits))
+                or (lat_start > lat_end and prev_lat_bits > 0
+                    and lat_start >> (n_lat_bits - prev_lat_bits)
+                    == lat_end >> (n_lat_bits - prev_lat_bits))
+            )
+
+            # A level with more cells than allowed is never kept, stop now
+            # (unless creating the parents would show in the result)
+            if long_count * lat_count > self.number and not orphans:
+                self.precision = level - 1
+                break
+
+            new_long_bits = n_long_bits - prev_long_bits
+            new_lat_bits = n_lat_bits - prev_lat_bits
+            chars = _level_chars(base_bits, level)
+            long_mask = (1 << new_long_bits) - 1
+            lat_mask = (1 << new_lat_bits) - 1
+
+            level_nodes = {}
+            for i in range(long_count):
+                long_cell = (long_start + i) % (1 << n_long_bits)
+                for j in range(lat_count):
+                    lat_cell = (lat_start + j) % (1 << n_lat_bits)
+
+                    # Add this cell to the tree, under its parent
+                    try:
+                        parent = nodes[(
+                            long_cell >> new_long_bits,
+                            lat_cell >> new_lat_bits,
+                        )]
+                    except KeyError:
+                        # The range wrapped around at this level but not at
+                        # the previous one, walk down from the root
+                        parent = self._get_parent_node(
+                            long_cell, n_long_bits, lat_cell, n_lat_bits,
+                        )
+                    key = chars[
+                        ((long_cell & long_mask) << new_lat_bits)
+                        | (lat_cell & lat_mask)
+                    ]
+                    try:
+                        node = parent[1][key]
+                    except KeyError:
+                        node = [0, {}]
+                        parent[1][key] = node
+                        self.number_at_level[level - 1] += 1
                     node[0] += 1
+                    level_nodes[(long_cell, lat_cell)] = node
 
                     if self.number_at_level[level - 1] > self.number:
                         self.precision = level - 1
                         break
 
+            nodes = level_nodes
             level += 1
 
+    def _get_parent_node(self, long_cell, n_long_bits, lat_cell, n_lat_bits):
+        """Get (or create) the parent node of a cell by walking the tree.
+        """
+        bits = [0] * (n_long_bits + n_lat_bits)
+        bits[0::2] = [
+            (long_cell >> i) & 1 for i in reversed(range(n_long_bits))
+        ]
+        bits[1::2] = [
+            (lat_cell >> i) & 1 for i in reversed(range(n_lat_bits))
+        ]
+        geohash = bits_to_chars(bits, self.base.bit_length() - 1)
+
+        node = self.tree_root
+        for lvl, key in enumerate(geohash[:-1]):
+            try:
+                node = node[1][key]
+            except KeyError:
+                new_node = [0, {}]
+                node[1][key] = new_node
+                node = new_node
+                self.number_at_level[lvl] += 1
+        return node
+
     def get_hashes(self):
         # Reconstruct the hashes at this level
         hashes = []
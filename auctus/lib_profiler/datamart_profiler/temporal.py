@@ -4,6 +4,7 @@ import dateutil.parser
 import dateutil.tz
 import logging
 import pandas
+import re
 
 from .warning_tools import raise_warnings
 
@@ -74,6 +75,36 @@ def get_temporal_resolution(values):
 _defaults = datetime(1985, 1, 1), datetime(2005, 6, 1)
 
 
+# A date needs a year, written with digits
+_re_digit = re.compile(r'\d')
+
+# Common ISO 8601 layouts that can be read without going through dateutil
+# Those with a timezone are left to dateutil, which picks the tzinfo class
+_re_iso_date = re.compile(
+    r'([1-9][0-9]{3})-([0-9]{2})-([0-9]{2})'
+    r'(?:'
+    r'[T ]([0-9]{2}):([0-9]{2})'
+    r'(?::([0-9]{2})(?:\.([0-9]{1,6}))?)?'
+    r')?'
+)
+
+
+def _parse_iso_date(string):
+    m = _re_iso_date.fullmatch(string)
+    if m is None:
+        return None
+    year, month, day, hour, minute, second, fraction = m.groups()
+    try:
+        return datetime(
+            int(year), int(month), int(day),
+            int(hour or 0), int(minute or 0), int(second or 0),
+            int(fraction.ljust(6, '0')) if fraction else 0,
+            tzinfo=dateutil.tz.UTC,
+        )
+    except ValueError:
+        return None
+
+
 def parse_date(string):
     """Parse a full date from a string.
 
@@ -82,6 +113,14 @@ def parse_date(string):
     (could be any year) but ``"June 2020"`` parses into
     ``2020-06-01 00:00:00 UTC``
     """
+    if isinstance(string, str):
+        # Quickly reject strings that can't be dates, and read ISO 8601 dates
+        if _re_digit.search(string) is None:
+            return None
+        dt = _parse_iso_date(string)
+        if dt is not None:
+            return dt
+
     with raise_warnings(dateutil.parser.UnknownTimezoneWarning):
         # This is a dirty trick because dateutil returns a datetime for strings
         # that only contain times. We parse it twice with different defaults,
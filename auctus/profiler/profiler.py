@@ -1,13 +1,21 @@
 import aio_pika
 import asyncio
+import collections
+import concurrent.futures
 import contextlib
 from datetime import datetime
 import defusedxml
 import elasticsearch
+import elasticsearch.serializer
+import hashlib
 import io
 import itertools
+import json
 import lazo_index_service
 import logging
+import multiprocessing
+import opentelemetry.context
+import opentelemetry.propagate
 import opentelemetry.trace
 import os
 import prometheus_client
@@ -17,30 +25,66 @@ import threading
 import time
 import traceback
 
-from datamart_core.common import PrefixedElasticsearch, setup_logging, \
-    add_dataset_to_index, delete_dataset_from_index, \
-    delete_dataset_from_lazo, log_future, json2msg, msg2json
+from datamart_core.common import PrefixedElasticsearch, BulkIndexer, \
+    setup_logging, get_profile_large_size, add_dataset_to_index, \
+    delete_dataset_from_index, delete_dataset_from_lazo, encode_dataset_id, \
+    hash_json, log_future, json2msg, msg2json, start_metrics_server
 from datamart_core.materialize import get_dataset, dataset_cache_key
-from datamart_fslock.cache import cache_get_or_set
+from datamart_fslock.cache import cache_get, cache_get_or_set
 from datamart_geo import GeoData
 from datamart_materialize import DatasetTooBig
 from datamart_materialize.detect import detect_format_convert_to_csv
 from datamart_profiler import process_dataset
+from datamart_profiler.core import MAX_SIZE as PROFILE_MAX_SIZE
 
 
 logger = logging.getLogger(__name__)
 tracer = opentelemetry.trace.get_tracer(__name__)
 
 
+# Defaults, see Profiler
 MAX_CONCURRENT_PROFILE = 1
 MAX_CONCURRENT_DOWNLOAD = 2
 
+# Estimated memory use of a profile, fixed part plus a multiple of the size
+# of the data that is loaded (the profiler loads a sample of big datasets)
+PROFILE_MEMORY_BASE = 128 << 20  # 128 MB
+PROFILE_MEMORY_FACTOR = 20
+
 
 PROM_DOWNLOADING = prometheus_client.Gauge(
     'profile_downloading_count', "Number of datasets currently downloading",
+    multiprocess_mode='livesum',
 )
 PROM_PROFILING = prometheus_client.Gauge(
     'profile_profiling_count', "Number of datasets currently profiling",
+    multiprocess_mode='livesum',
+)
+PROM_QUEUE_WAIT = prometheus_client.Histogram(
+    'profile_queue_wait_seconds',
+    "Time datasets waited from being published to being profiled",
+    ['queue', 'priority'],
+    buckets=[
+        1.0, 10.0, 60.0, 300.0, 900.0, 1800.0, 3600.0,
+        3 * 3600.0, 12 * 3600.0, 48 * 3600.0, float('inf'),
+    ],
+)
+PROM_FORWARDED = prometheus_client.Counter(
+    'profile_forwarded_large_count',
+    "Number of large datasets forwarded to the large queue",
+)
+PROM_PROFILE_CACHE = prometheus_client.Counter(
+    'profile_cache_count',
+    "Lookups of previous profiles, by result",
+    ['result'],
+)
+PROM_INDEXED_DOCUMENTS = prometheus_client.Counter(
+    'profile_indexed_documents_count',
+    "Number of documents sent to Elasticsearch after profiling",
+)
+PROM_INDEXING = prometheus_client.Counter(
+    'profile_indexing_seconds',
+    "Time spent sending documents to Elasticsearch after profiling",
 )
 
 
@@ -87,11 +131,218 @@ class LazoDeleteFirst(object):
         return self._lazo.get_lazo_sketch_from_data(*args, **kwargs)
 
 
+class ProfileGate(object):
+    """Limits the profiles running at once, by number and by memory.
+
+    A profile reserves an estimate of the memory it will use. It is let
+    through if fewer than `max_concurrent` are running and the reservations
+    fit in `memory` bytes, or if nothing is running (however big it is).
+    Profiles are let through in order, so small ones can't starve big ones.
+    """
+    def __init__(self, max_concurrent, memory=None):
+        self.max_concurrent = max_concurrent
+        self.memory = memory
+        self._cond = threading.Condition()
+        self._waiting = collections.deque()
+        self._running = 0
+        self._reserved = 0
+
+    @staticmethod
+    def estimate_memory(size):
+        return (
+            PROFILE_MEMORY_BASE
+            + min(size, PROFILE_MAX_SIZE) * PROFILE_MEMORY_FACTOR
+        )
+
+    def _can_enter(self, ticket, amount):
+        if self._waiting[0] is not ticket:
+            return False
+        if self._running == 0:
+            return True
+        return (
+            self._running < self.max_concurrent
+            and (
+                self.memory is None
+                or self._reserved + amount <= self.memory
+            )
+        )
+
+    @contextlib.contextmanager
+    def reserve(self, amount):
+        ticket = object()
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                self._cond.wait_for(lambda: self._can_enter(ticket, amount))
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+            self._running += 1
+            self._reserved += amount
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._reserved -= amount
+                self._cond.notify_all()
+
+
+def get_total_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError):
+        return None
+
+
+PROFILE_OPTIONS = dict(
+    include_sample=True,
+    coverage=True,
+    plots=True,
+)
+
+
+def profile_dataset(
+    dataset_path, dataset_id, metadata,
+    lazo_client, nominatim, geo_data,
+):
+    return process_dataset(
+        data=dataset_path,
+        dataset_id=dataset_id,
+        metadata=metadata,
+        lazo_client=lazo_client,
+        nominatim=nominatim,
+        geo_data=geo_data,
+        **PROFILE_OPTIONS,
+    )
+
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        chunk = fp.read(1 << 20)
+        while chunk:
+            h.update(chunk)
+            chunk = fp.read(1 << 20)
+    return h.hexdigest()
+
+
+def profile_cache_enabled():
+    """Whether profiles should be reused, set with ``$PROFILE_CACHE``.
+    """
+    return os.environ.get('PROFILE_CACHE') not in (
+        None, '', 'no', 'off', 'false',
+    )
+
+
+class ProfileCache(object):
+    """Profiles of datasets, reused if their data didn't change.
+
+    Entries are keyed on the dataset ID, the hash of its CSV (after
+    conversion), the metadata given to the profiler, the options, and
+    ``$DATAMART_VERSION``, so that upgrading the profiler (or the geo data
+    in the image) profiles everything again, and `freshen_old_index.py`
+    stays accurate.
+
+    The Lazo sketches are not cached, instead an entry is only used if
+    it is what's currently in the index for that dataset, in which case
+    the sketches in Lazo come from the same profile.
+    """
+    def __init__(self, es, cache_dir='/cache/datasets'):
+        self.es = es
+        self.cache_dir = cache_dir
+
+    def key(self, dataset_id, metadata, dataset_path, nominatim, geo_data):
+        h = hash_json({
+            'content': hash_file(dataset_path),
+            'metadata': metadata,
+            'options': PROFILE_OPTIONS,
+            'nominatim': nominatim is not None,
+            'geo': geo_data is not None,
+            'version': os.environ['DATAMART_VERSION'],
+        })
+        return '%s_%s.profile' % (encode_dataset_id(dataset_id), h)
+
+    def get(self, key, dataset_id):
+        with cache_get(self.cache_dir, key) as path:
+            if path is None:
+                PROM_PROFILE_CACHE.labels('miss').inc()
+                return None
+            with open(path, 'r') as fp:
+                metadata = json.load(fp)
+
+        try:
+            indexed = self.es.get('datasets', dataset_id)['_source']
+        except elasticsearch.NotFoundError:
+            indexed = {}
+        if any(indexed.get(k) != v for k, v in metadata.items()):
+            logger.info("Cached profile is not the indexed one: %r", key)
+            PROM_PROFILE_CACHE.labels('stale').inc()
+            return None
+        PROM_PROFILE_CACHE.labels('hit').inc()
+        return metadata
+
+    def set(self, key, metadata):
+        # Round-trip through the serializer Elasticsearch uses, to convert
+        # numpy types, so the entry compares equal to the indexed document
+        data = elasticsearch.serializer.JSONSerializer().dumps(metadata)
+
+        def create(cache_temp):
+            with open(cache_temp, 'w') as fp:
+                fp.write(data)
+
+        with cache_get_or_set(self.cache_dir, key, create):
+            pass
+
+
+# State of the worker processes, set by _init_worker()
+_worker = {}
+
+
+def _init_worker(nominatim, geo_data_path):
+    _worker['es'] = PrefixedElasticsearch()
+    _worker['lazo_client'] = lazo_index_service.LazoIndexClient(
+        host=os.environ['LAZO_SERVER_HOST'],
+        port=int(os.environ['LAZO_SERVER_PORT'])
+    )
+    _worker['nominatim'] = nominatim
+    _worker['geo_data'] = GeoData(geo_data_path)
+
+
+def _run_in_worker(carrier, func, args):
+    # Continue the trace of the parent process
+    token = opentelemetry.context.attach(
+        opentelemetry.propagate.extract(carrier),
+    )
+    try:
+        return func(*args)
+    finally:
+        opentelemetry.context.detach(token)
+
+
+def _profile_dataset_in_worker(dataset_path, dataset_id, metadata):
+    return profile_dataset(
+        dataset_path, dataset_id, metadata,
+        LazoDeleteFirst(_worker['lazo_client'], _worker['es'], dataset_id),
+        _worker['nominatim'],
+        _worker['geo_data'],
+    )
+
+
 def materialize_and_process_dataset(
     dataset_id, metadata,
     lazo_client, nominatim, geo_data,
-    profile_semaphore,
+    profile_gate, run_in_pool=None, profile_cache=None,
 ):
+    """Get the dataset, convert it to CSV if needed, then profile it.
+
+    If `run_in_pool` is provided, profiling happens in a worker process by
+    calling it with `_profile_dataset_in_worker` and its arguments, and
+    `lazo_client`, `nominatim` and `geo_data` are not used.
+
+    If `profile_cache` is provided, the previous profile is reused if the
+    data didn't change.
+    """
     with contextlib.ExitStack() as stack:
         # Remove converters, we'll discover what's needed
         metadata = dict(metadata)
@@ -130,36 +381,68 @@ def materialize_and_process_dataset(
             materialize,
         )
 
-        # Profile
-        with profile_semaphore:
-            with prom_incremented(PROM_PROFILING):
-                with tracer.start_as_current_span(
-                    'profile',
-                    attributes={'dataset': dataset_id},
-                ):
-                    logger.info("Profiling dataset %r", dataset_id)
-                    start = time.perf_counter()
-                    metadata = process_dataset(
-                        data=dataset_path,
-                        dataset_id=dataset_id,
-                        metadata=metadata,
-                        lazo_client=lazo_client,
-                        nominatim=nominatim,
-                        geo_data=geo_data,
-                        include_sample=True,
-                        coverage=True,
-                        plots=True,
-                    )
-                    logger.info(
-                        "Profiling dataset %r took %.2fs",
-                        dataset_id,
-                        time.perf_counter() - start,
+        # Look for a previous profile of this data
+        cached = profile_key = None
+        if profile_cache is not None:
+            profile_key = profile_cache.key(
+                dataset_id, metadata, dataset_path, nominatim, geo_data,
+            )
+            cached = profile_cache.get(profile_key, dataset_id)
+        if cached is not None:
+            logger.info(
+                "Dataset %r didn't change, reusing its profile", dataset_id,
+            )
+            metadata = cached
+        else:
+            metadata = _profile_gated(
+                dataset_path, dataset_id, metadata,
+                lazo_client, nominatim, geo_data,
+                profile_gate, run_in_pool,
+            )
+            if profile_cache is not None:
+                try:
+                    profile_cache.set(profile_key, metadata)
+                except Exception:
+                    logger.exception(
+                        "Error caching profile for %r", dataset_id,
                     )
 
         metadata['materialize'] = materialize
         return metadata
 
 
+def _profile_gated(
+    dataset_path, dataset_id, metadata,
+    lazo_client, nominatim, geo_data,
+    profile_gate, run_in_pool,
+):
+    size = os.path.getsize(dataset_path)
+    with profile_gate.reserve(profile_gate.estimate_memory(size)):
+        with prom_incremented(PROM_PROFILING):
+            with tracer.start_as_current_span(
+                'profile',
+                attributes={'dataset': dataset_id},
+            ):
+                logger.info("Profiling dataset %r", dataset_id)
+                start = time.perf_counter()
+                if run_in_pool is not None:
+                    metadata = run_in_pool(
+                        _profile_dataset_in_worker,
+                        dataset_path, dataset_id, metadata,
+                    )
+                else:
+                    metadata = profile_dataset(
+                        dataset_path, dataset_id, metadata,
+                        lazo_client, nominatim, geo_data,
+                    )
+                logger.info(
+                    "Profiling dataset %r took %.2fs",
+                    dataset_id,
+                    time.perf_counter() - start,
+                )
+    return metadata
+
+
 def exception_details(e):
     # Format traceback
     etype = type(e)
@@ -176,13 +459,60 @@ def exception_details(e):
 
 
 class Profiler(object):
+    """Profiles the datasets from the 'profile' queue.
+
+    Configured from the environment:
+
+    * ``$PROFILE_WORKERS``: if set, profile in a pool of this many
+      processes, which open the geographical data themselves. Otherwise
+      profile in threads (which only helps with downloads, since profiling
+      is CPU-bound)
+    * ``$PROFILE_CONCURRENT``: how many datasets to profile at once, defaults
+      to the number of workers (or 1)
+    * ``$PROFILE_CONCURRENT_DOWNLOAD``: how many datasets to get from the
+      queue at once, defaults to one more than the above (at least 2)
+    * ``$PROFILE_MEMORY``: how many bytes the profiles running at once can
+      be estimated to use, from the size of their data. Defaults to half
+      the memory of the machine
+    * ``$PROFILE_WORKER_CLASS``: by default, profile everything from the
+      'profile' queue. With ``small``, forward the datasets whose size hint
+      is over ``$PROFILE_LARGE_SIZE`` to the 'profile_large' queue, which
+      the workers with ``large`` consume
+    * ``$PROFILE_CACHE``: reuse the previous profile of datasets whose data
+      didn't change, see `ProfileCache`
+    """
+    WORKER_CLASSES = ('', 'small', 'large')
+
     def __init__(self):
-        self.profile_semaphore = threading.Semaphore(MAX_CONCURRENT_PROFILE)
-        self.es = PrefixedElasticsearch()
-        self.lazo_client = lazo_index_service.LazoIndexClient(
-            host=os.environ['LAZO_SERVER_HOST'],
-            port=int(os.environ['LAZO_SERVER_PORT'])
+        self.worker_class = os.environ.get('PROFILE_WORKER_CLASS', '')
+        if self.worker_class not in self.WORKER_CLASSES:
+            raise ValueError(
+                "Invalid PROFILE_WORKER_CLASS %r" % self.worker_class,
+            )
+        self.large_size = get_profile_large_size()
+        workers = int(os.environ.get('PROFILE_WORKERS', '') or 0)
+        max_concurrent = int(
+            os.environ.get('PROFILE_CONCURRENT', '')
+            or workers
+            or MAX_CONCURRENT_PROFILE
         )
+        self.max_concurrent_download = int(
+            os.environ.get('PROFILE_CONCURRENT_DOWNLOAD', '')
+            or max(MAX_CONCURRENT_DOWNLOAD, max_concurrent + 1)
+        )
+        memory = os.environ.get('PROFILE_MEMORY', '')
+        if memory:
+            memory = int(memory)
+        else:
+            memory = get_total_memory()
+            if memory is not None:
+                memory //= 2
+        self.profile_gate = ProfileGate(max_concurrent, memory)
+        self.es = PrefixedElasticsearch()
+        if profile_cache_enabled():
+            self.profile_cache = ProfileCache(self.es)
+        else:
+            self.profile_cache = None
         if os.environ.get('NOMINATIM_URL'):
             self.nominatim = os.environ['NOMINATIM_URL']
         else:
@@ -193,6 +523,24 @@ class Profiler(object):
         self.geo_data = GeoData.from_local_cache()
         self.channel = None
 
+        self.workers = workers
+        self.process_pool = None
+        self.process_pool_lock = threading.Lock()
+        if workers:
+            self._make_process_pool()
+        self.lazo_client = lazo_index_service.LazoIndexClient(
+            host=os.environ['LAZO_SERVER_HOST'],
+            port=int(os.environ['LAZO_SERVER_PORT'])
+        )
+        logger.info(
+            "Profiling %d datasets at once (%s), downloading %d, "
+            + "memory limit %s",
+            max_concurrent,
+            "%d processes" % workers if workers else "threads",
+            self.max_concurrent_download,
+            "%d MB" % (memory >> 20) if memory is not None else "none",
+        )
+
         assert(os.path.isdir('/cache/datasets'))
 
         self.loop = asyncio.get_event_loop()
@@ -213,6 +561,34 @@ class Profiler(object):
             else:
                 break
 
+    def _make_process_pool(self):
+        # Using the 'fork' method causes deadlocks because other threads hold
+        # locks, and the gRPC channel doesn't survive it
+        self.process_pool = concurrent.futures.ProcessPoolExecutor(
+            self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.nominatim, GeoData.get_local_cache_path()),
+        )
+
+    def run_in_pool(self, func, *args):
+        """Run a function in the worker processes, from a thread.
+        """
+        # Send the context, for tracing
+        carrier = {}
+        opentelemetry.propagate.inject(carrier)
+        pool = self.process_pool
+        try:
+            return pool.submit(_run_in_worker, carrier, func, args).result()
+        except concurrent.futures.process.BrokenProcessPool:
+            # A worker died (probably out of memory), replace the pool
+            with self.process_pool_lock:
+                if self.process_pool is pool:
+                    logger.error("Worker process died, restarting pool")
+                    self._make_process_pool()
+                    pool.shutdown(wait=False)
+            raise
+
     async def _amqp_setup(self):
         # Setup the datasets exchange
         self.datasets_exchange = await self.channel.declare_exchange(
@@ -232,6 +608,13 @@ class Profiler(object):
         )
         await self.profile_queue.bind(self.profile_exchange)
 
+        # Declare the queue for large datasets, which "small" workers forward
+        # them to
+        self.profile_large_queue = await self.channel.declare_queue(
+            'profile_large',
+            arguments={'x-max-priority': 3},
+        )
+
         # Declare the failed queue
         self.failed_queue = await self.channel.declare_queue('failed_profile')
 
@@ -243,16 +626,48 @@ class Profiler(object):
             password=os.environ['AMQP_PASSWORD'],
         )
         self.channel = await connection.channel()
-        await self.channel.set_qos(prefetch_count=MAX_CONCURRENT_DOWNLOAD)
+        await self.channel.set_qos(
+            prefetch_count=self.max_concurrent_download,
+        )
 
         await self._amqp_setup()
 
         # Consume profiling queue
-        async for message in self.profile_queue:
+        if self.worker_class == 'large':
+            queue = self.profile_large_queue
+        else:
+            queue = self.profile_queue
+        async for message in queue:
             obj = msg2json(message)
             dataset_id = obj['id']
             metadata = obj['metadata']
             materialize = metadata.get('materialize', {})
+            headers = message.headers or {}
+
+            if (
+                self.worker_class == 'small'
+                and headers.get('size', 0) >= self.large_size
+            ):
+                logger.info(
+                    "Forwarding large dataset %r (%d bytes)",
+                    dataset_id, headers['size'],
+                )
+                await self.channel.default_exchange.publish(
+                    aio_pika.Message(
+                        message.body,
+                        priority=message.priority,
+                        headers=message.headers,
+                    ),
+                    self.profile_large_queue.name,
+                )
+                await message.ack()
+                PROM_FORWARDED.inc()
+                continue
+
+            if 'sent' in headers:
+                PROM_QUEUE_WAIT.labels(
+                    queue.name, str(message.priority or 0),
+                ).observe(max(0.0, time.time() - headers['sent']))
 
             logger.info("Processing dataset %r from %r",
                         dataset_id, materialize.get('identifier'))
@@ -265,7 +680,9 @@ class Profiler(object):
                 LazoDeleteFirst(self.lazo_client, self.es, dataset_id),
                 self.nominatim,
                 self.geo_data,
-                self.profile_semaphore,
+                self.profile_gate,
+                self.run_in_pool if self.process_pool is not None else None,
+                self.profile_cache,
             )
 
             future.add_done_callback(
@@ -322,9 +739,11 @@ class Profiler(object):
                         body = dict(metadata,
                                     date=datetime.utcnow().isoformat() + 'Z',
                                     version=os.environ['DATAMART_VERSION'])
-                        await in_thread(
-                            lambda: add_dataset_to_index(self.es, dataset_id, body),
-                        )
+                        bulk = BulkIndexer(self.es)
+                        add_dataset_to_index(self.es, dataset_id, body, bulk)
+                        await in_thread(bulk.flush)
+                        PROM_INDEXED_DOCUMENTS.inc(bulk.documents)
+                        PROM_INDEXING.inc(bulk.elapsed)
 
                         # Publish to RabbitMQ
                         msg = dict(
@@ -436,7 +855,7 @@ class Profiler(object):
 
 def main():
     setup_logging()
-    prometheus_client.start_http_server(8000)
+    start_metrics_server(8000)
     logger.info(
         "Startup: profiler %s %s",
         os.environ['DATAMART_VERSION'],
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+"""This script benchmarks the geohashes computed for admin areas.
+
+It profiles a column of country names, once with `Geohasher.add_aab()` and
+once with the previous implementation (which enumerated every cell of each
+bounding box using `bitrange()`), and checks that they give the same result.
+"""
+
+import logging
+import math
+import pandas
+import sys
+import time
+
+from datamart_geo import GeoData
+from datamart_profiler import process_dataset
+from datamart_profiler import spatial
+
+
+COUNTRIES = [
+    'Afghanistan', 'Albania', 'Algeria', 'Andorra', 'Angola', 'Argentina',
+    'Armenia', 'Australia', 'Austria', 'Azerbaijan', 'Bahamas', 'Bahrain',
+    'Bangladesh', 'Barbados', 'Belarus', 'Belgium', 'Belize', 'Benin',
+    'Bhutan', 'Bolivia', 'Bosnia and Herzegovina', 'Botswana', 'Brazil',
+    'Brunei', 'Bulgaria', 'Burkina Faso', 'Burundi', 'Cambodia', 'Cameroon',
+    'Canada', 'Cape Verde', 'Central African Republic', 'Chad', 'Chile',
+    'China', 'Colombia', 'Comoros', 'Costa Rica', 'Croatia', 'Cuba',
+    'Cyprus', 'Czech Republic', 'Denmark', 'Djibouti', 'Dominica',
+    'Dominican Republic', 'Ecuador', 'Egypt', 'El Salvador',
+    'Equatorial Guinea', 'Eritrea', 'Estonia', 'Eswatini', 'Ethiopia',
+    'Fiji', 'Finland', 'France', 'Gabon', 'Gambia', 'Georgia', 'Germany',
+    'Ghana', 'Greece', 'Grenada', 'Guatemala', 'Guinea', 'Guinea-Bissau',
+    'Guyana', 'Haiti', 'Honduras', 'Hungary', 'Iceland', 'India',
+    'Indonesia', 'Iran', 'Iraq', 'Ireland', 'Israel', 'Italy', 'Jamaica',
+    'Japan', 'Jordan', 'Kazakhstan', 'Kenya', 'Kiribati', 'Kuwait',
+    'Kyrgyzstan', 'Laos', 'Latvia', 'Lebanon', 'Lesotho', 'Liberia', 'Libya',
+    'Liechtenstein', 'Lithuania', 'Luxembourg', 'Madagascar', 'Malawi',
+    'Malaysia', 'Maldives', 'Mali', 'Malta', 'Marshall Islands',
+    'Mauritania', 'Mauritius', 'Mexico', 'Micronesia', 'Moldova', 'Monaco',
+    'Mongolia', 'Montenegro', 'Morocco', 'Mozambique', 'Myanmar', 'Namibia',
+    'Nauru', 'Nepal', 'Netherlands', 'New Zealand', 'Nicaragua', 'Niger',
+    'Nigeria', 'North Korea', 'North Macedonia', 'Norway', 'Oman',
+    'Pakistan', 'Palau', 'Panama', 'Papua New Guinea', 'Paraguay', 'Peru',
+    'Philippines', 'Poland', 'Portugal', 'Qatar', 'Romania', 'Russia',
+    'Rwanda', 'Saint Kitts and Nevis', 'Saint Lucia',
+    'Saint Vincent and the Grenadines', 'Samoa', 'San Marino',
+    'Sao Tome and Principe', 'Saudi Arabia', 'Senegal', 'Serbia',
+    'Seychelles', 'Sierra Leone', 'Singapore', 'Slovakia', 'Slovenia',
+    'Solomon Islands', 'Somalia', 'South Africa', 'South Korea',
+    'South Sudan', 'Spain', 'Sri Lanka', 'Sudan', 'Suriname', 'Sweden',
+    'Switzerland', 'Syria', 'Taiwan', 'Tajikistan', 'Tanzania', 'Thailand',
+    'Timor-Leste', 'Togo', 'Tonga', 'Trinidad and Tobago', 'Tunisia',
+    'Turkey', 'Turkmenistan', 'Tuvalu', 'Uganda', 'Ukraine',
+    'United Arab Emirates', 'United Kingdom', 'United States', 'Uruguay',
+    'Uzbekistan', 'Vanuatu', 'Venezuela', 'Vietnam', 'Yemen', 'Zambia',
+    'Zimbabwe',
+]
+
+
+def add_aab_bitrange(self, box):
+    """Previous implementation of `Geohasher.add_aab()`, for comparison.
+    """
+    base_bits = self.base.bit_length() - 1
+
+    min_long, max_long, min_lat, max_lat = box
+    min_bits = spatial.location_to_bits(
+        (min_lat, min_long), self.base, self.precision,
+    )
+    min_long_bits = min_bits[0::2]
+    min_lat_bits = min_bits[1::2]
+    max_bits = spatial.location_to_bits(
+        (max_lat, max_long), self.base, self.precision,
+    )
+    max_long_bits = max_bits[0::2]
+    max_lat_bits = max_bits[1::2]
+
+    self.tree_root[0] += 1
+    level = 1
+    while level <= self.precision:
+        n_long_bits = math.ceil(level * base_bits / 2)
+        n_lat_bits = math.floor(level * base_bits / 2)
+        for long_bits in spatial.bitrange(
+                min_long_bits[:n_long_bits],
+                max_long_bits[:n_long_bits],
+        ):
+            for lat_bits in spatial.bitrange(
+                    min_lat_bits[:n_lat_bits],
+                    max_lat_bits[:n_lat_bits],
+            ):
+                bits = [0] * (n_long_bits + n_lat_bits)
+                bits[0::2] = long_bits
+                bits[1::2] = lat_bits
+                geohash = spatial.bits_to_chars(bits, base_bits)
+
+                # Add this hash to the tree
+                node = self.tree_root
+                for lvl, key in enumerate(geohash):
+                    try:
+                        node = node[1][key]
+                    except KeyError:
+                        new_node = [0, {}]
+                        node[1][key] = new_node
+                        node = new_node
+                        self.number_at_level[lvl] += 1
+                node[0] += 1
+
+                if self.number_at_level[level - 1] > self.number:
+                    self.precision = level - 1
+                    break
+
+        level += 1
+
+
+def profile(data, geo_data, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        metadata = process_dataset(
+            data,
+            geo_data=geo_data,
+            include_sample=False,
+            coverage=True,
+            plots=False,
+        )
+        times.append(time.perf_counter() - start)
+    return min(times), metadata
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    geo_data = GeoData.from_local_cache()
+    data = pandas.DataFrame({'country': COUNTRIES})
+
+    fast_time, fast_metadata = profile(data, geo_data, repeat)
+
+    add_aab = spatial.Geohasher.add_aab
+    spatial.Geohasher.add_aab = add_aab_bitrange
+    try:
+        slow_time, slow_metadata = profile(data, geo_data, repeat)
+    finally:
+        spatial.Geohasher.add_aab = add_aab
+
+    if fast_metadata.get('spatial_coverage') != \
+            slow_metadata.get('spatial_coverage'):
+        print("Spatial coverage differs!")
+        sys.exit(1)
+
+    print("%d countries, best of %d" % (len(COUNTRIES), repeat))
+    print("bitrange:   %.3fs" % slow_time)
+    print("intervals:  %.3fs" % fast_time)
+
+
+if __name__ == '__main__':
+    main()
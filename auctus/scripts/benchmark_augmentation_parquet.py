@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""This script benchmarks joins with a CSV or a Parquet companion dataset.
+
+It generates a large companion dataset (1 GB of CSV by default), converts it
+to Parquet like the dataset cache does, then joins a small input dataset with
+each of them, requesting a single column. Only the requested columns are
+loaded from either file, the Parquet file is read by row groups. The results
+have to be identical.
+
+Usage: benchmark_augmentation_parquet.py [size_in_mb]
+"""
+
+import filecmp
+import io
+import logging
+import numpy
+import os
+import pandas
+import sys
+import tempfile
+import time
+
+from datamart_augmentation import join
+from datamart_materialize import make_writer, types
+from datamart_materialize.parquet import csv_to_parquet
+
+
+NB_KEYS = 100000
+NB_TEXT_COLUMNS = 8
+
+
+def companion_metadata():
+    columns = [
+        {
+            'name': 'key',
+            'structural_type': types.INTEGER,
+            'semantic_types': [],
+        },
+        {
+            'name': 'value',
+            'structural_type': types.FLOAT,
+            'semantic_types': [],
+        },
+    ]
+    for i in range(NB_TEXT_COLUMNS):
+        columns.append({
+            'name': 'text_%d' % i,
+            'structural_type': types.TEXT,
+            'semantic_types': [],
+        })
+    return {'columns': columns}
+
+
+def generate_companion(csv_path, parquet_path, size):
+    rng = numpy.random.default_rng(0)
+    words = numpy.array([
+        'alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf',
+        'hotel', 'india', 'juliett', 'kilo', 'lima', 'mike', 'november',
+    ])
+    chunk_rows = 100000
+    with open(csv_path, 'w', newline='') as fp:
+        header = True
+        while fp.tell() < size:
+            chunk = {
+                'key': rng.integers(0, 2 * NB_KEYS, chunk_rows),
+                'value': rng.normal(size=chunk_rows),
+            }
+            for i in range(NB_TEXT_COLUMNS):
+                chunk['text_%d' % i] = numpy.char.add(
+                    rng.choice(words, chunk_rows),
+                    rng.integers(0, 1000000, chunk_rows).astype(str),
+                )
+            pandas.DataFrame(chunk).to_csv(fp, header=header, index=False)
+            header = False
+
+    # Convert to Parquet, keeping the values exactly
+    csv_to_parquet(csv_path, parquet_path, companion_metadata()['columns'])
+
+
+def run_join(original, companion, result):
+    orig_meta = {
+        'columns': [
+            {
+                'name': 'key',
+                'structural_type': types.INTEGER,
+                'semantic_types': [],
+            },
+            {
+                'name': 'name',
+                'structural_type': types.TEXT,
+                'semantic_types': [],
+            },
+        ],
+    }
+    start = time.perf_counter()
+    join(
+        io.BytesIO(original),
+        companion,
+        orig_meta,
+        companion_metadata(),
+        make_writer(result),
+        [[0]],
+        [[0]],
+        columns=[1],
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1024
+    size *= 1 << 20
+
+    original = pandas.DataFrame({
+        'key': numpy.arange(NB_KEYS),
+        'name': ['row%d' % i for i in range(NB_KEYS)],
+    }).to_csv(index=False).encode('utf-8')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'companion.csv')
+        parquet_path = os.path.join(tmp, 'companion.parquet')
+        generate_companion(csv_path, parquet_path, size)
+        print("companion: CSV %d MB, Parquet %d MB" % (
+            os.stat(csv_path).st_size >> 20,
+            os.stat(parquet_path).st_size >> 20,
+        ))
+
+        csv_result = os.path.join(tmp, 'result_csv.csv')
+        csv_time = run_join(original, csv_path, csv_result)
+        parquet_result = os.path.join(tmp, 'result_parquet.csv')
+        parquet_time = run_join(original, parquet_path, parquet_result)
+
+        if not filecmp.cmp(csv_result, parquet_result, shallow=False):
+            print("Results differ!")
+            sys.exit(1)
+
+    print("CSV:      %.3fs" % csv_time)
+    print("Parquet:  %.3fs" % parquet_time)
+
+
+if __name__ == '__main__':
+    main()
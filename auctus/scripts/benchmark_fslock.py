@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""This script benchmarks shared locks and cache hits in datamart_fslock.
+
+It takes uncontended shared locks on a file in a loop, once with the locking
+subprocess that used to be started for every lock, and once with the current
+implementation (which uses flock(2) in-process when the lock is available).
+Then it does the same with lookups of an existing cache entry.
+
+Usage: benchmark_fslock.py [seconds]
+"""
+
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from datamart_fslock import FSLockShared, cache, unix
+
+
+def subprocess_lock(filepath, timeout=None):
+    return unix._lock_subprocess(filepath, False, timeout=timeout)
+
+
+def rate(func, duration):
+    count = 0
+    start = now = time.perf_counter()
+    while now - start < duration:
+        func()
+        count += 1
+        now = time.perf_counter()
+    return count / (now - start)
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        lock_path = os.path.join(cache_dir, 'key.lock')
+        with open(lock_path, 'w'):
+            pass
+        with open(os.path.join(cache_dir, 'key.cache'), 'w') as fp:
+            fp.write('data')
+
+        def lock():
+            with lock_type(lock_path):
+                pass
+
+        def lookup():
+            with cache.cache_get(cache_dir, 'key') as path:
+                assert path is not None
+
+        results = []
+        for name, lock_type in [
+            ('subprocess', subprocess_lock),
+            ('in-process', FSLockShared),
+        ]:
+            # Have the cache use that kind of lock too
+            cache.FSLockShared = lock_type
+            try:
+                results.append((
+                    name,
+                    rate(lock, duration),
+                    rate(lookup, duration),
+                ))
+            finally:
+                cache.FSLockShared = FSLockShared
+
+    print("%-12s %14s %14s" % ("", "locks/sec", "lookups/sec"))
+    for name, locks, lookups in results:
+        print("%-12s %14.1f %14.1f" % (name, locks, lookups))
+
+
+if __name__ == '__main__':
+    main()
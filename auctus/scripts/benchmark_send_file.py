@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+"""This script benchmarks sending big files from the API server.
+
+It creates a file (2 GB by default) and serves it with a Tornado application
+using `BaseHandler.send_file()`, once with the previous implementation (which
+sent 40 kB chunks) and once with the current one, downloading it over HTTP
+each time and measuring the throughput.
+
+Usage: benchmark_send_file.py [size_in_mb]
+"""
+
+import asyncio
+import concurrent.futures
+import http.client
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tornado.httpserver
+import tornado.web
+from tornado.iostream import StreamClosedError
+
+from apiserver.base import BaseHandler
+from apiserver.executor import Executors
+
+
+async def send_file_40k(self, path, name):
+    """Previous implementation of `BaseHandler.send_file()`, for comparison.
+    """
+    self.set_header('Content-Type', 'application/octet-stream')
+    with open(path, 'rb') as fp:
+        self.set_header('Content-Length', fp.seek(0, 2))
+        fp.seek(0, 0)
+
+        BUFSIZE = 40960
+        buf = fp.read(BUFSIZE)
+        try:
+            while buf:
+                self.write(buf)
+                if len(buf) != BUFSIZE:
+                    break
+                buf = fp.read(BUFSIZE)
+                await self.flush()
+            return await self.finish()
+        except StreamClosedError:
+            return
+
+
+class FileHandler(BaseHandler):
+    def initialize(self, path, old):
+        self.path = path
+        self.old = old
+
+    async def get(self):
+        if self.old:
+            return await send_file_40k(self, self.path, 'data')
+        else:
+            return await self.send_file(self.path, 'data')
+
+
+def download(port, url, headers=None):
+    # Download from another process, so the client doesn't slow down the server
+    with concurrent.futures.ProcessPoolExecutor(1) as executor:
+        return executor.submit(_download, port, url, headers).result()
+
+
+def _download(port, url, headers=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    conn.request('GET', url, headers=headers or {})
+    response = conn.getresponse()
+    size = 0
+    start = time.perf_counter()
+    while True:
+        chunk = response.read(1 << 20)
+        if not chunk:
+            break
+        size += len(chunk)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return response.status, size, elapsed
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    size <<= 20
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'entry.cache')
+        with open(path, 'wb') as fp:
+            block = os.urandom(1 << 20)
+            for _ in range(size >> 20):
+                fp.write(block)
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        app = tornado.web.Application([
+            ('/old', FileHandler, {'path': path, 'old': True}),
+            ('/new', FileHandler, {'path': path, 'old': False}),
+        ])
+        app.executors = Executors()
+        server = tornado.httpserver.HTTPServer(app)
+        server.listen(0, '127.0.0.1')
+        port = next(iter(server._sockets.values())).getsockname()[1]
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        # Read the file once so it's in the page cache for both
+        download(port, '/new')
+
+        results = []
+        for url in ('/old', '/new'):
+            cpu = time.process_time()
+            status, received, elapsed = download(port, url)
+            cpu = time.process_time() - cpu
+            assert status == 200 and received == size, (status, received)
+            results.append((url, received, elapsed, cpu))
+
+        # Ranged request
+        cpu = time.process_time()
+        status, received, elapsed = download(
+            port, '/new',
+            {'Range': 'bytes=%d-' % (size // 2)},
+        )
+        cpu = time.process_time() - cpu
+        assert status == 206 and received == size - size // 2
+        results.append(('/new (range)', received, elapsed, cpu))
+
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        app.executors.shutdown()
+
+    print("%d MB file" % (size >> 20))
+    print("%-14s %8s %10s %12s" % ("", "time", "MB/s", "server CPU"))
+    for name, received, elapsed, cpu in results:
+        print("%-14s %7.2fs %10.0f %11.2fs" % (
+            name, elapsed, (received >> 20) / elapsed, cpu,
+        ))
+
+
+if __name__ == '__main__':
+    main()
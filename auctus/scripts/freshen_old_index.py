@@ -15,7 +15,8 @@ import os
 import subprocess
 import sys
 
-from datamart_core.common import PrefixedElasticsearch, json2msg
+from datamart_core.common import PrefixedElasticsearch, \
+    PROFILE_PRIORITY_LOW, profile_message
 
 
 logger = logging.getLogger(__name__)
@@ -100,7 +101,10 @@ async def freshen(version):
         if obj.get('manual_annotations'):
             metadata['manual_annotations'] = obj['manual_annotations']
         await amqp_profile_exchange.publish(
-            json2msg(dict(id=h['_id'], metadata=metadata)),
+            profile_message(
+                h['_id'], metadata,
+                PROFILE_PRIORITY_LOW, obj.get('size'),
+            ),
             '',
         )
     logger.info("Reprocessed %d datasets", reprocessed)
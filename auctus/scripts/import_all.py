@@ -5,24 +5,54 @@
 It simply loads the data from the JSON files. If you want to reprocess them
 instead, use `reprocess_all.py`, which will only read name, description, and
 date, and obtain the rest of the metadata via profiling.
+
+Documents are sent using the bulk API, see `BulkIndexer` for the settings.
+
+With ``--parallel N``, the export is streamed (from the folder, or directly
+from a snapshot ``.tar.gz``) and sent as batches of whole datasets, N at a
+time. Each batch first deletes the supplementary documents of its datasets
+then indexes them again, so it can be retried (with exponential backoff) or
+sent again after a restart. With ``--checkpoint FILE``, the entries of each
+batch are recorded once it is done, and skipped by the next run. This mode
+doesn't remove sketches from the Lazo server, the Lazo documents from the
+export simply replace the existing ones.
+
+Usage: import_all.py [--parallel N [--checkpoint FILE]] <folder or tar>
 """
 
+import argparse
 import asyncio
+import concurrent.futures
 import elasticsearch
+import elasticsearch.helpers
 import json
 import lazo_index_service
 import logging
 import os
-import sys
+import posixpath
+import random
+import tarfile
 import time
 
-from datamart_core.common import PrefixedElasticsearch, add_dataset_to_index, \
-    delete_dataset_from_index, add_dataset_to_lazo_storage, decode_dataset_id
+from datamart_core.common import PrefixedElasticsearch, BulkIndexer, \
+    add_dataset_to_index, delete_dataset_from_index, \
+    add_dataset_to_lazo_storage, decode_dataset_id
 
 
 RETRY_DELAYS = [10, 15, 30, 45, 60, 80, 100, 120, 140, 0]  # 10 attempts
 
 
+def retry(func):
+    for i, delay in enumerate(RETRY_DELAYS):
+        try:
+            return func()
+        except elasticsearch.TransportError:
+            print('X', end='', flush=True)
+            if i == len(RETRY_DELAYS) - 1:
+                raise
+            time.sleep(delay)
+
+
 async def import_all(folder):
     es = PrefixedElasticsearch()
     if 'LAZO_SERVER_HOST' in os.environ:
@@ -33,6 +63,10 @@ async def import_all(folder):
     else:
         lazo_client = None
 
+    bulk = BulkIndexer(es)
+    nb_documents = 0
+    start = time.perf_counter()
+
     dataset_docs = []
     lazo_docs = []
     for name in os.listdir(folder):
@@ -41,6 +75,9 @@ async def import_all(folder):
         else:
             dataset_docs.append(name)
 
+    # The supplementary documents have no ID, so they are sent in batches
+    # that delete them first, which can be retried safely
+    batch = Batch()
     for i, name in enumerate(dataset_docs):
         if i % 50 == 0:
             print(
@@ -52,18 +89,18 @@ async def import_all(folder):
             obj = json.load(fp)
 
         dataset_id = decode_dataset_id(name)
-        for i, delay in enumerate(RETRY_DELAYS):
-            try:
-                delete_dataset_from_index(es, dataset_id, lazo_client)
-                add_dataset_to_index(es, dataset_id, obj)
-                break
-            except elasticsearch.TransportError:
-                print('X', end='', flush=True)
-                if i == len(RETRY_DELAYS) - 1:
-                    raise
-                time.sleep(delay)
+        retry(lambda: delete_dataset_from_index(es, dataset_id, lazo_client))
+        batch.names.append(name)
+        batch.dataset_ids.append(dataset_id)
+        add_dataset_to_index(es, dataset_id, obj, batch)
+        if len(batch.actions) >= bulk.batch_size:
+            nb_documents += send_batch(es, batch)
+            batch = Batch()
         print('.', end='', flush=True)
+    if batch.actions:
+        nb_documents += send_batch(es, batch)
 
+    # Lazo documents have an ID, sending them again is harmless
     for i, name in enumerate(lazo_docs):
         if i % 500 == 0:
             print(
@@ -77,25 +114,246 @@ async def import_all(folder):
         dataset_id = decode_dataset_id(name[5:]).rsplit('.', 1)[0]
         lazo_es_id = obj.pop('_id')
         assert lazo_es_id.split('__.__')[0] == dataset_id
-        for i, delay in enumerate(RETRY_DELAYS):
-            try:
-                add_dataset_to_lazo_storage(es, lazo_es_id, obj)
-                break
-            except elasticsearch.TransportError:
-                print('X', end='', flush=True)
-                if i == len(RETRY_DELAYS) - 1:
-                    raise
-                time.sleep(delay)
+        add_dataset_to_lazo_storage(es, lazo_es_id, obj, bulk)
+        retry(bulk.flush_if_needed)
         if i % 10 == 0:
             print('.', end='', flush=True)
+    retry(bulk.flush)
+    nb_documents += bulk.documents
 
+    elapsed = time.perf_counter() - start
+    print(
+        "\nSent %d documents in %.0fs, %.0f documents/sec" % (
+            nb_documents, elapsed,
+            nb_documents / elapsed if elapsed else 0,
+        ),
+        flush=True,
+    )
 
-if __name__ == '__main__':
+
+MAX_ATTEMPTS = 10
+BACKOFF_FIRST = 2.0
+BACKOFF_MAX = 120.0
+
+
+def read_export(source):
+    """Iterate on the ``(name, document)`` entries of an export.
+
+    :param source: Either a folder or a tar file (possibly compressed), which
+        is read as a stream.
+    """
+    if os.path.isdir(source):
+        for entry in os.scandir(source):
+            if entry.is_file() and not entry.name.startswith('.'):
+                with open(entry.path, 'r') as fp:
+                    yield entry.name, json.load(fp)
+    else:
+        with tarfile.open(source, 'r|*') as tar:
+            for member in tar:
+                name = posixpath.basename(member.name)
+                if member.isfile() and not name.startswith('.'):
+                    yield name, json.load(tar.extractfile(member))
+
+
+class Batch(object):
+    """Documents for some entries of the export, sent in one bulk request.
+    """
+    def __init__(self):
+        self.names = []
+        self.dataset_ids = []
+        self.actions = []
+
+    def index(self, index, body, id=None):
+        self.actions.append(('index', index, id, body))
+
+
+def make_batches(es, entries, done, batch_size):
+    batch = Batch()
+    for name, obj in entries:
+        if name in done:
+            continue
+        batch.names.append(name)
+        if name.startswith('lazo.'):
+            dataset_id = decode_dataset_id(name[5:]).rsplit('.', 1)[0]
+            lazo_es_id = obj.pop('_id')
+            assert lazo_es_id.split('__.__')[0] == dataset_id
+            add_dataset_to_lazo_storage(es, lazo_es_id, obj, batch)
+        else:
+            dataset_id = decode_dataset_id(name)
+            batch.dataset_ids.append(dataset_id)
+            batch.actions.append(('delete', 'pending', dataset_id, None))
+            add_dataset_to_index(es, dataset_id, obj, batch)
+        if len(batch.actions) >= batch_size:
+            yield batch
+            batch = Batch()
+    if batch.names:
+        yield batch
+
+
+def is_retryable(error):
+    if isinstance(error, elasticsearch.ConnectionError):
+        return True
+    return (
+        isinstance(error, elasticsearch.TransportError)
+        and error.status_code in (429, 502, 503, 504)
+    )
+
+
+def send_batch(es, batch):
+    """Send a batch, retrying with exponential backoff.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            if batch.dataset_ids:
+                es.delete_by_query(
+                    index='columns,spatial_coverage,temporal_coverage',
+                    body={
+                        'query': {
+                            'terms': {'dataset_id': batch.dataset_ids},
+                        },
+                    },
+                )
+            response = es.bulk(batch.actions, request_timeout=120)
+            if response.get('errors'):
+                errors = [
+                    result
+                    for item in response['items']
+                    for result in item.values()
+                    if 'error' in result
+                ]
+                if errors and all(e['status'] == 429 for e in errors):
+                    # Elasticsearch is overloaded, send the whole batch again
+                    raise elasticsearch.TransportError(
+                        429, 'es_rejected_execution_exception', errors[0],
+                    )
+                elif errors:
+                    raise elasticsearch.helpers.BulkIndexError(
+                        "%d document(s) failed to index" % len(errors),
+                        errors,
+                    )
+            return len(batch.actions)
+        except elasticsearch.TransportError as e:
+            if attempt == MAX_ATTEMPTS - 1 or not is_retryable(e):
+                raise
+            delay = min(BACKOFF_MAX, BACKOFF_FIRST * 2 ** attempt)
+            delay *= random.uniform(0.5, 1.0)
+            print('X', end='', flush=True)
+            time.sleep(delay)
+
+
+def import_parallel(source, parallel, checkpoint=None):
+    es = PrefixedElasticsearch()
+
+    done = set()
+    if checkpoint is not None and os.path.exists(checkpoint):
+        with open(checkpoint, 'r') as fp:
+            for line in fp:
+                if line.endswith('\n'):  # Ignore a partial line
+                    done.update(json.loads(line))
+        print("Skipping %d entries from checkpoint" % len(done), flush=True)
+
+    batch_size = BulkIndexer(es).batch_size
+    batches = make_batches(es, read_export(source), done, batch_size)
+    checkpoint_fp = None
+    if checkpoint is not None:
+        checkpoint_fp = open(checkpoint, 'a')
+
+    nb_entries = nb_documents = nb_batches = 0
+    start = time.perf_counter()
+
+    def batch_done(future, batch):
+        nonlocal nb_entries, nb_documents, nb_batches
+        nb_documents += future.result()
+        nb_entries += len(batch.names)
+        nb_batches += 1
+        if checkpoint_fp is not None:
+            checkpoint_fp.write(json.dumps(batch.names) + '\n')
+            checkpoint_fp.flush()
+        if nb_batches % 20 == 0:
+            print(
+                "\n%d entries, %d documents, %.0f documents/sec" % (
+                    nb_entries, nb_documents,
+                    nb_documents / (time.perf_counter() - start),
+                ),
+                flush=True,
+            )
+        else:
+            print('.', end='', flush=True)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(parallel) as executor:
+            pending = {}
+            try:
+                for batch in batches:
+                    # Don't read the export further than needed
+                    while len(pending) >= 2 * parallel:
+                        finished, _ = concurrent.futures.wait(
+                            pending,
+                            return_when=concurrent.futures.FIRST_COMPLETED,
+                        )
+                        for future in finished:
+                            batch_done(future, pending.pop(future))
+                    pending[executor.submit(send_batch, es, batch)] = batch
+                for future in concurrent.futures.as_completed(list(pending)):
+                    batch_done(future, pending.pop(future))
+            finally:
+                # On error, still record the batches that made it
+                for future in list(pending):
+                    future.cancel()
+                concurrent.futures.wait(pending)
+                for future, batch in pending.items():
+                    if (
+                        not future.cancelled()
+                        and future.exception() is None
+                    ):
+                        batch_done(future, batch)
+    finally:
+        if checkpoint_fp is not None:
+            checkpoint_fp.close()
+        es.close()
+
+    elapsed = time.perf_counter() - start
+    print(
+        "\nImported %d entries, %d documents in %.0fs, %.0f documents/sec" % (
+            nb_entries, nb_documents, elapsed,
+            nb_documents / elapsed if elapsed else 0,
+        ),
+        flush=True,
+    )
+
+
+def main():
     logging.basicConfig(level=logging.INFO)
     logging.getLogger('elasticsearch').setLevel(logging.ERROR)
     logging.getLogger('datamart_core.common').setLevel(logging.WARNING)
 
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(loop.create_task(
-        import_all(sys.argv[1])
-    ))
+    parser = argparse.ArgumentParser(
+        description="Import an exported index",
+    )
+    parser.add_argument(
+        '--parallel', type=int, default=None, metavar='N',
+        help="Stream the export and send N batches at a time",
+    )
+    parser.add_argument(
+        '--checkpoint', default=None, metavar='FILE',
+        help="Record progress in FILE, and skip what it lists (needs "
+        + "--parallel)",
+    )
+    parser.add_argument('source', help="Export folder or snapshot tar file")
+    args = parser.parse_args()
+
+    if args.parallel:
+        import_parallel(args.source, args.parallel, args.checkpoint)
+    elif args.checkpoint is not None:
+        parser.error("--checkpoint needs --parallel")
+    elif not os.path.isdir(args.source):
+        parser.error("Reading a tar file needs --parallel")
+    else:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(loop.create_task(
+            import_all(args.source)
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,7 +13,8 @@ import logging
 import os
 import sys
 
-from datamart_core.common import PrefixedElasticsearch, json2msg
+from datamart_core.common import PrefixedElasticsearch, \
+    PROFILE_PRIORITY_LOW, PROFILE_PRIORITY_USER, profile_message
 
 
 logger = logging.getLogger(__name__)
@@ -55,9 +56,9 @@ async def freshen(datasets, priority):
         if obj.get('manual_annotations'):
             metadata['manual_annotations'] = obj['manual_annotations']
         await amqp_profile_exchange.publish(
-            json2msg(
-                dict(id=dataset_id, metadata=metadata),
-                priority=priority,
+            profile_message(
+                dataset_id, metadata,
+                priority, obj.get('size'),
             ),
             '',
         )
@@ -68,9 +69,9 @@ if __name__ == '__main__':
 
     args = sys.argv[1:]
 
-    priority = 0
+    priority = PROFILE_PRIORITY_LOW
     if args and args[0] == '--prio2':
-        priority = 2
+        priority = PROFILE_PRIORITY_USER
         args = args[1:]
 
     loop = asyncio.get_event_loop()
@@ -13,7 +13,8 @@ import logging
 import os
 import sys
 
-from datamart_core.common import json2msg, decode_dataset_id
+from datamart_core.common import PROFILE_PRIORITY_LOW, profile_message, \
+    decode_dataset_id
 
 
 async def import_all(folder):
@@ -45,7 +46,10 @@ async def import_all(folder):
             if obj.get('manual_annotations'):
                 metadata['manual_annotations'] = obj['manual_annotations']
             await amqp_profile_exchange.publish(
-                json2msg(dict(id=dataset_id, metadata=metadata)),
+                profile_message(
+                    dataset_id, metadata,
+                    PROFILE_PRIORITY_LOW, obj.get('size'),
+                ),
                 '',
             )
             print('.', end='', flush=True)
@@ -3,7 +3,9 @@ from datetime import datetime
 import io
 import json
 import logging
+import os
 import tarfile
+import tempfile
 
 from datamart_core.common import PrefixedElasticsearch, encode_dataset_id, \
     setup_logging
@@ -45,7 +47,14 @@ def snapshot():
     object_store = get_object_store()
 
     tarname = '%s.tar.gz' % datetime.utcnow().strftime('%Y-%m-%d')
-    with object_store.open('snapshots', tarname, 'wb') as fp:
+    with tempfile.TemporaryDirectory(prefix='datamart_snapshot_') as tmp:
+        path = os.path.join(tmp, tarname)
+        dump_snapshot(es, path, tarname)
+        object_store.upload_from('snapshots', tarname, path)
+
+
+def dump_snapshot(es, path, tarname):
+    with open(path, 'wb') as fp:
         with tarfile.open(tarname, 'w:gz', fileobj=fp) as tar:
             logger.info("Dumping datasets")
             hits = es.scan(
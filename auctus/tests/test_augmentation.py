@@ -1,9 +1,15 @@
 import contextlib
+import fastparquet
 import os
+import pandas
 import tempfile
+from unittest import mock
 
 from datamart_augmentation import join, union
+from datamart_augmentation.augmentation import UNIQUE_INDEX_KEY, \
+    perform_aggregations
 from datamart_materialize import make_writer
+from datamart_materialize.parquet import csv_to_parquet
 from datamart_profiler import process_dataset
 
 from .test_profile import check_ranges
@@ -208,6 +214,199 @@ class TestJoin(DataTestCase):
             },
         )
 
+    def test_agg_join_chunks(self):
+        """Join with aggregation over multiple chunks of companion data"""
+        with setup_augmentation('agg_aug.csv', 'agg.csv') as (
+            orig_data, aug_data, orig_meta, aug_meta, result, writer,
+        ):
+            with mock.patch(
+                'datamart_augmentation.augmentation.CHUNK_SIZE_ROWS', 2,
+            ):
+                output_metadata = join(
+                    orig_data,
+                    aug_data,
+                    orig_meta,
+                    aug_meta,
+                    writer,
+                    [[0]],
+                    [[0]],
+                    agg_functions={
+                        'work': 'count',
+                        'salary': ['mean', 'sum', 'min', 'count'],
+                    },
+                )
+
+            with open(result) as table:
+                self.assertCsvEqualNoOrder(
+                    table.read(),
+                    'id,location,count work,mean salary,'
+                    + 'sum salary,min salary,count salary',
+                    [
+                        '30,south korea,2,150.0,300.0,100.0,2',
+                        '40,brazil,1,,,,0',
+                        '70,usa,2,600.0,600.0,600.0,1',
+                        '80,canada,1,200.0,200.0,200.0,1',
+                        '100,france,2,250.0,500.0,200.0,2',
+                    ],
+                )
+
+        self.assertEqual(
+            [col['name'] for col in output_metadata['columns']],
+            [
+                'id', 'location', 'count work', 'mean salary', 'sum salary',
+                'min salary', 'count salary',
+            ],
+        )
+        self.assertEqual(
+            output_metadata['qualities'][0]['qualValue']['nb_rows_after'],
+            5,
+        )
+
+    def test_agg_join_many_matches(self):
+        """Join with aggregation of many rows, over chunks of companion data"""
+        with setup_augmentation('agg_aug.csv', 'agg.csv') as (
+            orig_data, aug_data, orig_meta, aug_meta, result, writer,
+        ):
+            tmp = os.path.dirname(result)
+            companion = os.path.join(tmp, 'companion.csv')
+            with open(companion, 'w') as fp:
+                fp.write('id,value,number,name\n')
+                for i in range(300):
+                    value = 0.1 * i + 1e-7 * (i % 7)
+                    fp.write('30,%r,%d,name%d\n' % (value, i - 100, i))
+                    if i % 3 == 0:
+                        fp.write('100,%r,%d,other%d\n' % (value * 2, i, i))
+            companion_meta = process_dataset(companion)
+
+            # Same as aggregating the whole join with pandas
+            orig_data.seek(0)
+            original = pandas.read_csv(orig_data)
+            original[UNIQUE_INDEX_KEY] = range(len(original))
+            joined = original.merge(
+                pandas.read_csv(companion),
+                how='left', on='id',
+            )
+
+            for agg_functions in [
+                None,
+                {'value': ['sum', 'count', 'first'], 'number': 'max',
+                 'name': 'count'},
+            ]:
+                expected = perform_aggregations(
+                    joined,
+                    list(original.columns),
+                    agg_functions,
+                    {'value': 'value', 'number': 'number', 'name': 'name'},
+                )
+                expected.drop([UNIQUE_INDEX_KEY], axis=1, inplace=True)
+
+                for chunk_size in [10000, 7]:
+                    orig_data.seek(0)
+                    result = os.path.join(tmp, 'result%d.csv' % chunk_size)
+                    with mock.patch(
+                        'datamart_augmentation.augmentation.CHUNK_SIZE_ROWS',
+                        chunk_size,
+                    ):
+                        join(
+                            orig_data,
+                            companion,
+                            orig_meta,
+                            companion_meta,
+                            make_writer(result),
+                            [[0]],
+                            [[0]],
+                            agg_functions=agg_functions,
+                        )
+                    # Sums are done in a different order
+                    pandas.testing.assert_frame_equal(
+                        pandas.read_csv(result),
+                        expected,
+                        check_exact=False,
+                        rtol=1e-12,
+                    )
+
+    def test_agg_join_parquet(self):
+        """Join with aggregation, reading the companion data from Parquet"""
+        with setup_augmentation('agg_aug.csv', 'agg.csv') as (
+            orig_data, aug_data, orig_meta, aug_meta, result, writer,
+        ):
+            parquet = os.path.join(os.path.dirname(result), 'agg.parquet')
+            fastparquet.write(
+                parquet,
+                pandas.read_csv(aug_data),
+                write_index=False,
+            )
+
+            output_metadata = join(
+                orig_data,
+                parquet,
+                orig_meta,
+                aug_meta,
+                writer,
+                [[0]],
+                [[0]],
+                columns=[2],
+            )
+
+            with open(result) as table:
+                self.assertCsvEqualNoOrder(
+                    table.read(),
+                    'id,location,mean salary,sum salary,max salary,min salary',
+                    [
+                        '30,south korea,150.0,300.0,200.0,100.0',
+                        '40,brazil,,,,',
+                        '70,usa,600.0,600.0,600.0,600.0',
+                        '80,canada,200.0,200.0,200.0,200.0',
+                        '100,france,250.0,500.0,300.0,200.0',
+                    ],
+                )
+
+        self.assertEqual(
+            output_metadata['qualities'][0]['qualValue']['new_columns'],
+            ['mean salary', 'sum salary', 'max salary', 'min salary'],
+        )
+
+    def test_agg_join_sidecar(self):
+        """Join with the Parquet sidecar gives the same result as the CSV"""
+        with setup_augmentation('agg_aug.csv', 'agg.csv') as (
+            orig_data, aug_data, orig_meta, aug_meta, result, writer,
+        ):
+            tmp = os.path.dirname(result)
+            companion = os.path.join(tmp, 'companion.csv')
+            with open(companion, 'w') as fp:
+                fp.write(
+                    'id,work,salary,ratio,count\n'
+                    '40,False,,1.50,1\n'
+                    '30,True,200,1e3,2\n'
+                    '70,True,,2,\n'
+                    '80,True,200,0.5,4\n'
+                    '100,False,300,3,5\n'
+                    '100,True,200,1.50,6\n'
+                    '30,False,100,2.5,7\n'
+                    '70,False,600,2,8\n'
+                )
+            companion_meta = process_dataset(companion)
+            sidecar = os.path.join(tmp, 'companion.parquet')
+            csv_to_parquet(companion, sidecar, companion_meta['columns'])
+
+            outputs = []
+            for i, companion_data in enumerate([companion, sidecar]):
+                orig_data.seek(0)
+                result = os.path.join(tmp, 'result%d.csv' % i)
+                join(
+                    orig_data,
+                    companion_data,
+                    orig_meta,
+                    companion_meta,
+                    make_writer(result),
+                    [[0]],
+                    [[0]],
+                )
+                with open(result) as table:
+                    outputs.append(table.read())
+            self.assertEqual(outputs[1], outputs[0])
+            self.assertIn('mean ratio', outputs[0].splitlines()[0])
+
     def test_agg_join_specific_functions(self):
         """Join between integer keys, with specified aggregation functions"""
         with setup_augmentation('agg_aug.csv', 'agg.csv') as (
@@ -890,3 +1089,45 @@ class TestUnion(DataTestCase):
                 ],
             },
         )
+
+    def test_union_parquet(self):
+        """Union reading both datasets from Parquet, like the CSV"""
+        with setup_augmentation('geo_aug.csv', 'geo.csv') as (
+            orig_data, aug_data, orig_meta, aug_meta, result, writer,
+        ):
+            union(
+                orig_data,
+                aug_data,
+                orig_meta,
+                aug_meta,
+                writer,
+                [[0], [1], [2]],
+                [[1], [2], [0]],
+            )
+            with open(result) as table:
+                expected = table.read()
+
+            tmp = os.path.dirname(result)
+            paths = []
+            for name, fp in [('orig', orig_data), ('aug', aug_data)]:
+                fp.seek(0)
+                path = os.path.join(tmp, '%s.parquet' % name)
+                fastparquet.write(
+                    path,
+                    pandas.read_csv(fp, dtype=str, na_filter=False),
+                    write_index=False,
+                )
+                paths.append(path)
+
+            result = os.path.join(tmp, 'result_parquet.csv')
+            union(
+                paths[0],
+                paths[1],
+                orig_meta,
+                aug_meta,
+                make_writer(result),
+                [[0], [1], [2]],
+                [[1], [2], [0]],
+            )
+            with open(result) as table:
+                self.assertEqual(table.read(), expected)
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from datamart_fslock.cache import cache_get, cache_get_or_set
+
+from cache_cleaner.eviction import CacheIndex
+
+
+class TestEviction(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='cache_cleaner_')
+        self.aug = os.path.join(self.tmp, 'aug')
+        self.datasets = os.path.join(self.tmp, 'datasets')
+        os.mkdir(self.aug)
+        os.mkdir(self.datasets)
+        self.index_path = os.path.join(self.tmp, 'index.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def create(self, cache_dir, key, size, delay=0.0):
+        def create(path):
+            time.sleep(delay)
+            with open(path, 'wb') as fp:
+                fp.write(b'a' * size)
+
+        with cache_get_or_set(cache_dir, key, create):
+            pass
+
+    def use(self, cache_dir, key):
+        # Make sure the mtime changes
+        time.sleep(0.01)
+        with cache_get(cache_dir, key) as path:
+            self.assertIsNotNone(path)
+
+    def make_entries(self):
+        # A big dataset, cheap to get and used once
+        self.create(self.datasets, 'big', 100000)
+        # Small augmentation results, slower to compute and used again
+        self.create(self.aug, 'small1', 1000, delay=0.2)
+        self.create(self.aug, 'small2', 1000, delay=0.2)
+
+    def scan(self, index):
+        return [
+            index.scan(self.datasets),
+            index.scan(self.aug),
+        ]
+
+    def test_scan(self):
+        """Test indexing the entries and counting hits."""
+        self.make_entries()
+        index = CacheIndex(self.index_path, [self.datasets, self.aug])
+        datasets, aug = self.scan(index)
+        self.assertEqual((datasets.entries, datasets.bytes), (1, 100000))
+        self.assertEqual((aug.entries, aug.bytes), (2, 2000))
+        self.assertEqual((aug.hits, aug.misses), (0, 2))
+        self.assertGreater(index.entries[self.aug]['small1']['cost'], 0.1)
+        index.save()
+
+        # Load it back
+        self.use(self.aug, 'small1')
+        index = CacheIndex(self.index_path, [self.datasets, self.aug])
+        datasets, aug = self.scan(index)
+        self.assertEqual((datasets.hits, datasets.misses), (0, 0))
+        self.assertEqual((aug.hits, aug.misses), (1, 0))
+        self.assertEqual(aug.hit_ratio, 1.0)
+        self.assertEqual(index.entries[self.aug]['small1']['hits'], 2)
+
+    def test_lru(self):
+        """Test evicting the least recently used entries."""
+        self.make_entries()
+        self.use(self.aug, 'small1')
+        self.use(self.datasets, 'big')
+        self.use(self.aug, 'small2')
+        index = CacheIndex(
+            self.index_path, [self.datasets, self.aug],
+            policy='lru',
+        )
+        self.scan(index)
+        freed = index.evict([self.datasets, self.aug], 500)
+        self.assertEqual(freed, {self.datasets: (0, 0), self.aug: (1, 1000)})
+        self.assertEqual(
+            sorted(os.listdir(self.aug)),
+            ['small2.cache', 'small2.lock'],
+        )
+
+    def test_cost(self):
+        """Test evicting big entries that are cheap to create first."""
+        self.make_entries()
+        index = CacheIndex(self.index_path, [self.datasets, self.aug])
+        self.scan(index)
+        self.use(self.aug, 'small1')
+        self.use(self.aug, 'small2')
+        self.use(self.datasets, 'big')
+        self.scan(index)
+        freed = index.evict([self.datasets, self.aug], 500)
+        self.assertEqual(
+            freed,
+            {self.datasets: (1, 100000), self.aug: (0, 0)},
+        )
+        self.assertEqual(os.listdir(self.datasets), [])
+
+    def test_locked(self):
+        """Test that entries in use are not evicted."""
+        self.make_entries()
+        index = CacheIndex(self.index_path, [self.datasets, self.aug])
+        self.scan(index)
+        with cache_get(self.datasets, 'big'):
+            freed = index.evict([self.datasets, self.aug], 500)
+        self.assertEqual(freed, {self.datasets: (0, 0), self.aug: (1, 1000)})
@@ -1,4 +1,8 @@
+import elasticsearch.helpers
+import json
+import os
 import unittest
+from unittest import mock
 
 from datamart_core import common
 
@@ -48,3 +52,142 @@ class TestStripHtml(unittest.TestCase):
             ),
             "Run python <program>",
         )
+
+
+class TestProfileMessage(unittest.TestCase):
+    def test_priority(self):
+        """Large datasets get a low priority by default"""
+        with mock.patch.dict(os.environ, {'PROFILE_LARGE_SIZE': '1000'}):
+            msg = common.profile_message('ds1', {'name': "Test"})
+            self.assertEqual(msg.priority, common.PROFILE_PRIORITY_DISCOVERY)
+            self.assertNotIn('size', msg.headers)
+            self.assertIn('sent', msg.headers)
+            self.assertEqual(
+                json.loads(msg.body.decode('utf-8')),
+                {'id': 'ds1', 'metadata': {'name': "Test"}},
+            )
+
+            msg = common.profile_message('ds1', {'size': 2000})
+            self.assertEqual(msg.priority, common.PROFILE_PRIORITY_LOW)
+            self.assertEqual(msg.headers['size'], 2000)
+
+            msg = common.profile_message(
+                'ds1', {'size': 2000}, common.PROFILE_PRIORITY_USER, 3000,
+            )
+            self.assertEqual(msg.priority, common.PROFILE_PRIORITY_USER)
+            self.assertEqual(msg.headers['size'], 3000)
+
+            msg = common.profile_message('ds1', {'size': None})
+            self.assertEqual(msg.priority, common.PROFILE_PRIORITY_DISCOVERY)
+            self.assertNotIn('size', msg.headers)
+
+
+class TestBulkIndexer(unittest.TestCase):
+    def make_es(self):
+        es = mock.Mock()
+        es.bulk.side_effect = lambda actions: {
+            'errors': False,
+            'items': [{op: {'status': 200}} for op, _, _, _ in actions],
+        }
+        return es
+
+    def test_batches(self):
+        """Operations are sent in batches, when there are enough of them"""
+        es = self.make_es()
+        bulk = common.BulkIndexer(es, batch_size=3, flush_interval=3600)
+        for i in range(5):
+            bulk.index('columns', {'index': i})
+            bulk.flush_if_needed()
+        self.assertEqual(es.bulk.call_count, 1)
+        self.assertEqual(len(bulk), 2)
+        bulk.delete('datasets', 'id1')
+        bulk.flush()
+        self.assertEqual(
+            [call[0][0] for call in es.bulk.call_args_list],
+            [
+                [('index', 'columns', None, {'index': i}) for i in range(3)],
+                [
+                    ('index', 'columns', None, {'index': 3}),
+                    ('index', 'columns', None, {'index': 4}),
+                    ('delete', 'datasets', 'id1', None),
+                ],
+            ],
+        )
+        self.assertEqual(len(bulk), 0)
+        self.assertEqual((bulk.documents, bulk.requests), (6, 2))
+
+    def test_interval(self):
+        """Operations are sent once they have waited long enough"""
+        es = self.make_es()
+        bulk = common.BulkIndexer(es, batch_size=100, flush_interval=0)
+        bulk.flush_if_needed()
+        self.assertEqual(es.bulk.call_count, 0)
+        bulk.index('columns', {})
+        bulk.flush_if_needed()
+        self.assertEqual(es.bulk.call_count, 1)
+
+    def test_errors(self):
+        """Failed requests are kept, failed documents raise"""
+        es = mock.Mock()
+        es.bulk.side_effect = elasticsearch.ConnectionError('N/A', 'down')
+        bulk = common.BulkIndexer(es)
+        bulk.index('columns', {'a': 1})
+        with self.assertRaises(elasticsearch.TransportError):
+            bulk.flush()
+        self.assertEqual(len(bulk), 1)
+
+        es.bulk.side_effect = None
+        es.bulk.return_value = {
+            'errors': True,
+            'items': [{'index': {'status': 400, 'error': {'type': 'x'}}}],
+        }
+        with self.assertRaises(elasticsearch.helpers.BulkIndexError):
+            bulk.flush()
+        self.assertEqual(len(bulk), 0)
+
+    def test_add_dataset(self):
+        """Adding a dataset uses a single bulk request"""
+        es = self.make_es()
+        common.add_dataset_to_index(es, 'ds1', {
+            'name': "Test",
+            'columns': [
+                {'name': 'a', 'plot': {}},
+                {'name': 'b', 'coverage': [{'range': {'gte': 1, 'lte': 2}}]},
+            ],
+            'temporal_coverage': [{
+                'type': 'datetime',
+                'ranges': [{'range': {'gte': 1, 'lte': 2}}],
+            }],
+        })
+        self.assertEqual(es.bulk.call_count, 1)
+        es.index.assert_not_called()
+        actions = es.bulk.call_args[0][0]
+        self.assertEqual(
+            [(op, index, id) for op, index, id, _ in actions],
+            [
+                ('index', 'datasets', 'ds1'),
+                ('index', 'columns', None),
+                ('index', 'columns', None),
+                ('index', 'temporal_coverage', None),
+            ],
+        )
+        self.assertEqual(
+            actions[1][3],
+            {
+                'name': 'a', 'index': 0,
+                'dataset_id': 'ds1', 'dataset_name': "Test",
+            },
+        )
+
+    def test_add_lazo(self):
+        """Lazo documents go through the indexer, even when it is empty"""
+        es = self.make_es()
+        bulk = common.BulkIndexer(es)
+        common.add_dataset_to_lazo_storage(es, 'ds1__.__a', {'n': 1}, bulk)
+        es.index.assert_not_called()
+        self.assertEqual(len(bulk), 1)
+        bulk.flush()
+        self.assertEqual(
+            es.bulk.call_args[0][0],
+            [('index', 'lazo', 'ds1__.__a', {'n': 1})],
+        )
@@ -0,0 +1,289 @@
+import asyncio
+import opentelemetry.baggage
+import opentelemetry.context
+import os
+import unittest
+from unittest import mock
+
+from apiserver import executor
+from apiserver.executor import Executors, ExecutorQueueFull, SingleFlight, \
+    _EndpointLimit
+
+
+def get_baggage(name):
+    return opentelemetry.baggage.get_baggage(name)
+
+
+def prometheus_value(metric, label):
+    return metric.labels(label)._value.get()
+
+
+class TestEndpointLimit(unittest.TestCase):
+    def test_backpressure(self):
+        """Reject requests when all slots are taken and the queue is full"""
+        async def coro():
+            limit = _EndpointLimit('test_backpressure', 1, 1)
+            running = asyncio.Event()
+            release = asyncio.Event()
+
+            async def request():
+                async with limit.acquire():
+                    running.set()
+                    await release.wait()
+
+            first = asyncio.ensure_future(request())
+            await running.wait()
+            self.assertEqual(limit.queued, 0)
+
+            # Second request waits in the queue
+            running.clear()
+            second = asyncio.ensure_future(request())
+            await asyncio.sleep(0)
+            self.assertEqual(limit.queued, 1)
+            self.assertFalse(running.is_set())
+
+            # Third request is rejected (429)
+            rejected = prometheus_value(
+                executor.PROM_EXECUTOR_REJECTED, 'test_backpressure',
+            )
+            with self.assertRaises(ExecutorQueueFull):
+                async with limit.acquire():
+                    self.fail("Entered the limit")
+            self.assertEqual(
+                prometheus_value(
+                    executor.PROM_EXECUTOR_REJECTED, 'test_backpressure',
+                ),
+                rejected + 1,
+            )
+            self.assertEqual(limit.queued, 1)
+
+            # Requests run once slots are free
+            release.set()
+            await asyncio.gather(first, second)
+            self.assertEqual(limit.queued, 0)
+            self.assertFalse(limit.semaphore.locked())
+            self.assertEqual(
+                prometheus_value(
+                    executor.PROM_EXECUTOR_RUNNING, 'test_backpressure',
+                ),
+                0,
+            )
+            self.assertEqual(
+                prometheus_value(
+                    executor.PROM_EXECUTOR_QUEUED, 'test_backpressure',
+                ),
+                0,
+            )
+
+        asyncio.run(coro())
+
+    def test_cancel_queued(self):
+        """Requests cancelled while waiting leave the queue"""
+        async def coro():
+            limit = _EndpointLimit('test_cancel_queued', 1, 1)
+            release = asyncio.Event()
+
+            async def request():
+                async with limit.acquire():
+                    await release.wait()
+
+            first = asyncio.ensure_future(request())
+            await asyncio.sleep(0)
+            second = asyncio.ensure_future(request())
+            await asyncio.sleep(0)
+            self.assertEqual(limit.queued, 1)
+
+            second.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await second
+            self.assertEqual(limit.queued, 0)
+            self.assertEqual(
+                prometheus_value(
+                    executor.PROM_EXECUTOR_QUEUED, 'test_cancel_queued',
+                ),
+                0,
+            )
+
+            # The freed queue spot can be used
+            third = asyncio.ensure_future(request())
+            await asyncio.sleep(0)
+            self.assertEqual(limit.queued, 1)
+
+            release.set()
+            await asyncio.gather(first, third)
+            self.assertEqual(limit.queued, 0)
+            self.assertFalse(limit.semaphore.locked())
+
+        asyncio.run(coro())
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_coalesce(self):
+        """Concurrent calls with the same key share one computation"""
+        async def coro():
+            single_flight = SingleFlight('test_coalesce')
+            calls = []
+            release = asyncio.Event()
+
+            async def compute(key):
+                calls.append(key)
+                await release.wait()
+                return 'result %s' % key
+
+            futures = [
+                asyncio.ensure_future(single_flight.run(key, compute, key))
+                for key in ['a', 'b', 'a', 'a']
+            ]
+            await asyncio.sleep(0)
+            self.assertEqual(set(single_flight.in_flight), {'a', 'b'})
+            release.set()
+            self.assertEqual(
+                await asyncio.gather(*futures),
+                ['result a', 'result b', 'result a', 'result a'],
+            )
+            self.assertEqual(sorted(calls), ['a', 'b'])
+            self.assertEqual(single_flight.in_flight, {})
+            self.assertEqual(
+                prometheus_value(
+                    executor.PROM_SINGLEFLIGHT_COALESCED, 'test_coalesce',
+                ),
+                2,
+            )
+
+            # Computation is not cached once done
+            self.assertEqual(
+                await single_flight.run('a', compute, 'a'),
+                'result a',
+            )
+            self.assertEqual(sorted(calls), ['a', 'a', 'b'])
+
+        asyncio.run(coro())
+
+    def test_error(self):
+        """Errors go to all the waiting calls"""
+        async def coro():
+            single_flight = SingleFlight('test_error')
+            release = asyncio.Event()
+
+            async def compute():
+                await release.wait()
+                raise ValueError("failed")
+
+            futures = [
+                asyncio.ensure_future(single_flight.run('key', compute))
+                for _ in range(2)
+            ]
+            await asyncio.sleep(0)
+            release.set()
+            results = await asyncio.gather(*futures, return_exceptions=True)
+            self.assertEqual(len(results), 2)
+            for result in results:
+                self.assertIsInstance(result, ValueError)
+            self.assertEqual(single_flight.in_flight, {})
+
+        asyncio.run(coro())
+
+    def test_cancel(self):
+        """Cancelling one call doesn't cancel the shared computation"""
+        async def coro():
+            single_flight = SingleFlight('test_cancel')
+            release = asyncio.Event()
+
+            async def compute():
+                await release.wait()
+                return 42
+
+            first = asyncio.ensure_future(single_flight.run('key', compute))
+            second = asyncio.ensure_future(single_flight.run('key', compute))
+            await asyncio.sleep(0)
+            first.cancel()
+            release.set()
+            self.assertEqual(await second, 42)
+            self.assertTrue(first.cancelled())
+            self.assertEqual(single_flight.in_flight, {})
+
+        asyncio.run(coro())
+
+
+class TestExecutors(unittest.TestCase):
+    def make_executors(self, **environ):
+        with mock.patch.dict(os.environ, environ):
+            executors = Executors()
+        self.addCleanup(executors.shutdown)
+        return executors
+
+    def test_limits(self):
+        """Override the limits from the environment"""
+        async def coro():
+            executors = self.make_executors(
+                APISERVER_PROCESSES='1',
+                APISERVER_THREADS='2',
+                APISERVER_LIMITS='{"search": [1, 3], "other": [5, 6]}',
+            )
+            self.assertEqual(executors.process_pool._max_workers, 1)
+            self.assertEqual(executors.thread_pool._max_workers, 2)
+            self.assertEqual(
+                {
+                    endpoint: limit.queue_size
+                    for endpoint, limit in executors.limits.items()
+                },
+                {'profile': 8, 'augment': 8, 'search': 3, 'other': 6},
+            )
+
+        asyncio.run(coro())
+
+    def test_invalid_limits(self):
+        """Reject invalid limits from the environment"""
+        async def coro():
+            for limits in [
+                '{"search": 4}',
+                '{"search": [4]}',
+                '{"search": [4, 16, 1]}',
+                '{"search": [0, 16]}',
+                '{"search": [4, "16"]}',
+                '{"search": [4.0, 16]}',
+            ]:
+                with self.subTest(limits=limits):
+                    with self.assertRaises(ValueError):
+                        self.make_executors(APISERVER_LIMITS=limits)
+
+        asyncio.run(coro())
+
+    def test_run_in_process(self):
+        """Run functions in the process pool, with the tracing context"""
+        async def coro():
+            executors = self.make_executors(APISERVER_PROCESSES='1')
+            token = opentelemetry.context.attach(
+                opentelemetry.baggage.set_baggage('request', 'test-request'),
+            )
+            try:
+                self.assertEqual(
+                    await executors.run_in_process(get_baggage, 'request'),
+                    'test-request',
+                )
+                self.assertEqual(
+                    await executors.run_in_thread(
+                        executors.call_in_process,
+                        get_baggage, 'request',
+                    ),
+                    'test-request',
+                )
+            finally:
+                opentelemetry.context.detach(token)
+
+        asyncio.run(coro())
+
+
+class TestWorkerResources(unittest.TestCase):
+    def test_lazo_lazy(self):
+        """The Lazo client is not needed for fast profiles"""
+        environ = {
+            k: v for k, v in os.environ.items()
+            if not k.startswith('LAZO_SERVER_')
+        }
+        with mock.patch.dict(os.environ, environ, clear=True), \
+                mock.patch('datamart_geo.GeoData.from_local_cache') as geo, \
+                mock.patch.object(executor, '_worker_resources', None):
+            resources = executor.worker_resources()
+        self.assertIs(resources['geo_data'], geo.return_value)
+        self.assertNotIn('lazo_client', resources)
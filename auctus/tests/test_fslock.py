@@ -0,0 +1,160 @@
+import os
+import prometheus_client
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from datamart_fslock import FSLockExclusive, FSLockShared
+from datamart_fslock.cache import cache_get_or_set
+
+
+def locks_acquired(type_, path):
+    return prometheus_client.REGISTRY.get_sample_value(
+        'cache_locks_acquired_total',
+        {'type': type_, 'path': path},
+    )
+
+
+class TestLock(unittest.TestCase):
+    def setUp(self):
+        fd, self.lock_path = tempfile.mkstemp(prefix='datamart_fslock_')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.lock_path)
+
+    def test_shared_fast(self):
+        """Test that available shared locks are taken in-process."""
+        fast = locks_acquired('shared', 'fast')
+        slow = locks_acquired('shared', 'subprocess')
+        with FSLockShared(self.lock_path):
+            with FSLockShared(self.lock_path):
+                pass
+        self.assertEqual(locks_acquired('shared', 'fast'), fast + 2)
+        self.assertEqual(locks_acquired('shared', 'subprocess'), slow)
+
+    def test_missing(self):
+        """Test that a shared lock on a missing file fails."""
+        with self.assertRaises(FileNotFoundError):
+            with FSLockShared(self.lock_path + '.missing'):
+                pass
+
+    def test_timeout(self):
+        """Test that exclusive locks wait for shared locks."""
+        with FSLockShared(self.lock_path):
+            with self.assertRaises(TimeoutError):
+                with FSLockExclusive(self.lock_path, timeout=0):
+                    pass
+            with self.assertRaises(TimeoutError):
+                with FSLockExclusive(self.lock_path, timeout=1):
+                    pass
+        with FSLockExclusive(self.lock_path, timeout=0):
+            pass
+
+    def test_wait(self):
+        """Test waiting for a lock held by another thread."""
+        locked = threading.Event()
+
+        def hold():
+            with FSLockExclusive(self.lock_path):
+                locked.set()
+                time.sleep(1)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        locked.wait()
+        slow = locks_acquired('shared', 'subprocess')
+        start = time.perf_counter()
+        with FSLockShared(self.lock_path):
+            self.assertGreater(time.perf_counter() - start, 0.5)
+        thread.join()
+        self.assertEqual(locks_acquired('shared', 'subprocess'), slow + 1)
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix='datamart_fslock_')
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_or_set(self):
+        """Test creating an entry then getting it from the cache."""
+        def create(path):
+            with open(path, 'w') as fp:
+                fp.write('one')
+
+        def fail(path):
+            raise AssertionError("Entry created again")
+
+        with cache_get_or_set(self.cache_dir, 'key', create) as path:
+            with open(path) as fp:
+                self.assertEqual(fp.read(), 'one')
+        with cache_get_or_set(self.cache_dir, 'key', fail) as path:
+            with open(path) as fp:
+                self.assertEqual(fp.read(), 'one')
+
+    def test_coalesce(self):
+        """Test threads asking for the same entry only create it once."""
+        calls = []
+        started = threading.Event()
+
+        def create(path):
+            calls.append(path)
+            started.set()
+            time.sleep(1)
+            with open(path, 'w') as fp:
+                fp.write('data')
+
+        results = []
+
+        def get():
+            with cache_get_or_set(self.cache_dir, 'key', create) as path:
+                with open(path) as fp:
+                    results.append(fp.read())
+
+        threads = [threading.Thread(target=get) for _ in range(4)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['data'] * 4)
+
+    def test_coalesce_error(self):
+        """Test threads waiting for a failed creation get the error."""
+        calls = []
+
+        started = threading.Event()
+
+        def create(path):
+            calls.append(path)
+            started.set()
+            time.sleep(1)
+            raise ValueError("Creation failed")
+
+        errors = []
+
+        def get():
+            try:
+                with cache_get_or_set(self.cache_dir, 'key', create):
+                    pass
+            except ValueError as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=get) for _ in range(3)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, ["Creation failed"] * 3)
+        self.assertEqual(os.listdir(self.cache_dir), [])
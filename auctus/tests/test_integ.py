@@ -1197,6 +1197,52 @@ class TestDownload(DatamartTest):
                          'application/octet-stream')
         self.assertTrue(response.content.startswith(b'dessert,year\r\n'))
 
+    def test_get_id_range(self):
+        """Download part of a dataset with a Range header"""
+        response = self.datamart_get('/download/' + 'datamart.test.lazo')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        content = response.content
+        etag = response.headers['ETag']
+
+        response = self.datamart_get(
+            '/download/' + 'datamart.test.lazo',
+            headers={'Range': 'bytes=0-11'},
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(
+            response.headers['Content-Range'],
+            'bytes 0-11/%d' % len(content),
+        )
+        self.assertEqual(response.content, b'dessert,year')
+
+        # Suffix range, with matching If-Range
+        response = self.datamart_get(
+            '/download/' + 'datamart.test.lazo',
+            headers={'Range': 'bytes=-10', 'If-Range': etag},
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, content[-10:])
+
+        # If-Range doesn't match, whole file is sent
+        response = self.datamart_get(
+            '/download/' + 'datamart.test.lazo',
+            headers={'Range': 'bytes=0-11', 'If-Range': '"outdated"'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, content)
+
+        # Range is past the end
+        response = self.datamart_get(
+            '/download/' + 'datamart.test.lazo',
+            headers={'Range': 'bytes=%d-' % len(content)},
+            check_status=False,
+        )
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(
+            response.headers['Content-Range'],
+            'bytes */%d' % len(content),
+        )
+
     def test_post(self):
         """Download datasets via POST /download"""
         # Basic dataset, materialized via direct_url
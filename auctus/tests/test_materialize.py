@@ -1,13 +1,23 @@
 import copy
+import csv
+import fastparquet
 import io
 import json
 import os
+import pandas
 import shutil
 import tempfile
 import unittest
+from unittest import mock
 
+from datamart_materialize import CsvWriter, types
+from datamart_materialize.common import SkipRowsConverter
 from datamart_materialize.d3m import D3mWriter, _D3mAddIndex
-from datamart_materialize.pivot import pivot_table
+from datamart_materialize.detect import detect_format_convert_to_csv
+from datamart_materialize.parquet import csv_to_parquet, parquet_to_csv, \
+    read_parquet_as_csv
+from datamart_materialize.pivot import PivotConverter, pivot_table
+from datamart_materialize.tsv import TsvConverter
 
 from .utils import data
 
@@ -353,3 +363,278 @@ class TestConvert(unittest.TestCase):
                 f_out.getvalue(),
                 f_exp.read(),
             )
+
+    def convert(self, chunks, *converters):
+        """Write chunks through a chain of converters, get the output"""
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = CsvWriter(os.path.join(tmp, 'out.csv'))
+            for converter_class, kwargs in reversed(converters):
+                writer = converter_class(writer, **kwargs)
+            with writer.open_file('wb') as fp:
+                for chunk in chunks:
+                    fp.write(chunk)
+            with open(os.path.join(tmp, 'out.csv'), newline='') as fp:
+                return fp.read()
+
+    def test_streaming_chunks(self):
+        """Test streaming converters with records split across writes"""
+        text = 'a\tb\r\n1\t"two\nlines"\n"x""y"\t\xe9\n'.encode('utf-8')
+        for size in (1, 2, 3, 5, len(text)):
+            self.assertEqual(
+                self.convert(
+                    [text[i:i + size] for i in range(0, len(text), size)],
+                    (TsvConverter, {}),
+                ),
+                'a,b\r\n1,"two\nlines"\r\n"x""y",\xe9\r\n',
+            )
+
+    def test_streaming_stray_quote(self):
+        """Test streaming converters with a quote that doesn't open a field"""
+        text = (
+            'name\tsize\n'
+            + 'screen\t12" wide\n' * 50
+            + '"multi\nline"\t"quoted ""field"""\n'
+            + 'other\t1"\n' * 50
+        )
+        expected = io.StringIO()
+        csv.writer(expected).writerows(
+            csv.reader(io.StringIO(text), delimiter='\t'),
+        )
+        text = text.encode('utf-8')
+        chunks = [text[i:i + 10] for i in range(0, len(text), 10)]
+        self.assertEqual(
+            self.convert(chunks, (TsvConverter, {})),
+            expected.getvalue(),
+        )
+
+        # Records are not held in memory past the limit
+        with mock.patch('datamart_materialize.utils.MAX_PENDING', 15):
+            self.assertEqual(
+                self.convert(chunks, (TsvConverter, {})),
+                expected.getvalue(),
+            )
+            self.assertEqual(
+                self.convert(
+                    [b'a\tb\n"unterminated\t', b'x' * 20, b'\n1\t2\n'],
+                    (TsvConverter, {}),
+                ),
+                'a,b\r\n"unterminated\t%s\n1\t2\n"\r\n' % ('x' * 20),
+            )
+
+    def test_streaming_chain(self):
+        """Test a chain of streaming converters"""
+        with data('years_pivoted.csv', 'rb') as fp:
+            text = b'note\nother note\n' + fp.read().replace(b',', b'\t')
+        expected = io.StringIO()
+        pivot_table(
+            os.path.join(os.path.dirname(__file__), 'data/years_pivoted.csv'),
+            expected,
+            [0],
+            'year',
+        )
+        self.assertEqual(
+            self.convert(
+                [text[i:i + 7] for i in range(0, len(text), 7)],
+                (TsvConverter, {}),
+                (SkipRowsConverter, {'nb_rows': 2}),
+                (PivotConverter, {'except_columns': [0],
+                                  'date_label': 'year'}),
+            ),
+            expected.getvalue(),
+        )
+
+        with self.assertRaises(ValueError):
+            self.convert([b'a\n'], (SkipRowsConverter, {'nb_rows': 2}))
+
+    def test_convert_file(self):
+        """Test converting a file on disk"""
+        source = os.path.join(os.path.dirname(__file__),
+                              'data/years_pivoted.csv')
+        expected = io.StringIO()
+        pivot_table(source, expected, [0], 'year')
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = CsvWriter(os.path.join(tmp, 'out.csv'))
+            writer = SkipRowsConverter(
+                PivotConverter(writer, except_columns=[0], date_label='year'),
+                nb_rows=0,
+            )
+            writer.convert_file(source)
+            with open(os.path.join(tmp, 'out.csv'), newline='') as f_out:
+                self.assertEqual(f_out.read(), expected.getvalue())
+
+    def test_csv_to_parquet(self):
+        """Test writing the typed Parquet version of a CSV file"""
+        columns = [
+            {'name': 'name', 'structural_type': types.TEXT},
+            {'name': 'number', 'structural_type': types.INTEGER},
+            {'name': 'ratio', 'structural_type': types.FLOAT},
+            {'name': 'code', 'structural_type': types.INTEGER},
+            {'name': 'count', 'structural_type': types.INTEGER},
+            {'name': 'scale', 'structural_type': types.FLOAT},
+        ]
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'data.csv')
+            with open(source, 'w') as fp:
+                fp.write(
+                    'name,number,ratio,code,count,scale\n'
+                    'one,1,0.5,12,1,1.50\n'
+                    'two,2,1.5,13,,1e3\n'
+                    'three,3,-2,1x,3,2\n'
+                    ',4,2.5,14,04,3\n'
+                )
+            dest = os.path.join(tmp, 'data.parquet')
+            csv_to_parquet(source, dest, columns, row_group_rows=2)
+
+            parquet = fastparquet.ParquetFile(dest)
+            self.assertEqual(len(parquet.row_groups), 2)
+            self.assertEqual(
+                {k: str(v) for k, v in parquet.dtypes.items()},
+                {
+                    'name': 'object',
+                    'number': 'int64',
+                    'ratio': 'float64',
+                    # Those would be written differently, kept as text
+                    'code': 'object',
+                    'count': 'object',
+                    'scale': 'object',
+                },
+            )
+            self.assertEqual(
+                parquet.statistics['min']['number'],
+                [1, 3],
+            )
+
+            # Reads the same as the CSV
+            for kwargs in [{}, {'dtype': str, 'na_filter': False}]:
+                expected = list(pandas.read_csv(
+                    source, chunksize=3, **kwargs,
+                ))
+                chunks = list(read_parquet_as_csv(dest, 3, **kwargs))
+                self.assertEqual(len(chunks), len(expected))
+                for chunk, expected_chunk in zip(chunks, expected):
+                    pandas.testing.assert_frame_equal(chunk, expected_chunk)
+
+    def test_read_parquet_as_csv(self):
+        """Test reading Parquet data like its CSV version"""
+        df = pandas.DataFrame({
+            'name': ['one', None, 'three', '', 'five'],
+            'number': [1, 2, 3, 4, 5],
+            'ratio': [0.5, float('nan'), 1e3, 1.25, 2.0],
+            'flag': [True, False, True, True, False],
+            'date': pandas.to_datetime([
+                '2021-01-01', '2021-01-02 12:30', None, '2021-01-04',
+                '2021-01-05',
+            ]),
+            # Text that the CSV parser reads as numbers or booleans
+            'count': ['1', '', '3', 'NA', '05'],
+            'exact': ['0.1', '-0.16323186423288033', '1e3', 'inf', '2'],
+            'answer': ['true', 'False', 'TRUE', 'true', 'false'],
+            'padded': [' 1', '2', '+3', '4', '5'],
+        })
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'data.parquet')
+            fastparquet.write(
+                source, df,
+                row_group_offsets=[0, 2, 3],
+                write_index=False,
+            )
+            csv = io.StringIO()
+            parquet_to_csv(source, csv)
+
+            for kwargs in [{}, {'dtype': str, 'na_filter': False}]:
+                for columns in [None, ['ratio', 'name']]:
+                    csv.seek(0)
+                    expected = list(pandas.read_csv(
+                        csv, chunksize=2, usecols=columns, **kwargs,
+                    ))
+                    if columns is not None:
+                        expected = [chunk[columns] for chunk in expected]
+                    chunks = list(read_parquet_as_csv(
+                        source, 2, columns=columns, **kwargs,
+                    ))
+                    self.assertEqual(len(chunks), len(expected))
+                    for chunk, expected_chunk in zip(chunks, expected):
+                        pandas.testing.assert_frame_equal(
+                            chunk, expected_chunk,
+                        )
+
+
+class TestDetect(unittest.TestCase):
+    def detect(self, text):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, 'data.csv')
+            with open(source, 'w') as fp:
+                fp.write(text)
+
+            conversions = []
+
+            def convert_dataset(func, path):
+                conversions.append(path)
+                dest = path + '.conv'
+                with open(dest, 'w', newline='') as dst:
+                    func(path, dst)
+                return dest
+
+            materialize = {}
+            result = detect_format_convert_to_csv(
+                source, convert_dataset, materialize,
+            )
+
+            # Converted once, applying everything
+            self.assertEqual(conversions, [source])
+            with open(result, newline='') as fp:
+                return materialize, fp.read()
+
+    def pivoted_years(self):
+        expected = io.StringIO()
+        pivot_table(
+            os.path.join(os.path.dirname(__file__), 'data/years_pivoted.csv'),
+            expected,
+            [0],
+            'year',
+        )
+        return expected.getvalue()
+
+    def test_detect_skip_pivot(self):
+        """Test detecting rows to skip and pivot in one pass"""
+        with data('years_pivoted.csv', 'r') as f_in:
+            text = f_in.read()
+        materialize, output = self.detect('Some title\n\n' + text)
+        self.assertEqual(
+            materialize,
+            {'convert': [
+                {'identifier': 'skip_rows', 'nb_rows': 2},
+                {'identifier': 'pivot', 'except_columns': [0],
+                 'date_label': 'year'},
+            ]},
+        )
+        self.assertEqual(output, self.pivoted_years())
+
+    def test_detect_tsv_pivot(self):
+        """Test detecting separator and pivot in one pass"""
+        with data('years_pivoted.csv', 'r') as f_in:
+            text = f_in.read()
+        materialize, output = self.detect(text.replace(',', '\t'))
+        self.assertEqual(
+            materialize,
+            {'convert': [
+                {'identifier': 'tsv', 'separator': '\t'},
+                {'identifier': 'pivot', 'except_columns': [0],
+                 'date_label': 'year'},
+            ]},
+        )
+        self.assertEqual(output, self.pivoted_years())
+
+    def test_detect_nothing(self):
+        """Test that a plain CSV file is left alone"""
+        conversions = []
+        materialize = {}
+        path = os.path.join(os.path.dirname(__file__), 'data/basic.csv')
+        result = detect_format_convert_to_csv(
+            path,
+            lambda func, path: conversions.append(path),
+            materialize,
+        )
+        self.assertEqual(result, path)
+        self.assertEqual(conversions, [])
+        self.assertEqual(materialize, {})
@@ -0,0 +1,80 @@
+import fsspec.implementations.memory
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+
+from datamart_core.objectstore import ObjectStore, S3ObjectStore
+
+
+class TestTransfers(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='objectstore_')
+        self.data = os.urandom(100000)
+        self.path = os.path.join(self.tmp, 'data')
+        with open(self.path, 'wb') as fp:
+            fp.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def make_store(self, **kwargs):
+        return ObjectStore(
+            fsspec.implementations.memory.MemoryFileSystem(),
+            '/test-%s-' % uuid.uuid4().hex,
+            **kwargs,
+        )
+
+    def check_roundtrip(self, store):
+        store.upload_from('datasets', 'data', self.path)
+        with store.open('datasets', 'data') as fp:
+            self.assertEqual(fp.read(), self.data)
+
+        dest = os.path.join(self.tmp, 'dest')
+        size = store.download_to('datasets', 'data', dest)
+        self.assertEqual(size, len(self.data))
+        with open(dest, 'rb') as fp:
+            self.assertEqual(fp.read(), self.data)
+
+    def test_parts(self):
+        """Test transfers split in parts, including a partial last part."""
+        self.check_roundtrip(self.make_store(part_size=7000, concurrency=4))
+
+    def test_single(self):
+        """Test transfers smaller than a part."""
+        self.check_roundtrip(self.make_store(part_size=1000000))
+
+    def test_empty(self):
+        """Test transferring an empty object."""
+        self.data = b''
+        with open(self.path, 'wb'):
+            pass
+        self.check_roundtrip(self.make_store(part_size=7000))
+
+    def test_missing(self):
+        """Test downloading an object that doesn't exist."""
+        store = self.make_store()
+        with self.assertRaises(FileNotFoundError):
+            store.download_to(
+                'datasets', 'missing',
+                os.path.join(self.tmp, 'dest'),
+            )
+
+    @unittest.skipIf(not os.environ.get('S3_KEY'), "S3 is not configured")
+    def test_s3_multipart(self):
+        """Test a multipart upload to S3 (or MinIO)."""
+        self.data = os.urandom(11 << 20)
+        with open(self.path, 'wb') as fp:
+            fp.write(self.data)
+        store = S3ObjectStore()
+        store.part_size = 1 << 20
+        name = 'test-%s' % uuid.uuid4().hex
+        try:
+            store.upload_from('datasets', name, self.path)
+            dest = os.path.join(self.tmp, 'dest')
+            store.download_to('datasets', name, dest)
+            with open(dest, 'rb') as fp:
+                self.assertEqual(fp.read(), self.data)
+        finally:
+            store.delete('datasets', name)
@@ -3,6 +3,7 @@ import csv
 from datetime import datetime
 from dateutil.tz import UTC
 import io
+import numpy
 import os
 import pandas
 import random
@@ -123,6 +124,44 @@ class TestSample(unittest.TestCase):
             data, metadata, column_names = load_data(tmp.name, 6000)
             self.assertEqual(data.shape, (425, 2))
 
+    def test_sample_single_pass(self):
+        """Test sampling of tables in a single pass"""
+        with self.random_data(1000) as (tmp, filesize):
+            self.assertEqual(filesize, 11901)
+            data, metadata, column_names = load_data(
+                tmp.name, 5000, single_pass=True,
+            )
+            self.assertEqual(data.shape, (421, 2))
+            self.assertEqual(list(data.columns), ['id', 'number'])
+            self.assertEqual(metadata['nb_rows'], 1001)
+            self.assertEqual(list(data['id'][:5]), ['0', '1', '2', '4', '5'])
+
+        with self.random_data(600) as (tmp, filesize):
+            self.assertEqual(filesize, 7101)
+            data, metadata, column_names = load_data(
+                tmp.name, 5000, single_pass=True,
+            )
+            self.assertEqual(data.shape, (423, 2))
+
+    def test_records(self):
+        """Test reading records with values spanning multiple lines"""
+        from datamart_profiler.core import iter_csv_record_blocks, \
+            iter_csv_records
+
+        text = 'a,b\n1,"one\n""two"""\n2,three\n3,"four\nfive"'
+        expected = ['a,b\n', '1,"one\n""two"""\n', '2,three\n', '3,"four\nfive"']
+        self.assertEqual(list(iter_csv_records(io.StringIO(text))), expected)
+        self.assertEqual(
+            [
+                buf[start:end]
+                for buf, starts, ends in iter_csv_record_blocks(
+                    io.BytesIO(text.encode('utf-8')), 5,
+                )
+                for start, end in zip(starts, ends)
+            ],
+            [record.encode('utf-8') for record in expected],
+        )
+
 
 class TestNames(unittest.TestCase):
     def test_names(self):
@@ -204,6 +243,16 @@ class TestIndex(unittest.TestCase):
         )
 
 
+class TestParallel(unittest.TestCase):
+    def test_parallel(self):
+        """Test profiling the columns in multiple processes"""
+        with data('spatiotemporal.csv') as data_fp:
+            serial = process_dataset(data_fp, plots=True)
+        with data('spatiotemporal.csv') as data_fp:
+            parallel = process_dataset(data_fp, plots=True, workers=2)
+        self.assertEqual(parallel, serial)
+
+
 class TestLatlongSelection(DataTestCase):
     def test_normalize_name(self):
         """Test normalizing column names"""
@@ -352,6 +401,31 @@ class TestDates(DataTestCase):
             None,
         )
 
+        # ISO 8601 without going through dateutil
+        self.assertEqual(
+            parse_date('2019-07-02T21:13:19.25'),
+            datetime(2019, 7, 2, 21, 13, 19, 250000, tzinfo=UTC),
+        )
+        self.assertEqual(
+            parse_date('2019-07-02'),
+            datetime(2019, 7, 2, tzinfo=UTC),
+        )
+        self.assertEqual(parse_date('2019-02-30'), None)
+        self.assertEqual(parse_date('July'), None)
+
+    def test_parse_array(self):
+        """Test parsing an array of dates"""
+        self.assertEqual(
+            profile_types.parse_dates(pandas.Series([
+                '2019-07-02', 'July 1, 2019', '', 'abc', '2019-07-02', '12',
+            ])),
+            [
+                datetime(2019, 7, 2, tzinfo=UTC),
+                datetime(2019, 7, 1, tzinfo=UTC),
+                datetime(2019, 7, 2, tzinfo=UTC),
+            ],
+        )
+
     def test_year(self):
         """Test the 'year' special-case"""
         dataframe = pandas.DataFrame({
@@ -693,6 +767,30 @@ class TestTypes(unittest.TestCase):
             positive, negative,
         )
 
+    def test_count(self):
+        """Test counting values of each type"""
+        array = [
+            '12', '12', '4.0', '', '-.5e3', 'https://auctus.vida-nyu.org/',
+            '/usr/bin/python3', 'POINT (-73.997174 40.729753)',
+            'POINT(-73.997174,40.729753)', '(40.729753, -73.997174)',
+            'NEW YORK, NY (40.729753, -73.997174)',
+            'POLYGON ((1 2), (3 4))', 'some words in a sentence',
+            'yes', 'no', 'two words',
+        ]
+        expected = {
+            'int': 3, 'float': 1, 'empty': 1, 'url': 1, 'file': 1,
+            'point': 1, 'other_point': 1, 'latlong_point': 1,
+            'geo_combined': 1, 'polygon': 1, 'text': 1, 'bool': 2,
+        }
+        self.assertEqual(
+            dict(profile_types.regular_exp_count(array)),
+            expected,
+        )
+        self.assertEqual(
+            dict(profile_types.regular_exp_count(pandas.Series(array))),
+            expected,
+        )
+
 
 class TestTruncate(unittest.TestCase):
     def test_simple(self):
@@ -722,6 +820,68 @@ class TestTruncate(unittest.TestCase):
         )
 
 
+class TestNumerical(unittest.TestCase):
+    def test_parse(self):
+        """Test parsing numbers from strings"""
+        from datamart_profiler.numerical import parse_numerical_values
+
+        values = ['12', '', '-1.5', 'abc', '1e400', '1_000', 'nan', ' 3 ']
+        self.assertEqual(
+            list(parse_numerical_values(values)),
+            [12.0, -1.5, 1000.0, 3.0],
+        )
+        self.assertEqual(
+            list(parse_numerical_values(pandas.Series(values * 2000))),
+            [12.0, -1.5, 1000.0, 3.0] * 2000,
+        )
+
+    def test_mean_stddev(self):
+        """Test computing the mean and standard deviation"""
+        from datamart_profiler.numerical import mean_stddev
+
+        values = [0.1] * 10 + [0.7, 1e-3, 3.0]
+        self.assertEqual(
+            mean_stddev(values),
+            (0.36161538461538456, 0.7790550033372817),
+        )
+        self.assertEqual(
+            mean_stddev(numpy.array(values)),
+            (0.36161538461538456, 0.7790550033372817),
+        )
+        self.assertEqual(mean_stddev([]), (0, 0))
+
+    def test_ranges(self):
+        """Test computing ranges with the different estimators"""
+        from datamart_profiler.numerical import get_numerical_ranges
+
+        rng = numpy.random.RandomState(1)
+        values = numpy.concatenate([
+            rng.uniform(0.0, 10.0, 3000),
+            rng.uniform(100.0, 110.0, 2000),
+            rng.uniform(1000.0, 1010.0, 1000),
+        ])
+        rng.shuffle(values)
+        for estimator in ('kmeans', 'ckmeans'):
+            ranges = get_numerical_ranges(values, estimator)
+            self.assertEqual(len(ranges), 3)
+            for rg, (lower, upper) in zip(
+                ranges,
+                [(0.0, 10.0), (100.0, 110.0), (1000.0, 1010.0)],
+            ):
+                self.assertEqual(rg.keys(), {'range'})
+                self.assertTrue(lower < rg['range']['gte'] < lower + 1.0)
+                self.assertTrue(upper - 1.0 < rg['range']['lte'] < upper)
+
+        self.assertEqual(
+            get_numerical_ranges([1.0, 2.0, 3.0, 10.0], 'ckmeans'),
+            [
+                {'range': {'gte': 1.0, 'lte': 1.0}},
+                {'range': {'gte': 2.0, 'lte': 3.0}},
+                {'range': {'gte': 10.0, 'lte': 10.0}},
+            ],
+        )
+
+
 class TestNominatim(DataTestCase):
     """Test resolving addresses, mocking Nominatim queries"""
     def test_profile(self):
@@ -1077,6 +1237,23 @@ class TestGeo(DataTestCase):
             },
         )
 
+    def test_admin_parallel(self):
+        """Test profiling administrative areas in multiple processes"""
+        with data('admins.csv', 'r') as data_fp:
+            serial = process_dataset(
+                data_fp,
+                geo_data=self.geo_data,
+                coverage=True,
+            )
+        with data('admins.csv', 'r') as data_fp:
+            parallel = process_dataset(
+                data_fp,
+                geo_data=datamart_geo.GeoData.get_local_cache_path(),
+                coverage=True,
+                workers=2,
+            )
+        self.assertEqual(parallel, serial)
+
     def test_admin_ambiguous(self):
         """Test the resolution of ambiguous administrative areas"""
         def countries(areas):
@@ -1404,6 +1581,37 @@ class TestGeoHash(unittest.TestCase):
             [('', 4)],
         )
 
+    def test_sketch_points_array(self):
+        rng = numpy.random.RandomState(2)
+        points = numpy.concatenate([
+            rng.normal((40.7, -74.0), 0.5, size=(300, 2)),
+            rng.normal((48.9, 2.3), 0.01, size=(100, 2)),
+            [(0.0, 0.0), (-45.0, 90.0), (90.0, 180.0)],
+        ])
+        self.assertEqual(
+            [
+                spatial.GEOHASH_CHARS[(int(h) >> (5 * (11 - i))) & 31]
+                for h in spatial.hash_locations(points[:3], precision=12)
+                for i in range(12)
+            ],
+            [
+                c
+                for point in points[:3]
+                for c in spatial.hash_location(tuple(point), precision=12)
+            ],
+        )
+
+        for number in (1, 3, 20, 500):
+            # All at once
+            builder = spatial.Geohasher(number=number)
+            builder.add_points(points)
+            # One by one
+            reference = spatial.Geohasher(number=number)
+            for point in points:
+                reference.add_points([tuple(point)])
+            self.assertEqual(builder.precision, reference.precision)
+            self.assertEqual(builder.get_hashes(), reference.get_hashes())
+
     def test_sketch_aab(self):
         builder = spatial.Geohasher(
             base=4,
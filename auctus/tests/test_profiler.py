@@ -0,0 +1,234 @@
+import elasticsearch
+import numpy as np
+import opentelemetry.baggage
+import opentelemetry.context
+import opentelemetry.propagate
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import profiler
+from profiler import ProfileCache, ProfileGate
+
+
+class TestProfileGate(unittest.TestCase):
+    def run_profiles(self, gate, amounts, delay=0.2):
+        """Reserve the amounts in threads, started in order.
+
+        Returns the order in which they got in, and the most that ran at once.
+        """
+        lock = threading.Lock()
+        entered = []
+        running = [0, 0]
+
+        def profile(i, amount):
+            with gate.reserve(amount):
+                with lock:
+                    entered.append(i)
+                    running[0] += 1
+                    running[1] = max(running)
+                time.sleep(delay)
+                with lock:
+                    running[0] -= 1
+
+        threads = []
+        for i, amount in enumerate(amounts):
+            thread = threading.Thread(target=profile, args=(i, amount))
+            thread.start()
+            threads.append(thread)
+            # Make sure they queue up in order
+            time.sleep(0.02)
+        for thread in threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(gate._running, 0)
+        self.assertEqual(gate._reserved, 0)
+        self.assertEqual(len(gate._waiting), 0)
+        return entered, running[1]
+
+    def test_concurrent(self):
+        """Limit the number of profiles running at once"""
+        gate = ProfileGate(2)
+        entered, max_running = self.run_profiles(gate, [1, 1, 1, 1, 1])
+        self.assertEqual(entered, [0, 1, 2, 3, 4])
+        self.assertEqual(max_running, 2)
+
+    def test_memory(self):
+        """Limit the memory reserved by the profiles running at once"""
+        gate = ProfileGate(4, 100)
+        entered, max_running = self.run_profiles(gate, [60, 60, 30, 30])
+        self.assertEqual(entered, [0, 1, 2, 3])
+        self.assertEqual(max_running, 2)
+
+    def test_too_big(self):
+        """Let a profile bigger than the memory limit run alone"""
+        gate = ProfileGate(4, 100)
+        entered, max_running = self.run_profiles(gate, [10, 500, 10])
+        self.assertEqual(entered, [0, 1, 2])
+        self.assertEqual(max_running, 1)
+
+    def test_order(self):
+        """Small profiles don't get ahead of a waiting big one"""
+        gate = ProfileGate(4, 100)
+        entered, max_running = self.run_profiles(
+            gate, [50, 80, 10, 10], delay=0.3,
+        )
+        self.assertEqual(entered, [0, 1, 2, 3])
+        self.assertEqual(max_running, 3)
+
+    def test_error(self):
+        """Release the reservation if the profile fails"""
+        gate = ProfileGate(1, 100)
+        with self.assertRaises(ValueError):
+            with gate.reserve(50):
+                raise ValueError
+        self.assertEqual(gate._running, 0)
+        self.assertEqual(gate._reserved, 0)
+        with gate.reserve(100):
+            pass
+
+    def test_estimate(self):
+        """Estimate the memory from the size of the data"""
+        self.assertEqual(
+            ProfileGate.estimate_memory(0),
+            profiler.PROFILE_MEMORY_BASE,
+        )
+        self.assertEqual(
+            ProfileGate.estimate_memory(1000),
+            profiler.PROFILE_MEMORY_BASE
+            + 1000 * profiler.PROFILE_MEMORY_FACTOR,
+        )
+        # The profiler only loads a sample of big datasets
+        self.assertEqual(
+            ProfileGate.estimate_memory(profiler.PROFILE_MAX_SIZE * 10),
+            ProfileGate.estimate_memory(profiler.PROFILE_MAX_SIZE),
+        )
+
+
+class TestWorker(unittest.TestCase):
+    def test_context(self):
+        """Run functions in workers with the tracing context of the caller"""
+        token = opentelemetry.context.attach(
+            opentelemetry.baggage.set_baggage('dataset', 'test-dataset'),
+        )
+        try:
+            carrier = {}
+            opentelemetry.propagate.inject(carrier)
+        finally:
+            opentelemetry.context.detach(token)
+
+        self.assertIsNone(opentelemetry.baggage.get_baggage('dataset'))
+        self.assertEqual(
+            profiler._run_in_worker(
+                carrier, opentelemetry.baggage.get_baggage, ('dataset',),
+            ),
+            'test-dataset',
+        )
+        self.assertIsNone(opentelemetry.baggage.get_baggage('dataset'))
+
+
+class TestProfileCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix='datamart_profiler_')
+        self.cache_dir = os.path.join(self.tmp, 'cache')
+        os.mkdir(self.cache_dir)
+        self.es = mock.Mock()
+        self.cache = ProfileCache(self.es, self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def write_data(self, name, contents):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w') as fp:
+            fp.write(contents)
+        return path
+
+    def test_key(self):
+        """The key only changes with the data, metadata, and options"""
+        path = self.write_data('data.csv', 'a,b\n1,2\n')
+        metadata = {'name': 'Test', 'source': 'test', 'size': 8}
+        key = self.cache.key('test.one', metadata, path, None, object())
+
+        # Stable for the same data, even at another path or in another order
+        copy = self.write_data('copy.csv', 'a,b\n1,2\n')
+        self.assertEqual(
+            ProfileCache(self.es, self.cache_dir).key(
+                'test.one',
+                {'size': 8, 'source': 'test', 'name': 'Test'},
+                copy,
+                None,
+                object(),
+            ),
+            key,
+        )
+        self.assertTrue(key.startswith('test.one_'))
+
+        # Changes when anything that affects the profile does
+        other = self.write_data('other.csv', 'a,b\n1,3\n')
+        with mock.patch.dict(os.environ, {'DATAMART_VERSION': 'other'}):
+            other_version = self.cache.key(
+                'test.one', metadata, path, None, object(),
+            )
+        self.assertEqual(
+            len({
+                key,
+                self.cache.key('test.two', metadata, path, None, object()),
+                self.cache.key('test.one', metadata, other, None, object()),
+                self.cache.key(
+                    'test.one', dict(metadata, name='Other'), path,
+                    None, object(),
+                ),
+                self.cache.key(
+                    'test.one', metadata, path, 'http://nominatim', object(),
+                ),
+                self.cache.key('test.one', metadata, path, None, None),
+                other_version,
+            }),
+            7,
+        )
+
+    def test_get(self):
+        """Entries are only used if they are what is indexed"""
+        metadata = {
+            'name': 'Test',
+            'nb_rows': np.int64(2),
+            'columns': [{'name': 'a', 'mean': np.float64(1.5)}],
+        }
+        indexed = {
+            'id': 'test.one',
+            'name': 'Test',
+            'nb_rows': 2,
+            'columns': [{'name': 'a', 'mean': 1.5}],
+        }
+
+        # Missing
+        self.assertIsNone(self.cache.get('key', 'test.one'))
+        self.es.get.assert_not_called()
+
+        # Hit, after converting numpy types like Elasticsearch does
+        self.cache.set('key', metadata)
+        self.es.get.return_value = {'_source': indexed}
+        self.assertEqual(
+            self.cache.get('key', 'test.one'),
+            {
+                'name': 'Test',
+                'nb_rows': 2,
+                'columns': [{'name': 'a', 'mean': 1.5}],
+            },
+        )
+        self.es.get.assert_called_with('datasets', 'test.one')
+
+        # Stale, a different profile was indexed since
+        self.es.get.return_value = {
+            '_source': dict(indexed, nb_rows=3),
+        }
+        self.assertIsNone(self.cache.get('key', 'test.one'))
+
+        # Stale, not in the index anymore
+        self.es.get.side_effect = elasticsearch.NotFoundError(404, 'not found')
+        self.assertIsNone(self.cache.get('key', 'test.one'))
@@ -368,3 +368,102 @@ class TestAugmentation(DataTestCase):
             0.38,
             places=2,
         )
+
+    def test_join_batched(self):
+        """Test that join search batches its requests"""
+        data_profile = {
+            'columns': [
+                {
+                    'name': 'number',
+                    'structural_type': 'http://schema.org/Integer',
+                    'semantic_types': [],
+                    'coverage': [
+                        {'range': {'gte': 1.0, 'lte': 5.0}},
+                    ],
+                },
+                {
+                    'name': 'name',
+                    'structural_type': 'http://schema.org/Text',
+                    'semantic_types': [],
+                    'lazo': {
+                        'n_permutations': 2,
+                        'hash_values': [1, 2],
+                        'cardinality': 10,
+                    },
+                },
+                {
+                    'name': 'country',
+                    'structural_type': 'http://schema.org/Text',
+                    'semantic_types': [],
+                    'lazo': {
+                        'n_permutations': 2,
+                        'hash_values': [3, 4],
+                        'cardinality': 10,
+                    },
+                },
+            ],
+        }
+        es = mock.Mock()
+        es.msearch.return_value = [
+            {'hits': {'hits': [
+                {
+                    '_score': 0.5,
+                    '_source': {
+                        'dataset_id': 'numbers',
+                        'name': 'num',
+                        'index': 1,
+                    },
+                },
+            ]}},
+        ]
+        es.mget.side_effect = [
+            # Column names for Lazo results
+            {
+                'names': {'_source': {
+                    'columns': [{'name': 'x'}, {'name': 'first'}],
+                }},
+                'countries': {'_source': {
+                    'columns': [{'name': 'country'}],
+                }},
+            },
+            # Metadata of results
+            {
+                dt: {'_source': {'id': dt}}
+                for dt in ('numbers', 'names', 'countries')
+            },
+        ]
+        lazo_client = mock.Mock()
+        lazo_client.query_lazo_sketch_data.side_effect = [
+            [('names', 'first', 0.9), ('missing', 'a', 0.1)],
+            [('countries', 'country', 0.7)],
+        ]
+
+        results = join.get_joinable_datasets(es, lazo_client, data_profile)
+
+        self.assertEqual(len(es.msearch.call_args_list), 1)
+        self.assertEqual(len(es.mget.call_args_list), 2)
+        self.assertEqual(
+            set(es.mget.call_args_list[0][0][1]),
+            {'names', 'missing', 'countries'},
+        )
+        self.assertEqual(
+            set(es.mget.call_args_list[1][0][1]),
+            {'numbers', 'names', 'countries'},
+        )
+        es.get.assert_not_called()
+        es.search.assert_not_called()
+        self.assertEqual(
+            [
+                (
+                    r['id'], r['score'],
+                    r['augmentation']['left_columns'],
+                    r['augmentation']['right_columns'],
+                )
+                for r in results
+            ],
+            [
+                ('names', 0.9, [[1]], [[1]]),
+                ('countries', 0.7, [[2]], [[0]]),
+                ('numbers', 0.5, [[0]], [[1]]),
+            ],
+        )